@@ -0,0 +1,144 @@
+"""
+按相关性聚类自动构建ETF标的池
+
+流程：
+1. 候选ETF：etf_list.csv（含成交额）或 industry_df2.csv（只有代码和名称，流动性由行情数据的成交额计算）
+2. 流动性过滤：日均成交额不低于 min_turnover，没有成交额数据的ETF不入选
+3. 用日收益率相关性做层次聚类（相关性距离 1 - 相关系数 不超过 threshold 的归为一簇），
+   指定 window 时只用最近 window 个交易日的滚动相关性（相关性分析.RollingCorrelation）
+4. 每簇选一个代表：成交额最大的ETF
+5. 结果写入 JSON 文件（默认 etf_pool.json），策略在 initialize 中读取
+   （PTrade 中需把文件上传到研究目录，见 ETF轮动策略V2.py 的 load_etf_pool）
+
+行情数据为长表：date、code、close，可选 money（成交额）列，
+与 相关性分析.py 使用的 market_data*.csv 格式一致。
+"""
+
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from 相关性分析 import to_returns, compute_correlation, cluster_correlation, RollingCorrelation
+
+
+def to_platform_code(code):
+    """把6位代码或 .SH 后缀的代码转换为平台代码（.SS/.SZ）"""
+    code = str(code).strip()
+    if '.' in code:
+        symbol, suffix = code.split('.', 1)
+        return symbol + '.' + {'SH': 'SS', 'XSHG': 'SS', 'XSHE': 'SZ'}.get(suffix.upper(), suffix.upper())
+    code = code.zfill(6)
+    # 沪市ETF代码以5开头，深市以1开头
+    return code + ('.SS' if code.startswith('5') else '.SZ')
+
+
+def load_candidates(list_path):
+    """
+    读取候选ETF列表，返回 DataFrame[code, name, turnover]
+    etf_list.csv 的成交额作为流动性；industry_df2.csv 没有成交额，turnover 为NaN
+    """
+    df = pd.read_csv(list_path, dtype=str, encoding='utf-8-sig')
+    if '代码' in df.columns:
+        result = pd.DataFrame({
+            'code': df['代码'].map(to_platform_code),
+            'name': df['名称'],
+            'turnover': pd.to_numeric(df['成交额'], errors='coerce'),
+        })
+    else:
+        result = pd.DataFrame({
+            'code': df['ts_code'].map(to_platform_code),
+            'name': df['name'],
+            'turnover': np.nan,
+        })
+    return result.drop_duplicates('code').reset_index(drop=True)
+
+
+def load_price_history(price_path):
+    """读取长表行情数据，第一列为日期（与 相关性分析.py 的示例数据一致）"""
+    df = pd.read_csv(price_path)
+    if 'date' not in df.columns:
+        df.rename(columns={df.columns[0]: 'date'}, inplace=True)
+    df['date'] = pd.to_datetime(df['date'])
+    return df
+
+
+def build_pool(candidates, price_history, min_turnover=5e7, threshold=0.3, min_days=60, exclude=(), window=None):
+    """
+    构建标的池，返回按成交额降序的 DataFrame[code, name, turnover, cluster, members]
+    - 行情数据有 money 列时，用其日均值代替列表中的成交额；成交额缺失的ETF视为流动性不足
+    - 有效行情不足 min_days 天的ETF不参与
+    - exclude 中的代码（如已手工维护的宽基池）不参与
+    - window 不为空时按最近 window 个交易日的滚动相关性聚类，否则用全部历史
+    """
+    price_wide = price_history.pivot_table(index='date', columns='code', values='close').sort_index()
+    candidates = candidates[candidates['code'].isin(price_wide.columns) & ~candidates['code'].isin(exclude)].copy()
+    if 'money' in price_history.columns:
+        avg_money = price_history.groupby('code')['money'].mean()
+        candidates['turnover'] = candidates['code'].map(avg_money)
+
+    # 流动性过滤（成交额为NaN的比较结果为False，不入选）
+    no_turnover = candidates['turnover'].isna().sum()
+    if no_turnover:
+        print(f"{no_turnover}只ETF没有成交额数据，按流动性不足剔除")
+    candidates = candidates[candidates['turnover'] >= min_turnover]
+    days = price_wide[candidates['code']].notna().sum()
+    candidates = candidates[candidates['code'].map(days) >= min_days].reset_index(drop=True)
+    if candidates.empty:
+        return candidates.assign(cluster=[], members=[])
+    print(f"流动性和数据长度过滤后剩余{len(candidates)}只ETF")
+
+    codes = candidates['code'].tolist()
+    if window:
+        tracker = RollingCorrelation.from_price_wide(price_wide[codes], window=window,
+                                                     min_periods=min(min_days, window), top_n=0)
+        corr = tracker.matrix()
+    else:
+        corr = compute_correlation(to_returns(price_wide[codes].values), min_periods=min_days)
+    _, labels = cluster_correlation(corr, threshold)
+    candidates['cluster'] = labels
+
+    # 每簇选成交额最大的ETF作为代表（成交额相同时取簇内平均相关性最高的，即最能代表该簇的）
+    with np.errstate(invalid='ignore'):
+        avg_corr = np.nanmean(np.where(np.isfinite(corr), corr, np.nan), axis=1)
+    candidates['avg_corr'] = avg_corr
+    rows = []
+    for label, group in candidates.groupby('cluster'):
+        best = group.sort_values(['turnover', 'avg_corr'], ascending=False).iloc[0]
+        rows.append({
+            'code': best['code'],
+            'name': best['name'],
+            'turnover': float(best['turnover']),
+            'cluster': int(label),
+            'members': group['code'].tolist(),
+        })
+    pool = pd.DataFrame(rows)
+    return pool.sort_values('turnover', ascending=False).reset_index(drop=True)
+
+
+def save_pool(pool, path, **params):
+    """写入JSON缓存：生成时间、参数和标的池"""
+    data = {
+        'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'params': params,
+        'pool': pool.to_dict(orient='records'),
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    print(f"标的池已保存到: {path}，共{len(pool)}只")
+
+
+if __name__ == "__main__":
+    data_dir = os.path.join('.', 'test', 'data')
+    candidates = load_candidates(os.path.join(data_dir, 'etf_list.csv'))
+    price_history = load_price_history(os.path.join(data_dir, 'market_data20241013-20251013.csv'))
+
+    params = {'min_turnover': 5e7, 'threshold': 0.3, 'min_days': 60, 'window': 120}
+    pool = build_pool(candidates, price_history, **params)
+    print(pool[['code', 'name', 'turnover', 'cluster', 'members']].to_string())
+    # 生成的标的池写入缓存目录（不纳入版本库），上传到研究目录后策略读取
+    cache_dir = os.path.join('.', 'test', 'cache')
+    os.makedirs(cache_dir, exist_ok=True)
+    save_pool(pool, os.path.join(cache_dir, 'etf_pool.json'), **params)
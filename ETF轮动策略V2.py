@@ -4,6 +4,29 @@ from datetime import datetime, timedelta  # Python标准日期时间库
 from scipy import stats     # 科学计算统计模块
 from sklearn.metrics import r2_score  # 机器学习评估指标
 import time
+import json
+import os
+from 市场环境 import RegimeCache  # 需将 市场环境.py 上传至研究目录
+from 持仓快照 import PositionSnapshot  # 需将 持仓快照.py 上传至研究目录
+import 策略性能监控 as perf  # 需将 策略性能监控.py 上传至研究目录
+
+# 读取研究目录中的聚类标的池，文件不存在或读取失败时使用手工维护的默认池
+def load_etf_pool(file_name, default, exclude=()):
+    try:
+        path = os.path.join(get_research_path(), file_name)
+        if not os.path.exists(path):
+            return default
+        with open(path, 'r', encoding='utf-8') as f:
+            codes = [item['code'] for item in json.load(f)['pool']]
+        codes = [code for code in codes if code not in exclude]
+        if codes:
+            log.info(f"载入聚类标的池 {file_name}：{codes}")
+            return codes
+    except Exception as e:
+        log.warning(f"读取聚类标的池失败，使用默认标的池: {e}")
+    return default
+
+
 # 初始化策略
 def initialize(context):
     # run_daily(context, ETF轮动策略, time='10:30')
@@ -33,13 +56,20 @@ def initialize(context):
         '162719.SZ',  # 石油LO     
         '159851.SZ'  # 金融科技 
     ]
+    # 有 ETF池构建.py 生成的聚类标的池时用其代替手工行业池（宽基池不变）
+    g.etf_pool_file = 'etf_pool.json'
+    g.a_industry = load_etf_pool(g.etf_pool_file, g.a_industry, exclude=g.broadIndexFund)
     
     g.allFunds = g.broadIndexFund+g.a_industry
     g.symbols = g.broadIndexFund
     # 状态变量
     g.positions = {}  # 当前持仓
     g.last_buy_prices = {}  # 买入价格记录
-    g.stop_loss_list = []
+    g.stop_loss_list = set()  # 当日止损标的（集合，O(1) 成员判断）
+    g.position_snapshot = PositionSnapshot()  # 每个tick的持仓快照
+    # 上证指数均线排列状态，按日追加缓存，用于切换标的池
+    g.regime_index = '000001.SS'
+    g.regimes = RegimeCache(['ma_alignment'])
     # # 设置基准和股票池
     # set_benchmark(g.symbols[0])
     # set_universe(g.symbols)
@@ -56,13 +86,20 @@ def initialize(context):
     # # 设置成交数量限制模式
         set_limit_mode(limit_mode='UNLIMITED')
 
+    # 性能监控开关：研究目录下有 perf_enable 文件（或环境变量 STRATEGY_PERF=1）时开启，
+    # 记录 handle_data、打分与 get_price/get_positions 等接口的耗时，收盘后输出汇总
+    perf.configure(globals(), flag_dir=get_research_path(), logger=log)
+
     print("pd.__version__: {}".format(pd.__version__)) 
 
    
+@perf.timed('handle_data', slowest=5)
 def handle_data(context, data):
     # log.info("###crrent returns = %s "%(context.portfolio.portfolio_value))
     # 获取当前时间
     current_time = context.blotter.current_dt.strftime('%H:%M')
+    # 新tick开始，持仓快照失效
+    g.position_snapshot.begin_tick(get_positions)
     
     # 检查止损
     stop_loss_list = check_stop_loss(context,  data)
@@ -153,6 +190,7 @@ def buy_stocks(context, data, market_data, target_list):
                                 raise ValueError(f"调用 order_target_value 买入时，未能获取 order_id")
                             else:
                                 g.buy_list.append(order_id)
+                                g.position_snapshot.on_order(symbol)  # 持仓数量以成交回报为准
                                 buyInfo = '开仓买入{}，金额：{:.2f}'.format(symbol, target_value)
                                 log.info(buyInfo)
                                 g.last_buy_prices[symbol] = limit_price
@@ -165,9 +203,7 @@ def buy_stocks(context, data, market_data, target_list):
             raise e               
 def get_current_positions_list():
     try:
-        holdings = get_positions()
-        holding_list = [holdings[p].sid for p in holdings if holdings[p].amount > 0 and holdings[p].sid in g.allFunds]
-        return holding_list
+        return g.position_snapshot.held_list(g.allFunds)
     except Exception as e:
         log.error("获取当前持仓列表失败: %s" % str(e))
         raise e
@@ -220,7 +256,8 @@ def clear_holdings(stock_list_to_cleared, data):
                 raise ValueError(f"调用 order_target_value 清仓时，未能获取 order_id")
             else:
                 g.sell_list.append(order_id)
-                g.stop_loss_list.append(symbol) # 记录止损标的
+                g.position_snapshot.on_order(symbol, 0)
+                g.stop_loss_list.add(symbol) # 记录止损标的
                 sellInfo = f"卖出{symbol} 订单号 {order_id}\n"
                 log.info(sellInfo)
                 if symbol in g.last_buy_prices: # 删除买入价记录
@@ -264,16 +301,42 @@ def getPrices():
         raise e
     return None
     
+# 更新指数收盘价（截至上一交易日）到状态缓存：已有缓存只追加新K线，缺口过大时重新加载
+def update_regime(security):
+    try:
+        end_date_str = get_trading_day(0).strftime('%Y%m%d')
+        last_date = g.regimes.last_date(security)
+        count = g.regimes.lookback if last_date is None else 5
+        hist_data = get_price(security=security, end_date=end_date_str, frequency='1d',
+                              fields=['close'], count=count, fq='pre')
+        if hist_data is None or hist_data.empty:
+            log.warning(f"{security} 行情数据为空，市场状态未更新")
+            return
+        if last_date is not None and hist_data.index[0] > last_date:
+            hist_data = get_price(security=security, end_date=end_date_str, frequency='1d',
+                                  fields=['close'], count=g.regimes.lookback, fq='pre')
+            last_date = None
+        if last_date is None:
+            g.regimes.load(security, hist_data.index, hist_data['close'].values)
+            return
+        for date, close in zip(hist_data.index, hist_data['close'].values):
+            if date >= last_date:
+                g.regimes.append(security, date, close)
+    except Exception as e:
+        log.error(f"市场状态更新失败：{str(e)}")
+
+
 def prepare_symbols():
-    sh_result = is_maX_above_maY('000001.SS', 10, 20)
-    # log.info(f"相对关系 {sh_result}")
-    if sh_result is not None and sh_result==False:
+    update_regime(g.regime_index)
+    regime = g.regimes.label(g.regime_index, 'ma_alignment')
+    log.info(f"{g.regime_index} 均线排列状态: {regime}")
+    if regime == 'Weak':
         print("弱势行情10<20, 控制风险，只操作宽基")
         # 只保留宽基标的池
         g.symbols = g.broadIndexFund
         g.score_threshold = 1  # 在下行趋势的时候加这个条件
         g.stop_loss_pct=0.05
-    if is_maX_above_maY('000001.SS', 10, 20) and is_maX_above_maY('000001.SS', 20, 30)and is_maX_above_maY('000001.SS', 5, 10):
+    if regime == 'Strong':
         print("强势行情 5>10>20>30，继续交易")
         # 合并行业标的池
         g.symbols = g.symbols + g.a_industry
@@ -285,81 +348,17 @@ def prepare_symbols():
     print(f"当前标的池: {g.symbols}, g.stop_loss_pct={g.stop_loss_pct}, g.score_threshold={g.score_threshold}") 
     
     
-def is_maX_above_maY(security, x_days, y_days):
-    """
-    判断指定标的的X日均线是否在Y日均线上方（结合get_trading_day接口规范）
-    """
-    try:
-        # 1. 参数校验
-        if not (isinstance(x_days, int) and isinstance(y_days, int) and x_days > 0 and y_days > 0):
-            log.error(f"参数错误：均线天数必须为正整数（X={x_days}, Y={y_days}）")
-            return None
-        
-        max_days = max(x_days, y_days)
-        # log.info(f"计算 {security} 的 {x_days}日/{y_days}日均线关系")
-        
-        # 2. 交易日期处理（严格遵循get_trading_day接口文档）
-        # 根据文档：day=0表示当前交易日（非交易日则返回下一交易日）
-        current_trading_day = get_trading_day(0)
-        # 转换为get_price接口要求的'YYYYMMDD'格式字符串
-        end_date_str = current_trading_day.strftime('%Y%m%d')
-        # log.info(f"当前交易日：{current_trading_day}，转换为接口日期格式：{end_date_str}")
-        
-        # 3. 调用get_price接口（参数组合符合文档要求）
-        hist_data = get_price(
-            security=security,
-            end_date=end_date_str,
-            frequency='1d',
-            fields=['close'],
-            count=max_days,  # 与end_date组合使用，不传入start_date
-            fq='pre'
-        )
-        
-        # 4. 数据有效性检查
-        if hist_data is None:
-            log.warning(f"接口返回空数据，可能标的代码错误或非交易日")
-            return None
-            
-        if not isinstance(hist_data, pd.DataFrame) or hist_data.empty:
-            log.warning(f"返回数据格式错误或为空")
-            return None
-            
-        if 'close' not in hist_data.columns:
-            log.warning(f"返回数据不包含'close'字段")
-            return None
-            
-        # 文档说明get_price返回数据不包括当天，因此实际获取的是end_date前的count个交易日数据
-        if len(hist_data) < max_days:
-            log.warning(f"数据量不足：需要{max_days}个交易日，实际获取{len(hist_data)}个")
-            return None
-        
-        # 5. 计算均线并判断
-        ma_x = hist_data['close'].iloc[-x_days:].mean()
-        ma_y = hist_data['close'].iloc[-y_days:].mean()
-        
-        log.info(f"{x_days}日均线：{ma_x:.2f}，{y_days}日均线：{ma_y:.2f}")
-        return ma_x > ma_y
-    
-    except TypeError as e:
-        log.error(f"类型错误：{str(e)}")
-        return None
-    except KeyError as e:
-        log.error(f"数据字段错误：{str(e)}")
-        return None
-    except Exception as e:
-        log.error(f"均线判断失败：{str(e)}")
-        return None
-
-        
 def after_trading_end(context, data):
 
     # try catch the exception
     # to avoid the error stop the whole strategy
     try:
         print("盘后清空止损列表")
-        g.stop_loss_list = []
+        g.stop_loss_list = set()
         g.sell_list=[]
         g.buy_list = []
+        g.position_snapshot.end_day()
+        perf.dump_summary(log)
         
         log.info("盘后打印持仓信息")
         # print_holding_details(context, data)
@@ -385,6 +384,7 @@ def after_trading_end(context, data):
         log.error("after_trading_end error: %s" % str(e))
         return
     
+@perf.timed('calculate_etf_scores')
 def calculate_etf_scores(market_data, lookback_window=63):
     """计算ETF评分"""
     log.info(f"lookback_window={lookback_window}")
@@ -462,30 +462,25 @@ def calculate_etf_scores(market_data, lookback_window=63):
 
 def check_stop_loss(context, data):
     """检查止损条件"""
-    # 获取当前持仓
-    holdings = get_positions()
-    
-    holding_list = [holdings[p].sid for p in holdings if holdings[p].amount > 0 and holdings[p].sid in g.allFunds]
-    # print(f"当前持仓列表: {holding_list}")
     # log.info("检查止损条件")
     stop_loss_list = []
-    for symbol, position in holdings.items():
-        # log.info(f"当前symbol = {symbol};  当前持仓{position}")
-        if position.amount > 0 and position.sid in g.last_buy_prices:
+    for symbol in g.position_snapshot.held_list(include_open=False):
+        # log.info(f"当前symbol = {symbol};  当前持仓{g.position_snapshot.amount(symbol)}")
+        if symbol in g.last_buy_prices:
             current_price = data[symbol]['close']
             # log.info(f"当前价格 = {current_price}")
             if current_price > 0:
-                buy_price = g.last_buy_prices[position.sid] # 修复止损问题
+                buy_price = g.last_buy_prices[symbol] # 修复止损问题
                 # log.info(f"上次买入价格 {buy_price}, 止损比例 {g.stop_loss_pct}, 止損價格：{buy_price * (1 - g.stop_loss_pct)} ")
                 if (current_price < buy_price * (1 - g.stop_loss_pct)) :
-                    stop_loss_list.append(position.sid)
+                    stop_loss_list.append(symbol)
                     print('{}触发止损，买入价：{:.2f}，当前价：{:.2f}，止损比例：{:.2%}'.format(
-                        position.sid, buy_price, current_price, g.stop_loss_pct))
-                if position.sid not in g.symbols:
-                    stop_loss_list.append(position.sid)
+                        symbol, buy_price, current_price, g.stop_loss_pct))
+                if symbol not in g.symbols:
+                    stop_loss_list.append(symbol)
                     print("{position.sid} 被清理出持仓池 {g.symbols} 止损")
             else:
-                print('警告：无法获取{}的市场数据'.format(position.sid))
+                print('警告：无法获取{}的市场数据'.format(symbol))
     return stop_loss_list
 def risk_management(market_data, symbol):
     """
@@ -542,5 +537,19 @@ def risk_management(market_data, symbol):
 
     # 无异常则返回满仓系数
     return 1.0
-    
- 
\ No newline at end of file
+
+
+def on_order_response(context, order_list):
+    """委托回报：已成、撤单、废单时清除未完成委托，撤单、废单后按查询结果重新同步持仓快照"""
+    for order_info in order_list:
+        g.position_snapshot.on_order_status(order_info.get('stock_code'), str(order_info.get('status')))
+
+
+def on_trade_response(context, trade_list):
+    """成交回报：同步更新持仓快照（entrust_bs：'1'买入，'2'卖出）"""
+    for trade_info in trade_list:
+        g.position_snapshot.on_trade(
+            trade_info.get('stock_code'),
+            trade_info.get('business_amount', 0),
+            str(trade_info.get('entrust_bs')) == '1'
+        )
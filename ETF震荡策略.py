@@ -1,11 +1,144 @@
+import io
 import numpy as np
-import datetime
+
+import 策略性能监控 as perf  # 需将 策略性能监控.py 上传至研究目录
 
 """
 ETF RSI震荡交易策略：使用特定ETF列表交易
 整合了RSI和支撑压力位的交易逻辑，高效版本
 """
 
+
+# 盘中成交量滑动窗口长度（当前分钟 + 之前19分钟）
+VOL_WINDOW = 20
+
+# 每只ETF的交易状态字段，浮点字段用NaN表示“尚无数据”，日期用NaT表示
+ETF_STATE_DTYPE = np.dtype([
+    ('hold_position', np.bool_),
+    ('can_buy', np.bool_),
+    ('bullish', np.bool_),
+    ('entry_price', np.float64),
+    ('entry_date', 'datetime64[D]'),
+    ('today_open', np.float64),
+    ('today_low', np.float64),
+    ('day_high_price', np.float64),
+    ('vol_avg', np.float64),
+    ('max_profit_pct', np.float64),
+    ('cooling_days_left', np.int16),
+    ('price_count', np.int32),
+    ('vol_count', np.int32),
+    ('vol_window', np.float64, (VOL_WINDOW,)),
+])
+
+
+class ETFStateStore(object):
+    """
+    按ETF保存交易状态的结构化数组（struct-of-arrays）
+    - 代码到行号的映射保证单只ETF的O(1)访问，row()返回可直接读写的行视图
+    - 冷静期递减、每日重置都是整列的向量化运算
+    - pickle时序列化为紧凑的npz字节串，随g对象一起在重启后恢复
+    """
+
+    def __init__(self, symbols=()):
+        self.symbols = []
+        self.index = {}
+        self.state = np.zeros(0, dtype=ETF_STATE_DTYPE)
+        self.add(symbols)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __contains__(self, symbol):
+        return symbol in self.index
+
+    @staticmethod
+    def _blank_rows(n):
+        rows = np.zeros(n, dtype=ETF_STATE_DTYPE)
+        rows['can_buy'] = True
+        rows['entry_date'] = np.datetime64('NaT')
+        for field in ('today_open', 'today_low', 'vol_avg'):
+            rows[field] = np.nan
+        return rows
+
+    def add(self, symbols):
+        """新增ETF（已存在的忽略），新行为初始状态"""
+        new_symbols = [s for s in dict.fromkeys(symbols) if s not in self.index]
+        if not new_symbols:
+            return
+        start = len(self.symbols)
+        self.symbols.extend(new_symbols)
+        self.index.update((s, start + i) for i, s in enumerate(new_symbols))
+        self.state = np.concatenate([self.state, self._blank_rows(len(new_symbols))])
+
+    def remove(self, symbols):
+        """删除ETF并重建代码到行号的映射"""
+        drop = set(symbols) & set(self.index)
+        if not drop:
+            return
+        keep = np.array([s not in drop for s in self.symbols], dtype=bool)
+        self.symbols = [s for s in self.symbols if s not in drop]
+        self.index = {s: i for i, s in enumerate(self.symbols)}
+        self.state = self.state[keep]
+
+    def row(self, symbol):
+        """返回单只ETF的行视图，对其字段赋值会直接写回数组"""
+        return self.state[self.index[symbol]]
+
+    def start_new_day(self):
+        """盘前：冷静期整列递减并刷新可买标记，同时重置当日盘中数据"""
+        cooling = self.state['cooling_days_left']
+        in_cooling = cooling > 0
+        cooling[in_cooling] -= 1
+        self.state['can_buy'] = ~in_cooling
+
+        for field in ('today_open', 'today_low', 'vol_avg'):
+            self.state[field] = np.nan
+        self.state['day_high_price'] = 0
+        self.state['price_count'] = 0
+        self.state['vol_count'] = 0
+        self.state['vol_window'] = 0
+
+    def push_tick(self, symbol, price, volume):
+        """记录一分钟行情：价格计数加一，成交量进入滑动窗口"""
+        stock_data = self.row(symbol)
+        stock_data['price_count'] += 1
+        if volume > 0:
+            window = stock_data['vol_window']
+            window[:-1] = window[1:]
+            window[-1] = volume
+            stock_data['vol_count'] += 1
+
+    def close_position(self, symbol, cooling_days):
+        """卖出后重置交易状态并进入冷静期"""
+        stock_data = self.row(symbol)
+        stock_data['cooling_days_left'] = cooling_days
+        stock_data['hold_position'] = False
+        stock_data['can_buy'] = False
+        stock_data['entry_price'] = 0
+        stock_data['max_profit_pct'] = 0
+
+    def dumps(self):
+        """序列化为压缩的npz字节串"""
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, symbols=np.array(self.symbols, dtype=str), state=self.state)
+        return buffer.getvalue()
+
+    @classmethod
+    def loads(cls, payload):
+        store = cls()
+        with np.load(io.BytesIO(payload)) as archive:
+            store.symbols = archive['symbols'].tolist()
+            store.state = archive['state'].astype(ETF_STATE_DTYPE)
+        store.index = {s: i for i, s in enumerate(store.symbols)}
+        return store
+
+    def __getstate__(self):
+        return {'payload': self.dumps()}
+
+    def __setstate__(self, state):
+        restored = self.loads(state['payload'])
+        self.__dict__.update(restored.__dict__)
+
 def initialize(context):
     # 使用固定ETF列表代替选股逻辑
     context.stock_list = [
@@ -68,8 +201,9 @@ def initialize(context):
     context.cooling_days_technical = 1
     context.cooling_days_profit = 2
     
-    # 初始化数据
-    context.stock_data = {}
+    # 初始化数据（交易状态放在g中，平台重启时随g序列化恢复）
+    if not hasattr(g, 'etf_state'):
+        g.etf_state = ETFStateStore()
     context.filtered_stocks = []
     
     # 缓存数据
@@ -79,7 +213,12 @@ def initialize(context):
     # 获取历史数据参数设置
     g.hist_fq = "dypre"
 
+    # 性能监控开关：研究目录下有 perf_enable 文件（或环境变量 STRATEGY_PERF=1）时开启，
+    # 记录 handle_data 与数据接口的耗时，收盘后输出汇总
+    perf.configure(globals(), flag_dir=get_research_path(), logger=log)
+
 
+@perf.timed('before_trading_start')
 def before_trading_start(context, data):
     """使用固定ETF列表代替选股逻辑"""
     current_date = get_trading_day()
@@ -98,47 +237,21 @@ def before_trading_start(context, data):
     log.info("固定ETF列表数量: {}".format(len(context.filtered_stocks)))
     
     # 处理已持有ETF
-    for stock in list(context.stock_data.keys()):
+    store = g.etf_state
+    stale_stocks = []
+    for stock in store.symbols:
         position = get_position(stock)
         has_position = position is not None and position.amount > 0
         
         if has_position and stock not in context.filtered_stocks:
             context.filtered_stocks.append(stock)
         elif not has_position and stock not in context.filtered_stocks:
-            del context.stock_data[stock]
-    
-    # 更新冷静期状态
-    for stock in context.filtered_stocks:
-        if stock not in context.stock_data:
-            context.stock_data[stock] = {
-                'hold_position': False,
-                'can_buy': True,
-                'entry_price': 0,
-                'entry_date': None,
-                'today_open': None,
-                'today_low': None,
-                'intraday_prices': [],
-                'intraday_volumes': [],
-                'day_high_price': 0,
-                'vol_avg': None,
-                'max_profit_pct': 0,
-                'cooling_days_left': 0
-            }
-        
-        # 检查冷静期
-        if context.stock_data[stock]['cooling_days_left'] > 0:
-            context.stock_data[stock]['cooling_days_left'] -= 1
-            context.stock_data[stock]['can_buy'] = False
-        else:
-            context.stock_data[stock]['can_buy'] = True
-        
-        # 重置当日数据
-        context.stock_data[stock]['today_open'] = None
-        context.stock_data[stock]['today_low'] = None
-        context.stock_data[stock]['intraday_prices'] = []
-        context.stock_data[stock]['intraday_volumes'] = []
-        context.stock_data[stock]['day_high_price'] = 0
-        context.stock_data[stock]['vol_avg'] = None
+            stale_stocks.append(stock)
+    store.remove(stale_stocks)
+    store.add(context.filtered_stocks)
+    
+    # 更新冷静期状态并重置当日数据
+    store.start_new_day()
 
 
 # 判断是否在尾盘10分钟
@@ -218,50 +331,29 @@ def is_price_breaking_resistance(current_price, resistance):
     return resistance is not None and current_price > resistance
 
 
-# 优化版本：检查价格是否处于"盘中冲高"状态
-def is_intraday_price_surging(current_price, stock_data, context):
-    if len(stock_data['intraday_prices']) < 30:
-        return False
-    
-    # 更新当日最低价和最高价
-    if stock_data['today_low'] is None or current_price < stock_data['today_low']:
-        stock_data['today_low'] = current_price
-    
-    if current_price > stock_data['day_high_price']:
-        stock_data['day_high_price'] = current_price
-    
-    # 快速计算涨幅
-    open_surge_pct = 0 if stock_data['today_open'] is None else (current_price / stock_data['today_open'] - 1)
-    low_surge_pct = 0 if stock_data['today_low'] is None else (current_price / stock_data['today_low'] - 1)
-    entry_surge_pct = 0 if stock_data['entry_price'] == 0 else (current_price / stock_data['entry_price'] - 1)
-    
-    # 条件检查
-    condition1 = open_surge_pct >= context.intraday_high_pct
-    condition2 = low_surge_pct >= context.min_high_pct
-    condition3 = entry_surge_pct >= context.entry_high_pct
-    
-    # 成交量检查
-    condition4 = False
-    if len(stock_data['intraday_volumes']) > 20:
-        avg_volume = np.mean(stock_data['intraday_volumes'][-20:-1])
-        current_vol = stock_data['intraday_volumes'][-1]
-        condition4 = current_vol > avg_volume * context.vol_surge_ratio
-    
-    # 满足至少3个条件
-    return sum([condition1, condition2, condition3, condition4]) >= 3
+# 批量版本：一次判断全部持仓ETF是否处于"盘中冲高"状态
+def intraday_surge_mask(prices, day_opens, day_lows, entry_prices, current_vols, avg_vols, ready, context):
+    """
+    所有参数为按持仓对齐的数组，NaN表示当日开盘价/最低价/均量尚无数据，入场价0表示未知
+    ready: 当日已积累足够分钟数据（>=30）的持仓
+    满足 开盘涨幅、低点涨幅、入场涨幅、放量 四个条件中至少3个时返回True
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        votes = ((np.where(np.isnan(day_opens), 0, prices / day_opens - 1) >= context.intraday_high_pct).astype(np.int8) +
+                 (np.where(np.isnan(day_lows), 0, prices / day_lows - 1) >= context.min_high_pct) +
+                 (np.where(entry_prices == 0, 0, prices / entry_prices - 1) >= context.entry_high_pct) +
+                 (current_vols > avg_vols * context.vol_surge_ratio))
+    return ready & (votes >= 3)
 
 
-# 优化版本：检查是否满足"缓慢涨幅"卖出条件
-def is_slow_rise_sell_condition(current_price, resistance, rsi, stock_data, context):
-    if stock_data['entry_price'] == 0:
-        return False
-    
-    profit_pct = (current_price / stock_data['entry_price'] - 1)
-    
-    # 快速条件检查
-    return (rsi > context.rsi_sell_base and 
-            is_price_breaking_resistance(current_price, resistance) and 
-            profit_pct >= context.slow_rise_pct)
+# 批量版本：检查是否满足"缓慢涨幅"卖出条件（压力位为NaN表示无压力位）
+def slow_rise_sell_mask(prices, resistances, rsis, entry_prices, context):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        profit_pct = np.where(entry_prices == 0, 0, prices / entry_prices - 1)
+        return ((entry_prices != 0) &
+                (rsis > context.rsi_sell_base) &
+                (prices > resistances) &
+                (profit_pct >= context.slow_rise_pct))
 
 
 # 获取持仓成本的安全方法
@@ -298,15 +390,31 @@ def adjust_rsi_threshold(current_price, support, resistance, context):
     return buy_threshold, sell_threshold
 
 
+# 批量版本：调整RSI阈值（支撑位/压力位为NaN表示不存在）
+def adjust_rsi_thresholds(prices, supports, resistances, context):
+    float_range = context.rsi_float_range
+    with np.errstate(invalid='ignore'):
+        support_proximity = (prices - supports) / prices
+        buy_adjust = np.where(np.isnan(supports), 0,
+                              np.trunc(float_range * (1 - support_proximity / context.price_threshold)))
+        breakout_strength = (prices - resistances) / resistances
+        sell_adjust = np.where(prices > resistances,
+                               np.minimum(np.trunc(float_range * np.minimum(breakout_strength * 10, 1)), float_range), 0)
+    buy_thresholds = context.rsi_buy_base + buy_adjust
+    sell_thresholds = np.minimum(context.rsi_sell_base + sell_adjust, 95)
+    return buy_thresholds, sell_thresholds
+
+
 # 优化后的每日收盘后处理函数
 def after_trading_end(context, data):
-    for stock in context.filtered_stocks:
-        # 直接设置看多信号
-        if stock in context.stock_data:
-            context.stock_data[stock]['market_signal'] = 'bullish'
+    # 直接设置看多信号
+    g.etf_state.state['bullish'] = True
+
+    perf.dump_summary(log)
 
 
 # 优化的主要处理函数
+@perf.timed('handle_data', slowest=5)
 def handle_data(context, data):
     current_time = context.current_dt
     is_tailend = is_last_10_minutes(current_time)
@@ -346,9 +454,9 @@ def handle_data(context, data):
                     current_price = price_data.iloc[-1]['close']
                 
                 # 获取交易状态数据
-                if stock not in context.stock_data:
+                if stock not in g.etf_state:
                     continue
-                stock_data = context.stock_data[stock]
+                stock_data = g.etf_state.row(stock)
                 
                 # 检查是否可买入
                 if not stock_data['can_buy']:
@@ -363,16 +471,17 @@ def handle_data(context, data):
                 high_data = hist_data['high'].values
                 low_data = hist_data['low'].values
                 
-                # 计算RSI
-                rsi6 = calc_rsi(close_data, context.rsi_short)
-                if rsi6 is None:
-                    continue
-                
-                # 寻找支撑位和压力位
-                support, resistance = find_support_resistance(close_data, high_data, low_data, context.support_period, context)
-                
-                # 调整RSI阈值
-                rsi_buy_threshold, _ = adjust_rsi_threshold(current_price, support, resistance, context)
+                with perf.timer('score_buy_signal'):
+                    # 计算RSI
+                    rsi6 = calc_rsi(close_data, context.rsi_short)
+                    if rsi6 is None:
+                        continue
+                    
+                    # 寻找支撑位和压力位
+                    support, resistance = find_support_resistance(close_data, high_data, low_data, context.support_period, context)
+                    
+                    # 调整RSI阈值
+                    rsi_buy_threshold, _ = adjust_rsi_threshold(current_price, support, resistance, context)
                 
                 # 检查RSI买入条件
                 if rsi6 < rsi_buy_threshold:
@@ -400,7 +509,7 @@ def handle_data(context, data):
                         # 更新交易状态
                         stock_data['hold_position'] = True
                         stock_data['entry_price'] = current_price
-                        stock_data['entry_date'] = current_time.strftime('%Y-%m-%d')
+                        stock_data['entry_date'] = np.datetime64(current_time.date())
                         
                         # 更新持仓计数
                         held_positions += 1
@@ -409,8 +518,11 @@ def handle_data(context, data):
     
     # 处理已持仓的ETF - 检查卖出条件
     held_stocks = [stock for stock, position in positions.items() if position.amount > 0]
+    store = g.etf_state
+    today = np.datetime64(current_time.date())
     
-    # 处理持仓ETF
+    # 第一步：逐只更新盘中状态并计算技术指标，结果收集为对齐的数组
+    sell_stocks, rows, prices, rsis, supports, resistances = [], [], [], [], [], []
     for stock in held_stocks:
         try:
             # 获取价格
@@ -425,47 +537,28 @@ def handle_data(context, data):
                 current_price = price_data['close'].iloc[-1]
                 current_volume = price_data['volume'].iloc[-1] if 'volume' in price_data else 0
             
-            # 获取持仓信息
-            position = positions[stock]
-            current_amount = position.amount
-            
             # 获取交易状态数据
-            if stock not in context.stock_data:
+            if stock not in store:
                 continue
-            stock_data = context.stock_data[stock]
+            stock_data = store.row(stock)
             
             # 更新价格数据
-            stock_data['intraday_prices'].append(current_price)
-            if current_volume > 0:
-                stock_data['intraday_volumes'].append(current_volume)
+            store.push_tick(stock, current_price, current_volume)
             
             # 更新开盘价
-            if stock_data['today_open'] is None and stock in data and hasattr(data[stock], 'open'):
+            if np.isnan(stock_data['today_open']) and stock in data and hasattr(data[stock], 'open'):
                 stock_data['today_open'] = data[stock].open
             
-            # 检查持仓成本和持仓天数
-            entry_price = stock_data['entry_price']
-            entry_date = stock_data['entry_date']
-            
             # 如果没有保存入场价，使用持仓的平均成本
-            if entry_price == 0:
-                entry_price = get_position_cost(position)
-                stock_data['entry_price'] = entry_price
+            if stock_data['entry_price'] == 0:
+                stock_data['entry_price'] = get_position_cost(positions[stock])
             
             # 如果没有保存入场日期，使用当前日期
-            if not entry_date:
-                entry_date = current_time.strftime('%Y-%m-%d')
-                stock_data['entry_date'] = entry_date
-            
-            # 计算持仓天数和盈亏
-            holding_days = 0
-            if entry_date:
-                entry_date_obj = datetime.datetime.strptime(entry_date, '%Y-%m-%d')
-                holding_days = (current_time.date() - entry_date_obj.date()).days
-            
-            profit_pct = (current_price / entry_price - 1) * 100
+            if np.isnat(stock_data['entry_date']):
+                stock_data['entry_date'] = today
             
             # 更新最大盈利
+            profit_pct = (current_price / stock_data['entry_price'] - 1) * 100
             if profit_pct > stock_data['max_profit_pct']:
                 stock_data['max_profit_pct'] = profit_pct
             
@@ -486,71 +579,78 @@ def handle_data(context, data):
             # 寻找支撑位和压力位
             support, resistance = find_support_resistance(close_data, high_data, low_data, context.support_period, context)
             
-            # 调整RSI阈值
-            _, rsi_sell_threshold = adjust_rsi_threshold(current_price, support, resistance, context)
-            
-            # 检查价格是否处于盘中冲高状态
-            is_price_surging = False
-            if len(stock_data['intraday_prices']) >= 30:
-                is_price_surging = is_intraday_price_surging(current_price, stock_data, context)
-            
-            # 检查是否满足缓慢涨幅卖出条件
-            is_slow_rise = is_slow_rise_sell_condition(current_price, resistance, rsi6, stock_data, context)
-            
-            # 检查卖出条件
-            sell_signal = False
-            sell_type = None
-            
-            # 卖出条件1：技术指标
-            if is_price_surging or rsi6 > rsi_sell_threshold or is_slow_rise:
-                sell_signal = True
-                sell_type = "technical"
-            
-            # 卖出条件2：止损 - 1.5%止损
-            elif profit_pct < -context.stop_loss_pct * 100:
-                sell_signal = True
-                sell_type = "stop_loss"
-            
-            # 卖出条件3：止盈回撤 - 5%盈利后回撤1%
-            elif (stock_data['max_profit_pct'] >= context.profit_target_pct * 100 and 
-                 (stock_data['max_profit_pct'] - profit_pct) >= context.profit_retreat_pct * 100):
-                sell_signal = True
-                sell_type = "profit_taking"
-            
-            # 卖出条件4：持仓超时
-            elif holding_days >= context.max_holding_days:
-                sell_signal = True
-                
-                sell_type = "timeout"
+            sell_stocks.append(stock)
+            rows.append(store.index[stock])
+            prices.append(current_price)
+            rsis.append(rsi6)
+            supports.append(np.nan if support is None else support)
+            resistances.append(np.nan if resistance is None else resistance)
+        except:
+            continue
+    
+    if not sell_stocks:
+        return
+    
+    # 第二步：全部持仓的卖出筛选一次完成
+    rows = np.array(rows)
+    prices = np.array(prices, dtype=np.float64)
+    rsis = np.array(rsis, dtype=np.float64)
+    supports = np.array(supports, dtype=np.float64)
+    resistances = np.array(resistances, dtype=np.float64)
+    state = store.state
+    
+    # 当日已积累30分钟以上数据的持仓才更新日内高低点并参与冲高判断
+    ready = state['price_count'][rows] >= 30
+    state['today_low'][rows] = np.where(ready, np.fmin(state['today_low'][rows], prices), state['today_low'][rows])
+    state['day_high_price'][rows] = np.where(ready, np.maximum(state['day_high_price'][rows], prices), state['day_high_price'][rows])
+    
+    vol_window = state['vol_window'][rows]
+    avg_vols = np.where(state['vol_count'][rows] > VOL_WINDOW, vol_window[:, :-1].mean(axis=1), np.nan)
+    entry_prices = state['entry_price'][rows]
+    
+    _, rsi_sell_thresholds = adjust_rsi_thresholds(prices, supports, resistances, context)
+    surging = intraday_surge_mask(prices, state['today_open'][rows], state['today_low'][rows], entry_prices,
+                                  vol_window[:, -1], avg_vols, ready, context)
+    slow_rise = slow_rise_sell_mask(prices, resistances, rsis, entry_prices, context)
+    
+    profit_pcts = (prices / entry_prices - 1) * 100
+    max_profit_pcts = state['max_profit_pct'][rows]
+    holding_days = (today - state['entry_date'][rows]).astype(np.int64)
+    
+    # 卖出条件按优先级：技术指标 > 止损 > 止盈回撤 > 持仓超时
+    sell_types = np.select(
+        [surging | (rsis > rsi_sell_thresholds) | slow_rise,
+         profit_pcts < -context.stop_loss_pct * 100,
+         (max_profit_pcts >= context.profit_target_pct * 100) &
+         (max_profit_pcts - profit_pcts >= context.profit_retreat_pct * 100),
+         holding_days >= context.max_holding_days],
+        ["technical", "stop_loss", "profit_taking", "timeout"],
+        default="")
+    
+    # 第三步：执行卖出
+    sell_reasons = {
+        "technical": "技术指标",
+        "stop_loss": "止损",
+        "profit_taking": "止盈回撤",
+        "timeout": "持仓时间超限"
+    }
+    for i in np.flatnonzero(sell_types != ""):
+        stock = sell_stocks[i]
+        sell_type = sell_types[i]
+        try:
+            current_amount = positions[stock].amount
+            log.info("卖出 {} - 原因: {}, 买价: {:.2f}, 卖价: {:.2f}, 数量: {}, 盈亏: {:.2f}%, 持仓天数: {}".format(
+                stock, sell_reasons.get(sell_type, "未知"), 
+                entry_prices[i], prices[i], current_amount,
+                profit_pcts[i], holding_days[i]))
             
             # 执行卖出
-            if sell_signal:
-                # 记录卖出原因
-                sell_reasons = {
-                    "technical": "技术指标",
-                    "stop_loss": "止损",
-                    "profit_taking": "止盈回撤",
-                    "timeout": "持仓时间超限"
-                }
-                
-                log.info("卖出 {} - 原因: {}, 买价: {:.2f}, 卖价: {:.2f}, 数量: {}, 盈亏: {:.2f}%, 持仓天数: {}".format(
-                    stock, sell_reasons.get(sell_type, "未知"), 
-                    entry_price, current_price, current_amount,
-                    profit_pct, holding_days))
-                
-                # 执行卖出
-                order(stock, -current_amount)
-                
-                # 设置冷静期
-                if sell_type == "profit_taking":
-                    stock_data['cooling_days_left'] = context.cooling_days_profit
-                else:
-                    stock_data['cooling_days_left'] = context.cooling_days_technical
-                
-                # 重置交易状态
-                stock_data['hold_position'] = False
-                stock_data['can_buy'] = False
-                stock_data['entry_price'] = 0
-                stock_data['max_profit_pct'] = 0
+            order(stock, -current_amount)
+            
+            # 设置冷静期并重置交易状态
+            if sell_type == "profit_taking":
+                store.close_position(stock, context.cooling_days_profit)
+            else:
+                store.close_position(stock, context.cooling_days_technical)
         except:
             continue
@@ -0,0 +1,448 @@
+"""
+ETF震荡策略 分钟级离线回放工具
+
+把本地保存的分钟K线按时间顺序喂给策略的 initialize / before_trading_start /
+handle_data / after_trading_end，平台 API（context、data、get_history、order、
+get_position 等）由本文件中的桩对象模拟。回放结束后输出每个 tick 的耗时分位数
+和各数据接口的调用次数，用于在部署前检查性能改动的效果。
+
+分钟数据格式（CSV）：datetime,code,open,high,low,close,volume
+没有分钟数据时，可用 synthesize_minute_bars() 从日线数据（如
+test/data/market_data20241013-20251013.csv）生成近似的分钟路径。
+"""
+
+import argparse
+import importlib.util
+import os
+import sys
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_STRATEGY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ETF震荡策略.py')
+
+# 每个交易日的分钟时间轴：09:31-11:30，13:01-15:00，共240根
+MINUTES_OF_DAY = (
+    [pd.Timedelta(hours=9, minutes=30) + pd.Timedelta(minutes=i) for i in range(1, 121)] +
+    [pd.Timedelta(hours=13) + pd.Timedelta(minutes=i) for i in range(1, 121)]
+)
+
+
+# ===================== 数据加载 =====================
+def load_minute_bars(csv_path):
+    """读取分钟K线，按时间和代码排序"""
+    bars = pd.read_csv(csv_path, parse_dates=['datetime'])
+    return bars.sort_values(['datetime', 'code']).reset_index(drop=True)
+
+
+def synthesize_minute_bars(daily_df, start_date=None, end_date=None):
+    """
+    用日线 OHLCV 生成近似分钟K线：价格沿 开→低→高→收（阳线为 开→低→高→收，
+    阴线为 开→高→低→收）线性插值，成交量平均分摊到240分钟。
+    daily_df 需包含 date、code、open、high、low、close、volume 列。
+    """
+    daily_df = daily_df.copy()
+    daily_df['date'] = pd.to_datetime(daily_df['date'])
+    if start_date is not None:
+        daily_df = daily_df[daily_df['date'] >= pd.to_datetime(start_date)]
+    if end_date is not None:
+        daily_df = daily_df[daily_df['date'] <= pd.to_datetime(end_date)]
+
+    n = len(MINUTES_OF_DAY)
+    # 四个锚点对应的分钟位置
+    anchors = np.array([0, n // 3, 2 * n // 3, n - 1])
+    steps = np.arange(n)
+    offsets = np.array(MINUTES_OF_DAY, dtype='timedelta64[ns]')
+
+    frames = []
+    for row in daily_df.itertuples(index=False):
+        if row.close >= row.open:
+            path = [row.open, row.low, row.high, row.close]
+        else:
+            path = [row.open, row.high, row.low, row.close]
+        prices = np.interp(steps, anchors, path)
+        frames.append(pd.DataFrame({
+            'datetime': np.datetime64(row.date, 'ns') + offsets,
+            'code': row.code,
+            'open': np.r_[row.open, prices[:-1]],
+            'high': prices,
+            'low': prices,
+            'close': prices,
+            'volume': np.full(n, row.volume / n),
+        }))
+    bars = pd.concat(frames, ignore_index=True)
+    # 每根分钟K线的高低点取开收两端
+    bars['high'] = bars[['open', 'close']].max(axis=1)
+    bars['low'] = bars[['open', 'close']].min(axis=1)
+    return bars.sort_values(['datetime', 'code']).reset_index(drop=True)
+
+
+# ===================== 平台对象桩 =====================
+class GlobalVars(object):
+    """模拟平台的全局变量 g"""
+    pass
+
+
+class ReplayLog(object):
+    """模拟平台 log，默认不输出，只计数"""
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.counts = Counter()
+
+    def _emit(self, level, msg, *args):
+        self.counts[level] += 1
+        if self.verbose:
+            print("[%s] %s" % (level, msg % args if args else msg))
+
+    def info(self, msg, *args):
+        self._emit('INFO', msg, *args)
+
+    def debug(self, msg, *args):
+        self._emit('DEBUG', msg, *args)
+
+    def warning(self, msg, *args):
+        self._emit('WARNING', msg, *args)
+
+    def error(self, msg, *args):
+        self._emit('ERROR', msg, *args)
+
+
+class Position(object):
+    def __init__(self, sid, amount=0, cost_basis=0.0, last_sale_price=0.0):
+        self.sid = sid
+        self.amount = amount
+        self.enable_amount = amount
+        self.cost_basis = cost_basis
+        self.last_sale_price = last_sale_price
+
+    @property
+    def avg_cost(self):
+        return self.cost_basis
+
+
+class Portfolio(object):
+    def __init__(self, cash):
+        self.cash = cash
+        self.positions = {}
+
+    @property
+    def positions_value(self):
+        return sum(p.amount * p.last_sale_price for p in self.positions.values())
+
+    @property
+    def total_value(self):
+        return self.cash + self.positions_value
+
+    portfolio_value = total_value
+
+
+class ReplayContext(object):
+    def __init__(self, cash):
+        self.portfolio = Portfolio(cash)
+        self.current_dt = None
+        self.previous_date = None
+
+
+class BarData(object):
+    """单个标的的分钟行情，同时支持属性和下标访问"""
+
+    def __init__(self, open, high, low, close, volume):
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.price = close
+        self.volume = volume
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+
+# ===================== 回放引擎 =====================
+class MinuteReplay(object):
+    """
+    分钟级回放：加载策略文件并把平台 API 桩注入其全局命名空间，
+    逐分钟调用 handle_data，记录耗时和数据接口调用次数。
+    """
+
+    def __init__(self, minute_bars, daily_bars=None, strategy_path=DEFAULT_STRATEGY, cash=1000000, verbose=False):
+        self.bars = minute_bars
+        self.daily_bars = daily_bars
+        self.strategy_path = strategy_path
+        self.log = ReplayLog(verbose)
+        self.context = ReplayContext(cash)
+        self.call_counts = Counter()
+        self.stub_seconds = 0.0
+        self.tick_seconds = []
+        self.tick_stub_seconds = []
+        self.orders = []
+        self.data = {}
+        self._prepare_history()
+        self.strategy = self._load_strategy()
+
+    # ---------- 数据准备 ----------
+    def _prepare_history(self):
+        bars = self.bars
+        bars['date'] = bars['datetime'].dt.normalize()
+        grouped = bars.groupby(['code', 'date'], sort=False)
+        # 当日截至每分钟的累计日线（用于 include=True 的当日未完成K线）
+        bars['day_open'] = grouped['open'].transform('first')
+        bars['day_high'] = grouped['high'].cummax()
+        bars['day_low'] = grouped['low'].cummin()
+        bars['day_volume'] = grouped['volume'].cumsum()
+
+        if self.daily_bars is not None:
+            # 外部日线用于回放区间之前的指标预热
+            daily = self.daily_bars[['date', 'code', 'open', 'high', 'low', 'close', 'volume']].copy()
+            daily['date'] = pd.to_datetime(daily['date']).dt.normalize()
+        else:
+            daily = grouped.agg(open=('open', 'first'), high=('high', 'max'), low=('low', 'min'),
+                                close=('close', 'last'), volume=('volume', 'sum')).reset_index()
+        daily['price'] = daily['close']
+        self.daily = {code: df.set_index('date').sort_index()
+                      for code, df in daily.groupby('code')}
+        self.minutes = {code: df.set_index('datetime')[['open', 'high', 'low', 'close', 'volume']]
+                        for code, df in bars.groupby('code')}
+        self.partial = {code: df.set_index('datetime')[['day_open', 'day_high', 'day_low', 'close', 'day_volume']]
+                        for code, df in bars.groupby('code')}
+
+    def _load_strategy(self):
+        # 策略所在目录加入搜索路径，使其能导入同目录的共享模块（如 策略性能监控）
+        strategy_dir = os.path.dirname(os.path.abspath(self.strategy_path))
+        if strategy_dir not in sys.path:
+            sys.path.insert(0, strategy_dir)
+        spec = importlib.util.spec_from_file_location('replay_strategy', self.strategy_path)
+        module = importlib.util.module_from_spec(spec)
+        module.__dict__.update(self._platform_api())
+        spec.loader.exec_module(module)
+        return module
+
+    # ---------- 平台 API 桩 ----------
+    def _counted(self, name, func):
+        def wrapper(*args, **kwargs):
+            self.call_counts[name] += 1
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.stub_seconds += time.perf_counter() - start
+        return wrapper
+
+    def _platform_api(self):
+        api = {
+            'get_history': self._get_history,
+            'get_price': self._get_price,
+            'get_position': self._get_position,
+            'get_positions': self._get_positions,
+            'order': self._order,
+            'order_target': self._order_target,
+            'order_value': self._order_value,
+            'order_target_value': self._order_target_value,
+            'get_trading_day': self._get_trading_day,
+            # 研究目录指向策略所在目录（放 perf_enable 文件同样可以开启性能监控）
+            'get_research_path': lambda: os.path.dirname(os.path.abspath(self.strategy_path)),
+            'set_universe': lambda *args, **kwargs: None,
+            'set_benchmark': lambda *args, **kwargs: None,
+            'set_commission': lambda *args, **kwargs: None,
+            'set_slippage': lambda *args, **kwargs: None,
+            'is_trade': lambda: False,
+        }
+        api = {name: self._counted(name, func) for name, func in api.items()}
+        api['g'] = GlobalVars()
+        api['log'] = self.log
+        return api
+
+    def _history_frame(self, code, count, frequency, fields, include):
+        now = self.context.current_dt
+        if frequency == '1d':
+            daily = self.daily.get(code)
+            if daily is None:
+                return pd.DataFrame(columns=fields)
+            today = now.normalize()
+            frame = daily.loc[:today - pd.Timedelta(days=1)].tail(count - 1 if include else count)
+            frame = frame[fields]
+            if include and now in self.partial[code].index:
+                row = self.partial[code].loc[now]
+                today_bar = {'open': row['day_open'], 'high': row['day_high'], 'low': row['day_low'],
+                             'close': row['close'], 'price': row['close'], 'volume': row['day_volume']}
+                frame = pd.concat([frame, pd.DataFrame([{f: today_bar[f] for f in fields}], index=[today])])
+            return frame
+        minutes = self.minutes.get(code)
+        if minutes is None:
+            return pd.DataFrame(columns=fields)
+        end = now if include else now - pd.Timedelta(minutes=1)
+        return minutes.loc[:end].tail(count)[[f if f != 'price' else 'close' for f in fields]]
+
+    def _get_history(self, count, frequency='1d', field=None, security_list=None, fq=None,
+                     include=False, fill='nan', is_dict=False):
+        fields = [field] if isinstance(field, str) else list(field or ['close'])
+        if isinstance(security_list, str):
+            return self._history_frame(security_list, count, frequency, fields, include)
+        frames = []
+        for code in security_list or []:
+            frame = self._history_frame(code, count, frequency, fields, include)
+            frame.insert(0, 'code', code)
+            frames.append(frame)
+        return pd.concat(frames) if frames else pd.DataFrame(columns=['code'] + fields)
+
+    def _get_price(self, security, start_date=None, end_date=None, frequency='1d', fields=None, fq=None, count=None):
+        return self._get_history(count or 1, frequency, fields, security, fq)
+
+    def _get_position(self, stock):
+        return self.context.portfolio.positions.get(stock, Position(stock))
+
+    def _get_positions(self, security=None):
+        return dict(self.context.portfolio.positions)
+
+    def _get_trading_day(self, day=0):
+        return self.context.current_dt.date()
+
+    def _fill(self, stock, amount, limit_price=None):
+        bar = self.data.get(stock)
+        if bar is None or amount == 0:
+            return None
+        price = bar.close
+        portfolio = self.context.portfolio
+        position = portfolio.positions.get(stock)
+        if position is None:
+            position = portfolio.positions[stock] = Position(stock)
+        if amount > 0:
+            amount = min(amount, int(portfolio.cash / price / 100) * 100)
+            if amount <= 0:
+                return None
+            position.cost_basis = (position.cost_basis * position.amount + price * amount) / (position.amount + amount)
+        else:
+            amount = -min(-amount, position.amount)
+        position.amount += amount
+        position.enable_amount = position.amount
+        position.last_sale_price = price
+        portfolio.cash -= price * amount
+        if position.amount == 0:
+            del portfolio.positions[stock]
+        self.orders.append((self.context.current_dt, stock, amount, price))
+        return len(self.orders)
+
+    def _order(self, stock, amount, limit_price=None):
+        return self._fill(stock, amount, limit_price)
+
+    def _order_target(self, stock, amount, limit_price=None):
+        return self._fill(stock, amount - self._get_position(stock).amount, limit_price)
+
+    def _order_value(self, stock, value, limit_price=None):
+        bar = self.data.get(stock)
+        return self._fill(stock, int(value / bar.close / 100) * 100, limit_price) if bar else None
+
+    def _order_target_value(self, stock, value, limit_price=None):
+        bar = self.data.get(stock)
+        if bar is None:
+            return None
+        target = int(value / bar.close / 100) * 100
+        return self._fill(stock, target - self._get_position(stock).amount, limit_price)
+
+    # ---------- 回放主循环 ----------
+    def _mark_to_market(self):
+        for stock, position in self.context.portfolio.positions.items():
+            if stock in self.data:
+                position.last_sale_price = self.data[stock].close
+
+    def run(self):
+        strategy = self.strategy
+        context = self.context
+        days = self.bars['date'].unique()
+        context.current_dt = pd.Timestamp(days[0]) + pd.Timedelta(hours=9)
+        strategy.initialize(context)
+
+        by_minute = self.bars.groupby('datetime', sort=True)
+        minutes_by_day = defaultdict(list)
+        for dt, frame in by_minute:
+            minutes_by_day[dt.normalize()].append((dt, frame))
+
+        for day in sorted(minutes_by_day):
+            context.current_dt = day + pd.Timedelta(hours=9, minutes=15)
+            self.data = {}
+            if hasattr(strategy, 'before_trading_start'):
+                strategy.before_trading_start(context, self.data)
+
+            for dt, frame in minutes_by_day[day]:
+                context.current_dt = dt
+                self.data = {row.code: BarData(row.open, row.high, row.low, row.close, row.volume)
+                             for row in frame.itertuples(index=False)}
+                self._mark_to_market()
+                stub_before = self.stub_seconds
+                start = time.perf_counter()
+                strategy.handle_data(context, self.data)
+                self.tick_seconds.append(time.perf_counter() - start)
+                self.tick_stub_seconds.append(self.stub_seconds - stub_before)
+
+            context.current_dt = day + pd.Timedelta(hours=15, minutes=30)
+            if hasattr(strategy, 'after_trading_end'):
+                strategy.after_trading_end(context, self.data)
+            context.previous_date = day.date()
+        return self.report()
+
+    def report(self):
+        """汇总每个 tick 的耗时分位数（毫秒）和数据接口调用次数"""
+        ticks = np.array(self.tick_seconds) * 1000
+        strategy_only = ticks - np.array(self.tick_stub_seconds) * 1000
+        percentiles = [50, 90, 99]
+        summary = {
+            'ticks': len(ticks),
+            'latency_ms': dict(zip(['p50', 'p90', 'p99'], np.percentile(ticks, percentiles))) if len(ticks) else {},
+            'strategy_latency_ms': dict(zip(['p50', 'p90', 'p99'], np.percentile(strategy_only, percentiles))) if len(ticks) else {},
+            'max_ms': ticks.max() if len(ticks) else 0,
+            'call_counts': dict(self.call_counts),
+            'calls_per_tick': {k: v / max(len(ticks), 1) for k, v in self.call_counts.items()},
+            'orders': len(self.orders),
+            'final_value': self.context.portfolio.total_value,
+        }
+        return summary
+
+
+def print_report(summary):
+    print("=" * 60)
+    print(f"回放 tick 数: {summary['ticks']}，委托笔数: {summary['orders']}，期末总资产: {summary['final_value']:.2f}")
+    print("handle_data 耗时（含接口桩）: " +
+          ", ".join(f"{k}={v:.3f}ms" for k, v in summary['latency_ms'].items()) +
+          f", max={summary['max_ms']:.3f}ms")
+    print("handle_data 耗时（不含接口桩）: " +
+          ", ".join(f"{k}={v:.3f}ms" for k, v in summary['strategy_latency_ms'].items()))
+    print("-" * 60)
+    print(f"{'接口':<20}{'调用次数':>10}{'每tick':>10}")
+    for name, count in sorted(summary['call_counts'].items(), key=lambda x: -x[1]):
+        print(f"{name:<20}{count:>10}{summary['calls_per_tick'][name]:>10.2f}")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ETF震荡策略分钟级离线回放")
+    parser.add_argument('--minute-csv', help="分钟K线CSV（datetime,code,open,high,low,close,volume）")
+    parser.add_argument('--daily-csv', default='./test/data/market_data20241013-20251013.csv',
+                        help="日线CSV：提供回放区间之前的历史，无分钟数据时也用于合成分钟K线")
+    parser.add_argument('--start', default='2025-08-01')
+    parser.add_argument('--end', default='2025-08-31')
+    parser.add_argument('--strategy', default=DEFAULT_STRATEGY)
+    parser.add_argument('--verbose', action='store_true', help="输出策略日志")
+    parser.add_argument('--perf', action='store_true', help="启用 策略性能监控，收盘后输出每日耗时汇总")
+    args = parser.parse_args()
+
+    daily_df = None
+    if args.daily_csv:
+        daily_df = pd.read_csv(args.daily_csv)
+        daily_df.rename(columns={daily_df.columns[0]: 'date'}, inplace=True)
+
+    if args.minute_csv:
+        minute_bars = load_minute_bars(args.minute_csv)
+    else:
+        minute_bars = synthesize_minute_bars(daily_df, args.start, args.end)
+
+    replay = MinuteReplay(minute_bars, daily_bars=daily_df, strategy_path=args.strategy, verbose=args.verbose)
+    if args.perf:
+        import 策略性能监控 as perf
+        perf.enable()
+        # 只包装回放提供了桩的接口
+        names = [name for name in perf.DEFAULT_APIS if name in replay.strategy.__dict__]
+        perf.instrument_api(replay.strategy.__dict__, names, replay.log)
+    print_report(replay.run())
@@ -1,3 +1,10 @@
+import numpy as np
+
+from 成分股管理 import UniverseManager  # 需将 成分股管理.py 上传至研究目录
+
+import 策略性能监控 as perf  # 需将 策略性能监控.py 上传至研究目录
+
+
 # 初始化函数
 def initialize(context):
     # 设置全局变量
@@ -7,66 +14,213 @@ def initialize(context):
     g.short_period = 12  # 短期EMA天数
     g.long_period = 26  # 长期EMA天数
     g.signal_period = 9  # 信号线EMA天数
-    g.last_low = None  # 上一次低点价格
-    g.last_macd_low = None  # 上一次MACD低点
+    g.window_bars = 120  # 新股票预热及背离低点的K线窗口
+    g.incremental_bars = 8  # 增量更新时获取的K线数（需覆盖两次运行之间新增的K线）
+    # 按股票保存的EMA/MACD递推状态，随g跨交易日保存
+    if not hasattr(g, 'macd_state'):
+        g.macd_state = MacdStateStore(g.window_bars)
 
-    # g.stocks = get_index_stocks(g.index_code)  # 获取成分股列表
-    # set_universe(g.stocks)  # 设置股票池
+    # 成分股缓存：成员不变时不重复设置股票池，新加入的股票盘前预热MACD状态
+    # 随g持久化，重启后沿用：否则全部成分股都被当作新增，已保存的MACD状态会被重新预热覆盖
+    if not hasattr(g, 'universe'):
+        g.universe = UniverseManager()
 
     # 获取历史数据参数设置
     g.hist_fq = "dypre"
 
+    # 性能监控开关：研究目录下有 perf_enable 文件（或环境变量 STRATEGY_PERF=1）时开启
+    perf.configure(globals(), flag_dir=get_research_path(), logger=log)
+
     run_daily(context, exec_strategy, time="09:31")
     run_daily(context, exec_strategy, time="14:55")
 
 
 # 盘前事件
+@perf.timed('before_trading_start')
 def before_trading_start(context, data):
-    g.stocks = get_index_stocks(g.index_code)  # 获取成分股列表
-    set_universe(g.stocks)  # 设置股票池
-
-
+    g.universe.bind(get_index_stocks, set_universe, log, hooks=[on_universe_change])
+    g.stocks = g.universe.sync(g.index_code, context.current_dt.strftime("%Y%m%d"))
+
+
+# 成分股变化回调：重排MACD状态（剔除的股票随之删除），只预热新加入的股票
+def on_universe_change(added, removed):
+    stocks = g.universe.universe
+    state = g.macd_state
+    state.align(stocks)
+    if added:
+        warm_up_state(stocks, np.array([state.index[stock] for stock in added], dtype=int))
+
+
+class MacdStateStore(object):
+    """
+    按股票保存MACD递推状态（EMA12、EMA26、DEA、DIF、上一根DIF、最新收盘价、最后一根K线时间）
+    以及最近 window 根K线的最低价和MACD柱，用于计算背离低点
+    - 最低价和MACD柱按股票存放在环形缓冲区中，head 为每只股票下一根K线的写入行
+    - 已有状态的股票只把上次更新之后的新K线递推进去
+    - 新加入的股票用 window 根K线预热
+    - 所有运算按K线逐行、全部股票同时进行
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.stocks = []
+        self.index = {}
+        self.ema_short = np.zeros(0)
+        self.ema_long = np.zeros(0)
+        self.dea = np.zeros(0)
+        self.dif = np.zeros(0)
+        self.prev_dif = np.zeros(0)
+        self.last_close = np.zeros(0)
+        self.last_time = np.zeros(0, dtype='datetime64[ns]')
+        self.low_buf = np.zeros((window, 0))
+        self.macd_buf = np.zeros((window, 0))
+        self.head = np.zeros(0, dtype=int)
+
+    def align(self, stocks):
+        """按当前股票列表重排状态，新加入的股票状态为空"""
+        rows = np.array([self.index.get(stock, -1) for stock in stocks], dtype=int)
+        known = rows >= 0
+        for name in ('ema_short', 'ema_long', 'dea', 'dif', 'prev_dif', 'last_close'):
+            values = np.full(len(stocks), np.nan)
+            values[known] = getattr(self, name)[rows[known]]
+            setattr(self, name, values)
+        last_time = np.full(len(stocks), np.datetime64('NaT'), dtype='datetime64[ns]')
+        last_time[known] = self.last_time[rows[known]]
+        self.last_time = last_time
+        head = np.zeros(len(stocks), dtype=int)
+        head[known] = self.head[rows[known]]
+        self.head = head
+        for name in ('low_buf', 'macd_buf'):
+            values = np.full((self.window, len(stocks)), np.nan)
+            values[:, known] = getattr(self, name)[:, rows[known]]
+            setattr(self, name, values)
+        self.stocks = list(stocks)
+        self.index = {stock: i for i, stock in enumerate(stocks)}
+
+    def reset(self, cols):
+        for name in ('ema_short', 'ema_long', 'dea', 'dif', 'prev_dif', 'last_close'):
+            getattr(self, name)[cols] = np.nan
+        self.last_time[cols] = np.datetime64('NaT')
+        self.low_buf[:, cols] = np.nan
+        self.macd_buf[:, cols] = np.nan
+        self.head[cols] = 0
+
+    def fold(self, cols, times, close, low):
+        """
+        把 (K线 × 股票) 的新K线递推进状态，cols 为各列对应的股票下标
+        只处理时间晚于该股票最后一根K线的有效数据（等价于 ewm(span, adjust=False)）
+        """
+        a_short = 2.0 / (g.short_period + 1)
+        a_long = 2.0 / (g.long_period + 1)
+        a_signal = 2.0 / (g.signal_period + 1)
+        last_time = self.last_time[cols]
+        fresh = np.isfinite(close) & (np.isnat(last_time)[None, :] | (times[:, None] > last_time[None, :]))
+        for r in range(len(times)):
+            j = cols[fresh[r]]
+            if not len(j):
+                continue
+            x = close[r, fresh[r]]
+            started = ~np.isnan(self.ema_short[j])
+            ema_short = np.where(started, a_short * x + (1 - a_short) * self.ema_short[j], x)
+            ema_long = np.where(started, a_long * x + (1 - a_long) * self.ema_long[j], x)
+            dif = ema_short - ema_long
+            dea = np.where(started, a_signal * dif + (1 - a_signal) * self.dea[j], dif)
+
+            self.prev_dif[j] = self.dif[j]
+            self.ema_short[j], self.ema_long[j], self.dif[j], self.dea[j] = ema_short, ema_long, dif, dea
+            self.last_close[j] = x
+            self.last_time[j] = times[r]
+            # 写入环形缓冲区，覆盖每只股票最早的一根K线
+            head = self.head[j]
+            self.low_buf[head, j] = low[r, fresh[r]]
+            self.macd_buf[head, j] = 2 * (dif - dea)
+            self.head[j] = (head + 1) % self.window
+
+    def window_lows(self):
+        """窗口内的最低价和MACD最低值，无数据的股票为NaN（取最小值与环形缓冲区的起点无关）"""
+        lows = np.where(np.isnan(self.low_buf), np.inf, self.low_buf).min(axis=0)
+        macd_lows = np.where(np.isnan(self.macd_buf), np.inf, self.macd_buf).min(axis=0)
+        lows[np.isinf(lows)] = np.nan
+        macd_lows[np.isinf(macd_lows)] = np.nan
+        return lows, macd_lows
+
+
+def fetch_bars(stocks, count):
+    """批量获取60分钟K线，返回 (K线时间, 收盘价矩阵, 最低价矩阵)，列顺序与 stocks 一致"""
+    history_data = get_history(count, '60m', ['close', 'low'], security_list=stocks, fq=g.hist_fq, include=False)
+    wide = history_data.set_index('code', append=True)[['close', 'low']].unstack('code')
+    times = wide.index.values.astype('datetime64[ns]')
+    close = wide['close'].reindex(columns=stocks).values.astype(float)
+    low = wide['low'].reindex(columns=stocks).values.astype(float)
+    return times, close, low
+
+
+def update_macd_state(stocks):
+    """新股票预热，已有股票只递推新增K线；增量数据与上次状态不衔接的股票重新预热"""
+    state = g.macd_state
+    if state.stocks != stocks:
+        state.align(stocks)
+    empty = np.isnat(state.last_time)
+    warm_cols = list(np.flatnonzero(empty))
+    known_cols = np.flatnonzero(~empty)
+
+    if len(known_cols):
+        times, close, low = fetch_bars([stocks[i] for i in known_cols], g.incremental_bars)
+        # 获取到的最早K线仍晚于上次更新时间，说明中间有缺口
+        first_time = np.array([times[np.flatnonzero(np.isfinite(close[:, k]))[0]] if np.isfinite(close[:, k]).any()
+                               else np.datetime64('NaT') for k in range(len(known_cols))], dtype='datetime64[ns]')
+        gap = ~np.isnat(first_time) & (first_time > state.last_time[known_cols])
+        state.fold(known_cols[~gap], times, close[:, ~gap], low[:, ~gap])
+        warm_cols.extend(known_cols[gap])
+
+    if warm_cols:
+        warm_up_state(stocks, np.array(sorted(warm_cols), dtype=int))
+
+
+def warm_up_state(stocks, cols):
+    """清空 cols 对应股票的状态，用 window 根K线重新递推"""
+    state = g.macd_state
+    log.info("MACD状态预热 %d 只股票" % len(cols))
+    state.reset(cols)
+    times, close, low = fetch_bars([stocks[i] for i in cols], state.window)
+    state.fold(cols, times, close, low)
+
+
+@perf.timed('exec_strategy', slowest=5)
 def exec_strategy(context):
-    history_data = get_history(120, '60m', ['open', 'close', 'high', 'low'], security_list=g.stocks, fq=g.hist_fq, include=False)
-
-    for stock in g.stocks:
-        # 获取60分钟K线数据
-        df = history_data[history_data['code'].isin([stock])]
-
-        # 计算MACD指标
-        df['EMA12'] = df['close'].ewm(span=g.short_period, adjust=False).mean()
-        df['EMA26'] = df['close'].ewm(span=g.long_period, adjust=False).mean()
-        df['DIF'] = df['EMA12'] - df['EMA26']
-        df['DEA'] = df['DIF'].ewm(span=g.signal_period, adjust=False).mean()
-        df['MACD'] = 2 * (df['DIF'] - df['DEA'])
-
-        # 获取最新价格和MACD值
-        current_price = df['close'].iloc[-1]
-        current_macd = df['MACD'].iloc[-1]
-        current_dif = df['DIF'].iloc[-1]
-        previous_dif = df['DIF'].iloc[-2]
-        current_dea = df['DEA'].iloc[-1]
-
-        # 检查底背离
-        if g.last_low is not None and g.last_macd_low is not None:
-            if current_price < g.last_low and current_macd > g.last_macd_low:
-                # 价格创新低，但MACD不创新低，底背离
-                cash = context.portfolio.cash
-                if cash > 0:
-                    order_value(stock, cash)
-                    log.info("底背离买入 %s" % stock)
-
-        # 检查死叉
-        if previous_dif > current_dea and current_dif < current_dea:
-            # DIF线下穿DEA线，形成死叉
-            position = get_position(stock)
-            if position.amount > 0:
-                order_target(stock, 0)
-                log.info("死叉卖出 %s" % stock)
-
-        # 更新价格和MACD的低点
-        g.last_low = df['low'].min()
-        g.last_macd_low = df['MACD'].min()
+    stocks = list(g.stocks)
+    state = g.macd_state
+
+    # 上一次计算窗口内的低点（与该股票自身比较），新股票为NaN不产生信号
+    if state.stocks != stocks:
+        state.align(stocks)
+    last_low, last_macd_low = state.window_lows()
+    update_macd_state(stocks)
+
+    # 获取最新价格和MACD值
+    current_price = state.last_close
+    current_dif = state.dif
+    previous_dif = state.prev_dif
+    current_dea = state.dea
+    current_macd = 2 * (current_dif - current_dea)
+
+    with np.errstate(invalid='ignore'):
+        # 底背离：价格创新低，但MACD不创新低
+        divergence = (current_price < last_low) & (current_macd > last_macd_low)
+        # 死叉：DIF线下穿DEA线
+        death_cross = (previous_dif > current_dea) & (current_dif < current_dea)
+
+    for i in np.flatnonzero(divergence):
+        cash = context.portfolio.cash
+        if cash > 0:
+            order_value(stocks[i], cash)
+            log.info("底背离买入 %s" % stocks[i])
+
+    for i in np.flatnonzero(death_cross):
+        position = get_position(stocks[i])
+        if position.amount > 0:
+            order_target(stocks[i], 0)
+            log.info("死叉卖出 %s" % stocks[i])
 
 
 # 60分钟级别盘中事件
@@ -76,4 +230,4 @@ def handle_data(context, data):
 
 # 盘后事件
 def after_trading_end(context, data):
-    pass
\ No newline at end of file
+    perf.dump_summary(log)
\ No newline at end of file
@@ -1,6 +1,8 @@
 import pandas as pd
 import numpy as np
 
+from 持仓快照 import PositionSnapshot  # 需将 持仓快照.py 上传至研究目录
+
 def initialize(context):
     # ========== 1. 基础配置优化 ==========
     g.etf_list = list(dict.fromkeys([
@@ -59,175 +61,233 @@ def initialize(context):
     g.long_ma = 10  # 长期均线（10日线）
     g.rsi_rate = 0.5
     g.stop_loss_low_days = 5  # 新增：跌破N天最低价止损的周期（5天）
+    g.prior_lows = {}  # 前N-1个交易日最低价（盘前计算）
+    g.today_lows = {}  # 当日盘中最低价（分钟行情更新）
     set_universe(g.etf_list)  # 设置ETF池
     g.buy_price = {}  # 记录买入价格（用于止损）
+    g.position_snapshot = PositionSnapshot()  # 每个tick的持仓快照
     # 新增：标记当日是否已执行2:30的操作，避免重复执行
     g.executed_afternoon_task = False  
+    # 动态RSI周期的当日缓存：{ETF代码: 周期}
+    g.rsi_period_cache = {}
+    g.rsi_period_day = None
+    # RSI序列的tick级缓存
+    g.rsi_tick = None
+    g.rsi_daily_day = None
+    g.rsi_daily_closes = {}
+    g.rsi_closes = {}
+    g.rsi_values = {}
 
-# ========== 修复：动态计算RSI周期的核心方法（解决索引越界+类型错误） ==========
-def calculate_rsi_period(context, etf_code):
+# ========== 动态计算RSI周期：全部ETF批量计算，按交易日缓存 ==========
+def _period_from_crosses(closes, cross_idx, cross_up):
     """
-    动态计算RSI的period参数
-    核心修复：
-    1. 修正高低点索引计算逻辑，避免iloc越界
-    2. 增加索引有效性校验
-    3. 统一索引为从0开始的位置索引
+    根据单只ETF的均线交叉点计算RSI周期
+    closes: 收盘价数组；cross_idx: 交叉点位置（升序）；cross_up: 对应交叉是否为上穿
+    - 过去交叉次数<=3：震荡周期长，返回12
+    - 否则取最近3次交叉形成的两个区间：下穿→上穿取区间最低点，上穿→下穿取区间最高点，
+      周期为高低点之间的K线根数（至少为6）；无法形成高低点对时返回12
     """
+    recent_idx = cross_idx[-g.ma_cross_days:]
+    recent_up = cross_up[-g.ma_cross_days:]
+    if len(recent_idx) <= 3:
+        return 12
+
+    price_points = []  # (类型, 位置)
+    for i in range(len(recent_idx) - 3, len(recent_idx) - 1):
+        start_idx, end_idx = recent_idx[i], recent_idx[i + 1]
+        if start_idx >= end_idx:
+            continue
+        price_slice = closes[start_idx:end_idx + 1]
+        if not recent_up[i] and recent_up[i + 1]:
+            price_points.append(('low', start_idx + int(np.argmin(price_slice))))
+        elif recent_up[i] and not recent_up[i + 1]:
+            price_points.append(('high', start_idx + int(np.argmax(price_slice))))
+
+    if len(price_points) == 2 and price_points[0][0] != price_points[1][0]:
+        kline_distance = abs(price_points[0][1] - price_points[1][1])
+        return max(int(kline_distance), 6)
+    return 12
+
+
+def prepare_rsi_periods(context, etf_list=None):
+    """
+    一次批量获取全部ETF的日线，用符号变化数组识别5日/10日均线交叉，
+    计算每只ETF的动态RSI周期并缓存到当日（输入只使用已收盘的日线，当日内不变）
+    """
+    etf_list = g.etf_list if etf_list is None else etf_list
+    required = g.ma_cross_days + g.long_ma
+    periods = dict.fromkeys(etf_list, 12)
     try:
-        # 1. 获取足够的日线数据（40天+10天，确保均线计算完整）
         history_data = get_history(
-            count=g.ma_cross_days + g.long_ma,
+            count=required,
             frequency='1d',
             field='close',
-            security_list=etf_code,
-            include=True
+            security_list=etf_list,
+            include=False
         )
-        # 增加数据空值/长度双重校验
-        if history_data.empty or len(history_data) < g.ma_cross_days + g.long_ma:
-            log.info(f"{etf_code} 均线计算数据不足/为空，默认返回RSI周期12")
-            return 12
-        
-        close_series = history_data['close'].copy()
-        # 重置索引为从0开始的整数（关键：统一索引体系）
-        close_series = close_series.reset_index(drop=True)
-        total_length = len(close_series)  # 记录总长度，用于后续索引校验
-        
-        # 2. 计算5日和10日均线（处理空值）
-        ma5 = close_series.rolling(window=g.short_ma, min_periods=1).mean()
-        ma10 = close_series.rolling(window=g.long_ma, min_periods=1).mean()
-        
-        # 3. 识别均线交叉点（上穿/下穿）
-        ma_diff = ma5 - ma10
-        cross_points = []  # 存储交叉点：(索引, 类型) 类型：up=上穿，down=下穿
-        
-        # 过滤掉ma_diff为空的行
-        ma_diff_valid = ma_diff.dropna()
-        if len(ma_diff_valid) < 2:
-            log.info(f"{etf_code} 均线差值数据不足，默认返回RSI周期12")
-            return 12
-        
-        # 遍历有效差值，判断交叉（使用位置索引）
-        for i in range(1, len(ma_diff_valid)):
-            prev_diff = ma_diff_valid.iloc[i-1]
-            curr_diff = ma_diff_valid.iloc[i]
-            
-            # 上穿：前一天ma5<ma10，当天ma5≥ma10
-            if prev_diff < 0 and curr_diff >= 0:
-                cross_points.append((ma_diff_valid.index[i], 'up'))
-            # 下穿：前一天ma5>ma10，当天ma5≤ma10
-            elif prev_diff > 0 and curr_diff <= 0:
-                cross_points.append((ma_diff_valid.index[i], 'down'))
-        
-        # 4. 过滤过去40天内的交叉点（只保留最后40天的数据）
-        recent_cross_points = cross_points[-g.ma_cross_days:] if cross_points else []
-        cross_count = len(recent_cross_points)
-        
-        # 5. 根据交叉次数分支处理
-        if cross_count <= 3:
-            # log.info(f"{etf_code} 过去{g.ma_cross_days}天均线交叉次数为{cross_count}，震荡周期长，RSI周期设为12")
-            return 12
+        if history_data is None or history_data.empty:
+            log.info(f"均线计算数据为空，RSI周期默认12")
         else:
-            # 取最近3次交叉点
-            latest_3_cross = recent_cross_points[-3:]
-            price_points = []  # 存储高低点：(类型, 索引, 价格) 类型：low=低点，high=高点
-            
-            # 初始化数值类型变量
-            total_kline_count = 0  # 存储高低点之间的K线根数总和
-            valid_pair_count = 0   # 有效高低点对数量
-            
-            for i in range(len(latest_3_cross)-1):
-                cross1_idx, cross1_type = latest_3_cross[i]
-                cross2_idx, cross2_type = latest_3_cross[i+1]
-                
-                # 确保索引为整数，且在合法范围内
-                start_idx = min(int(cross1_idx), int(cross2_idx))
-                end_idx = max(int(cross1_idx), int(cross2_idx))
-                
-                # 核心修复1：严格校验索引边界，防止越界
-                start_idx = max(0, start_idx)
-                end_idx = min(total_length - 1, end_idx)
-                
-                # 如果起始索引 >= 结束索引，跳过该区间
-                if start_idx >= end_idx:
-                    log.warning(f"{etf_code} 交叉点区间无效（start={start_idx}, end={end_idx}），跳过")
-                    continue
-                
-                # 确定价格区间：使用iloc切片（基于位置的索引）
-                price_slice = close_series.iloc[start_idx:end_idx+1]
-                if price_slice.empty or len(price_slice) < 2:
-                    continue
-                
-                # 提取高低点（核心修复2：使用位置索引，避免越界）
-                try:
-                    if cross1_type == 'down' and cross2_type == 'up':
-                        # 下穿→上穿：取区间最低点
-                        # 先获取最小值的位置（相对于切片的位置）
-                        low_pos = price_slice.argmin()  # 返回位置索引（0开始）
-                        # 转换为全局位置索引
-                        global_low_idx = start_idx + low_pos
-                        # 校验全局索引是否合法
-                        if 0 <= global_low_idx < total_length:
-                            low_price = price_slice.iloc[low_pos]
-                            price_points.append(('low', global_low_idx, low_price))
-                        else:
-                            log.warning(f"{etf_code} 低点全局索引{global_low_idx}越界（总长度{total_length}），跳过")
-                            continue
-                    
-                    elif cross1_type == 'up' and cross2_type == 'down':
-                        # 上穿→下穿：取区间最高点
-                        high_pos = price_slice.argmax()  # 返回位置索引（0开始）
-                        global_high_idx = start_idx + high_pos
-                        # 校验全局索引是否合法
-                        if 0 <= global_high_idx < total_length:
-                            high_price = price_slice.iloc[high_pos]
-                            price_points.append(('high', global_high_idx, high_price))
-                        else:
-                            log.warning(f"{etf_code} 高点全局索引{global_high_idx}越界（总长度{total_length}），跳过")
-                            continue
-                except Exception as inner_e:
-                    log.warning(f"{etf_code} 提取高低点异常：{str(inner_e)}，跳过该区间")
+            # (日期 × ETF) 收盘价矩阵
+            close_panel = history_data.set_index('code', append=True)['close'].unstack('code')
+            close_panel = close_panel.reindex(columns=etf_list).tail(required)
+            ma_diff = (close_panel.rolling(window=g.short_ma, min_periods=1).mean() -
+                       close_panel.rolling(window=g.long_ma, min_periods=1).mean()).values
+
+            # 上穿：前一天ma5<ma10，当天ma5≥ma10；下穿：前一天ma5>ma10，当天ma5≤ma10
+            prev_diff, curr_diff = ma_diff[:-1], ma_diff[1:]
+            cross_up = (prev_diff < 0) & (curr_diff >= 0)
+            cross_down = (prev_diff > 0) & (curr_diff <= 0)
+            crossed = cross_up | cross_down
+
+            closes = close_panel.values
+            complete = np.isfinite(closes).sum(axis=0) >= required
+            for col, etf in enumerate(etf_list):
+                if not complete[col]:
+                    log.info(f"{etf} 均线计算数据不足/为空，默认返回RSI周期12")
                     continue
-                
-                # 计算高低点对之间的K线根数（距离）
-                if len(price_points) >= 2:
-                    p1_type, p1_idx, _ = price_points[-2]
-                    p2_type, p2_idx, _ = price_points[-1]
-                    
-                    # 确保索引为整数且合法
-                    p1_idx_int = int(p1_idx) if isinstance(p1_idx, (int, np.integer)) else 0
-                    p2_idx_int = int(p2_idx) if isinstance(p2_idx, (int, np.integer)) else 0
-                    
-                    # 校验索引是否在合法范围
-                    if not (0 <= p1_idx_int < total_length and 0 <= p2_idx_int < total_length):
-                        log.warning(f"{etf_code} 高低点索引{p1_idx_int}/{p2_idx_int}越界，跳过")
-                        continue
-                    
-                    if (p1_type == 'low' and p2_type == 'high') or (p1_type == 'high' and p2_type == 'low'):
-                        # 计算两个点之间的K线根数（索引差值的绝对值）
-                        kline_distance = abs(p1_idx_int - p2_idx_int)
-                        if kline_distance >= 0:
-                            total_kline_count += kline_distance
-                            valid_pair_count += 1
-            
-            # 计算最终period（取K线根数的整数部分，至少为6，避免过小）
-            if valid_pair_count > 0:
-                avg_kline_distance = total_kline_count / valid_pair_count
-                period = max(int(round(avg_kline_distance)), 6)
-            else:
-                # 无有效高低点对，默认返回12
-                period = 12
-            
-            # log.info(f"{etf_code} 过去{g.ma_cross_days}天均线交叉次数为{cross_count}，计算得RSI周期为{period}（基于高低点K线根数）")
-            return period
+                cross_idx = np.flatnonzero(crossed[:, col])
+                periods[etf] = _period_from_crosses(closes[:, col], cross_idx + 1, cross_up[cross_idx, col])
     except Exception as e:
-        log.error(f"{etf_code} 计算RSI周期异常：{str(e)}，默认返回12")
-        return 12
+        log.error(f"批量计算RSI周期异常：{str(e)}，默认返回12")
+
+    g.rsi_period_cache.update(periods)
+    return periods
+
+
+def calculate_rsi_period(context, etf_code):
+    """动态RSI周期：每个交易日首次调用时批量计算全部ETF，之后直接读取缓存"""
+    today = context.current_dt.date()
+    if g.rsi_period_day != today:
+        g.rsi_period_cache = {}
+        g.rsi_period_day = today
+        prepare_rsi_periods(context)
+    if etf_code not in g.rsi_period_cache:
+        prepare_rsi_periods(context, [etf_code])
+    return g.rsi_period_cache[etf_code]
+
+# ========== RSI序列共享缓存：卖出检查与买入筛选共用一次批量取数 ==========
+def _refresh_rsi_closes(context):
+    """
+    每个tick只取一次数据：已收盘的60根日线按交易日缓存，
+    再批量拼接全部ETF的最新1分钟收盘价（修复未来函数问题）
+    """
+    if g.rsi_tick == context.current_dt:
+        return
+    today = context.current_dt.date()
+    if g.rsi_daily_day != today:
+        history_data = get_history(
+            count=60,  # 适配动态周期的数据源
+            frequency='1d',
+            field='close',
+            security_list=g.etf_list,
+            fq='pre',
+            include=False
+        )
+        if history_data is None or history_data.empty:
+            # 取数失败时不缓存，下一个tick重试；本tick没有RSI数据
+            log.info(f"RSI日线数据为空，下一个tick重试")
+            g.rsi_daily_closes = {}
+        else:
+            g.rsi_daily_closes = {code: df['close'].values for code, df in history_data.groupby('code')}
+            g.rsi_daily_day = today
+
+    latest_data = get_history(count=1, frequency='1m', field='close', security_list=g.etf_list, fq='pre', include=True)
+    latest_closes = {}
+    if latest_data is not None and not latest_data.empty:
+        latest_closes = {code: df['close'].values[-1:] for code, df in latest_data.groupby('code')}
+
+    g.rsi_closes = {}
+    for etf, daily_closes in g.rsi_daily_closes.items():
+        if etf in latest_closes:
+            g.rsi_closes[etf] = np.concatenate([daily_closes, latest_closes[etf]])
+        else:
+            g.rsi_closes[etf] = daily_closes
+    g.rsi_values = {}
+    g.rsi_tick = context.current_dt
+
+
+def get_rsi_closes(context, etf):
+    """当前tick的收盘价序列（60根日线 + 最新1分钟价）"""
+    _refresh_rsi_closes(context)
+    return g.rsi_closes.get(etf)
+
+
+def get_rsi_pair(context, etf, rsi_period):
+    """
+    返回当前tick的 (当前RSI, 前一期RSI)，数据不足时返回None
+    同一tick内相同ETF、相同周期只计算一次
+    """
+    _refresh_rsi_closes(context)
+    period = max(6, rsi_period * g.rsi_rate)
+    key = (etf, period)
+    if key not in g.rsi_values:
+        closes = g.rsi_closes.get(etf)
+        rsi_pair = None
+        if closes is not None:
+            # 传入动态计算的period计算RSI（使用ptrade原生API）
+            rsi_data = get_RSI(closes, period)
+            if rsi_data.size >= 2:
+                rsi_pair = (rsi_data[-1], rsi_data[-2])
+        g.rsi_values[key] = rsi_pair
+    return g.rsi_values[key]
+
+
+# ========== 跌破N天最低价止损：盘前缓存前N-1天最低价，盘中跟踪当日最低价 ==========
+def prepare_low_stops(context):
+    """盘前批量获取全部ETF前N-1个交易日的最低价，并清空当日最低价"""
+    g.prior_lows = {}
+    g.today_lows = {}
+    try:
+        history_data = get_history(
+            count=g.stop_loss_low_days - 1,
+            frequency='1d',
+            field='low',
+            security_list=g.etf_list,
+            include=False
+        )
+        if history_data is None or history_data.empty:
+            return
+        for etf, df in history_data.groupby('code'):
+            # 数据不足N-1天的ETF不做最低价止损
+            if len(df) >= g.stop_loss_low_days - 1:
+                g.prior_lows[etf] = df['low'].min()
+    except Exception as e:
+        log.error(f"获取{g.stop_loss_low_days}天最低价异常：{str(e)}")
+
+
+def update_today_lows(data):
+    """用分钟行情更新全部ETF的当日最低价，在止损检查之后调用，使当前分钟不参与本分钟的判断"""
+    for etf in g.etf_list:
+        if etf in data:
+            bar = data[etf]
+            low = bar.low if hasattr(bar, 'low') else bar.close
+            if low > 0 and low < g.today_lows.get(etf, float('inf')):
+                g.today_lows[etf] = low
+
+
+def get_n_day_low(etf):
+    """
+    过去N天最低价：前N-1天最低价与当日已完成分钟的最低价，不含当前分钟
+    （当前分钟的最低价不高于收盘价，计入后当前价永远不会跌破），数据不足时返回None
+    """
+    if etf not in g.prior_lows:
+        return None
+    return min(g.prior_lows[etf], g.today_lows.get(etf, float('inf')))
+
 
 def before_trading_start(context, data):
     # ========== 第一步：量化选股 ==========   
     # print(f"默认股票池：{g.etf_list}")
     # 每日开盘重置2:30任务执行标记
     g.executed_afternoon_task = False  
+    g.position_snapshot.end_day()
+    # 盘前批量计算当日的动态RSI周期
+    g.rsi_period_cache = {}
+    g.rsi_period_day = context.current_dt.date()
+    prepare_rsi_periods(context)
+    # 盘前缓存跌破N天最低价止损的价位
+    prepare_low_stops(context)
 
 # ========== 优化：增强版止损检查函数（新增跌破5天最低价止损） ==========
 def check_stop_loss(context, data):
@@ -239,8 +299,8 @@ def check_stop_loss(context, data):
     """
     for etf in g.etf_list:
         try:
-            position = get_position(etf)
-            if position and position.amount > 0:
+            # 有未完成委托时不重复下单，委托撤单、废单或超时后重新检查
+            if g.position_snapshot.held(etf) and not g.position_snapshot.open_order(etf):
                 # 获取当前价格
                 current_price = data[etf].close if etf in data else 0
                 if current_price <= 0:
@@ -259,33 +319,24 @@ def check_stop_loss(context, data):
                 
                 # ========== 新增逻辑：跌破过去5天最低价止损 ==========
                 if not stop_loss_triggered:  # 未触发亏损止损时，检查最低价止损
-                    # 获取过去N天的价格数据（包含low字段）
-                    history_data = get_history(
-                        count=g.stop_loss_low_days,
-                        frequency='1d',
-                        field=['close', 'low'],
-                        security_list=etf,
-                        include=True
-                    )
-                    if not history_data.empty and len(history_data) >= g.stop_loss_low_days:
-                        # 计算过去N天最低价
-                        past_n_days_low = history_data['low'].min()
-                        # 当前价格跌破过去N天最低价则止损
-                        # print(f"{etf} 当前价 {current_price}， 过去5日最低价 {past_n_days_low}")
-                        if current_price < past_n_days_low:
-                            stop_loss_triggered = True
-                            stop_loss_reason = f"跌破{g.stop_loss_low_days}天最低价（当前价{current_price:.4f} < {g.stop_loss_low_days}天最低价{past_n_days_low:.4f}）"
+                    past_n_days_low = get_n_day_low(etf)
+                    # 当前价格跌破过去N天最低价则止损
+                    if past_n_days_low is not None and current_price < past_n_days_low:
+                        stop_loss_triggered = True
+                        stop_loss_reason = f"跌破{g.stop_loss_low_days}天最低价（当前价{current_price:.4f} < {g.stop_loss_low_days}天最低价{past_n_days_low:.4f}）"
                 # ========== 执行RSI卖出检查 ==========
                 if not stop_loss_triggered:
                         rsi_period = calculate_rsi_period(context, etf)              
                         if check_rsi_sell(context, etf, rsi_period):
                             order_target(etf, 0)
+                            g.position_snapshot.on_order(etf, 0)
                             if etf in g.buy_price:
                                 del g.buy_price[etf]
                             # log.info(f"{context.current_dt.strftime('%Y-%m-%d %H:%M')} {etf} RSI下穿65 前值{previous_rsi:.2f} → 当前值{current_rsi:.2f}），执行卖出")
                 # ========== 执行止损操作 ==========
                 if stop_loss_triggered:
                     order_target(etf, 0)
+                    g.position_snapshot.on_order(etf, 0)
                     stop_loss_triggered = False
                     if etf in g.buy_price:
                         del g.buy_price[etf]  # 删除买入价格记录
@@ -298,28 +349,10 @@ def check_stop_loss(context, data):
 
 # 检查单个持仓标的RSI是否跌破卖出阈值
 def check_rsi_sell(context, etf, rsi_period):
-    history_data = get_history(
-        count=60,  # 适配动态周期的数据源
-        frequency='1d',  
-        field=['close'],
-        security_list=etf,
-        fq = 'pre',
-        include=False
-    )
-    latest_data = get_history(count=1,frequency='1m',field='close',security_list=etf,fq='pre',include=True)
-        
-    if latest_data is not None and not latest_data.empty:
-        
-        history_data = history_data.append(latest_data, ignore_index=False) # 修复未来函数问题
-    
-    # 传入动态计算的period计算RSI（使用ptrade原生API）
-    # rsi_data = get_RSI(history_data['close'], max(6, rsi_period*g.rsi_rate))
-    rsi_data = get_RSI(history_data['close'].values, max(6, rsi_period*g.rsi_rate))    
-    # if rsi_data.empty or len(rsi_data) < 2:
-    if rsi_data.size < 2:
+    rsi_pair = get_rsi_pair(context, etf, rsi_period)
+    if rsi_pair is None:
         return False
-    current_rsi = rsi_data[-1]
-    previous_rsi = rsi_data[-2]  # 获取前一期RSI值
+    current_rsi, previous_rsi = rsi_pair
     
     # 卖出条件：前一期RSI≥65，当前期RSI<65（下穿65）
     log.info(f"{context.current_dt.strftime('%Y-%m-%d %H:%M')} {etf} RSI{max(6, rsi_period*g.rsi_rate)}下穿{g.sell_threshold} 前值{previous_rsi:.2f} → 当前值{current_rsi:.2f}")
@@ -331,15 +364,15 @@ def check_rsi_sell(context, etf, rsi_period):
 def sell_target(context):
     for etf in g.etf_list:
         try:
-            position = get_position(etf)
-            if position and position.amount > 0:
+            if g.position_snapshot.held(etf) and not g.position_snapshot.open_order(etf):
                 # 动态计算当前ETF的RSI周期
                 rsi_period = calculate_rsi_period(context, etf)              
-                if check_rsi_sell(context, None, etf, rsi_period):
+                if check_rsi_sell(context, etf, rsi_period):
                     order_target(etf, 0)
+                    g.position_snapshot.on_order(etf, 0)
                     if etf in g.buy_price:
                         del g.buy_price[etf]
-                    log.info(f"{context.current_dt.strftime('%Y-%m-%d %H:%M')} {etf} RSI下穿65 前值{previous_rsi:.2f} → 当前值{current_rsi:.2f}），执行卖出")
+                    log.info(f"{context.current_dt.strftime('%Y-%m-%d %H:%M')} {etf} RSI下穿{g.sell_threshold}，执行卖出")
         except Exception as e:
             log.error(f"{etf} 卖出检查异常：{str(e)}")
             continue
@@ -362,37 +395,23 @@ def execute_afternoon_trading(context, data):
     candidate_etfs = []
     for etf in g.etf_list:
         try:
-            # 跳过已有持仓的ETF
-            position = get_position(etf)
-            if position and position.amount > 0:
+            # 跳过已有持仓或有未完成委托的ETF
+            if g.position_snapshot.held(etf) or g.position_snapshot.open_order(etf):
                 continue
             
             # 动态计算当前ETF的RSI周期
             rsi_period = calculate_rsi_period(context, etf)
             
-            # 获取足够的日线数据（动态RSI周期+动量周期）
-            history_data = get_history(
-                count=60,  # 适配动态周期的数据源
-                frequency='1d',  
-                field=['close'],
-                security_list=etf,
-                fq = 'pre',
-                include=False
-            )
-            latest_data = get_history(count=1,frequency='1m',field='close',security_list=etf,fq='pre',include=True)
-            if latest_data is not None and not latest_data.empty:  
-                history_data = history_data.append(latest_data, ignore_index=False) # 修复未来函数问题
-            
-            # 传入动态period计算RSI（使用ptrade原生API）
-            rsi_data = get_RSI(history_data['close'].values, max(6,rsi_period*g.rsi_rate))
-            if rsi_data.empty or len(rsi_data) < 2:
+            # 读取当前tick共享的RSI（与卖出检查共用一次取数和计算）
+            rsi_pair = get_rsi_pair(context, etf, rsi_period)
+            if rsi_pair is None:
                 continue
-            current_rsi = rsi_data.iloc[-1]
-            previous_rsi = rsi_data.iloc[-2]
+            current_rsi, previous_rsi = rsi_pair
+            close_series = get_rsi_closes(context, etf)
             
             # RSI上穿判断 + 最小动量过滤
             if (previous_rsi < g.buy_threshold and current_rsi >= g.buy_threshold):
-                momentum = close_series.iloc[-1] / close_series.iloc[-g.momentum_period] - 1
+                momentum = close_series[-1] / close_series[-g.momentum_period] - 1
                 # 过滤弱动量标的
                 if momentum >= g.min_momentum:
                     candidate_etfs.append((etf, momentum, rsi_period))
@@ -409,7 +428,7 @@ def execute_afternoon_trading(context, data):
         # 计算当前持仓数量
         current_hold_count = 0
         try:
-            current_hold_count = sum([1 for etf in g.etf_list if get_position(etf).amount > 0])
+            current_hold_count = len(g.position_snapshot.held_list(g.etf_list))
         except Exception as e:
             log.error(f"计算持仓数量异常：{str(e)}")
             current_hold_count = 0
@@ -432,10 +451,13 @@ def execute_afternoon_trading(context, data):
             for target_etf, target_momentum, rsi_period in target_etfs:
                 try:
                     # 确保无持仓才买入
-                    if get_position(target_etf).amount == 0 and per_etf_cash > 100:  # 最小买入金额过滤
+                    if (not g.position_snapshot.held(target_etf) and not g.position_snapshot.open_order(target_etf)
+                            and per_etf_cash > 100):  # 最小买入金额过滤
                         order_value(target_etf, per_etf_cash)
                         # 记录买入价格（用于止损）
                         g.buy_price[target_etf] = data[target_etf].close if target_etf in data else 0
+                        # 记为未完成的买入委托，持仓数量以成交回报为准
+                        g.position_snapshot.on_order(target_etf)
                         log.info(f"{context.current_dt.strftime('%Y-%m-%d %H:%M')} 买入 {target_etf}，金额: {per_etf_cash:.2f}，动量: {target_momentum:.4f}，动态RSI周期: {rsi_period}")
                 except Exception as e:
                     log.error(f"买入{target_etf}异常：{str(e)}")
@@ -450,11 +472,30 @@ def handle_data(context, data):
     # 获取当前时间
     current_dt = context.current_dt
     current_hour = current_dt.hour
+    # 新tick开始，持仓快照失效
+    g.position_snapshot.begin_tick(get_positions)
     current_minute = current_dt.minute
     
     # ========== 第二步：风控优先 - 止损检查（每分钟执行） ==========
     check_stop_loss(context, data)
+    update_today_lows(data)
     
     # ========== 第三步到第五步：下午2:30执行核心交易逻辑 ==========
     if current_hour == 14 and current_minute == 30:
-        execute_afternoon_trading(context, data)
\ No newline at end of file
+        execute_afternoon_trading(context, data)
+
+
+def on_order_response(context, order_list):
+    """委托回报：已成、撤单、废单时清除未完成委托，撤单、废单后按查询结果重新同步持仓快照"""
+    for order_info in order_list:
+        g.position_snapshot.on_order_status(order_info.get('stock_code'), str(order_info.get('status')))
+
+
+def on_trade_response(context, trade_list):
+    """成交回报：同步更新持仓快照（entrust_bs：'1'买入，'2'卖出）"""
+    for trade_info in trade_list:
+        g.position_snapshot.on_trade(
+            trade_info.get('stock_code'),
+            trade_info.get('business_amount', 0),
+            str(trade_info.get('entrust_bs')) == '1'
+        )
@@ -1,5 +1,11 @@
 # 中小板指100成分股均线突破策略（修正版）
 # from cmath import log
+import numpy as np
+
+from 成分股管理 import UniverseManager  # 需将 成分股管理.py 上传至研究目录
+from 向量化选股引擎 import Screener, MA, MAX, MIN, fields, build_panels  # 需将 向量化选股引擎.py 上传至研究目录
+
+import 策略性能监控 as perf  # 需将 策略性能监控.py 上传至研究目录
 
 
 def initialize(context):
@@ -15,34 +21,37 @@ def initialize(context):
     # 初始化持仓记录字典（关键修正：确保该变量被正确初始化）
     g.bought_stocks = {}  # 存储{股票代码: 买入日开盘价}
 
-    # 标记是否已获取股票池
-    g.stocks_initialized = False
+    # 成分股缓存：同一交易日只查询一次，成员不变时不重复设置股票池
+    if not hasattr(g, 'universe'):
+        g.universe = UniverseManager()
     # 股票池变量
     g.stocks = []
 
     # 获取历史数据参数设置
     g.hist_fq = "dypre"
 
+    # 性能监控开关：研究目录下有 perf_enable 文件（或环境变量 STRATEGY_PERF=1）时开启
+    perf.configure(globals(), flag_dir=get_research_path(), logger=log)
+
     run_daily(context, exec_strategy, time="09:31")
     run_daily(context, exec_strategy, time="14:55")
 
 
+@perf.timed('before_trading_start')
 def before_trading_start(context, data):
-    # 首先初始化股票池（修正：在第一个交易日获取成分股）
-    if not g.stocks_initialized:
-        g.stocks = get_index_stocks(g.index_code)  # 获取成分股列表
-        set_universe(g.stocks)  # 设置股票池
-        g.stocks_initialized = True
-        log.info("股票池初始化完成，共{}只股票".format(len(g.stocks)))
+    refresh_universe(context)
+
 
+def refresh_universe(context):
+    # 每日更新成分股；同一交易日重复调用直接返回缓存，成员变化时才重新设置股票池
+    g.universe.bind(get_index_stocks, set_universe, log)
+    g.stocks = g.universe.sync(g.index_code, context.current_dt.strftime("%Y%m%d"))
 
+
+@perf.timed('exec_strategy', slowest=5)
 def exec_strategy(context):
-    # 首先初始化股票池（修正：在第一个交易日获取成分股）
-    if not g.stocks_initialized:
-        g.stocks = get_index_stocks(g.index_code)  # 获取成分股列表
-        set_universe(g.stocks)  # 设置股票池
-        g.stocks_initialized = True
-        log.info("股票池初始化完成，共{}只股票".format(len(g.stocks)))
+    # 首先更新股票池（修正：盘前事件未执行时在此获取成分股）
+    refresh_universe(context)
 
     # 执行卖出逻辑
     sell_strategy(context, None)
@@ -55,91 +64,72 @@ def handle_data(context, data):
     pass
 
 
+def screen_buy_signals(history_data, stocks):
+    """
+    全部成分股一次完成"一阳穿三线"筛选，返回满足条件的股票列表（保持 stocks 顺序）：
+    最新一根K线开盘价低于5/13/21日均线、收盘价高于三条均线，且成交量大于15日均量的2倍
+    """
+    panels = build_panels(history_data, ['open', 'close', 'volume'], stocks)
+    buy_mask = build_screener().mask(panels)
+    today_open, today_close = panels['open'][-1], panels['close'][-1]
+    return [(stocks[i], today_open[i], today_close[i]) for i in np.flatnonzero(buy_mask)]
+
+
+def build_screener():
+    """一阳穿三线的选股条件"""
+    open_, close, volume = fields('open', 'close', 'volume')
+    mas = [MA(close, g.short_period), MA(close, g.mid_period), MA(close, g.long_period)]
+    return Screener({
+        'open_below': open_ < MIN(*mas),  # 开盘价低于所有均线
+        'close_above': close > MAX(*mas),  # 收盘价高于所有均线
+        'volume_up': volume > MA(volume, g.volume_period) * 2,  # 成交量放大（大于15天均量的2倍）
+    })
+
+
 def buy_strategy(context, data):
-    # 股票池未初始化则不执行买入
-    if not g.stocks_initialized or len(g.stocks) == 0:
+    # 股票池为空则不执行买入
+    if len(g.stocks) == 0:
+        return
+
+    # 跳过已买入的股票
+    candidates = [stock for stock in g.stocks if stock not in g.bought_stocks]
+    if not candidates:
         return
 
     history_data = get_history(
         count=max(g.long_period, g.volume_period) + 20,  # 取最长周期确保数据完整
         frequency='1d',
         field=['open', 'close', 'volume'],
-        security_list=g.stocks,
+        security_list=candidates,
         fq=g.hist_fq,
         include=False,
         is_dict=False
     )
+    if history_data is None or history_data.empty:
+        return
 
+    try:
+        signals = screen_buy_signals(history_data, candidates)
+    except Exception as e:
+        log.error(f"批量筛选买入信号时出错：{str(e)}")
+        return
 
-    # log.info("数据长度 {}".format(len(hist_data)))
-    # print(hist_data.head(5))
-
-    # 打印hist_data的类型
-    # print(type(hist_data))
-
-    # 遍历股票池中的每只股票
-    for stock in g.stocks:
-        # 跳过已买入的股票
-        if stock in g.bought_stocks:
-            continue
+    for stock, today_open, today_close in signals:
         try:
-            # 获取所需历史数据
-
-            stock_hd = history_data[history_data['code'].isin([stock])]
-            # 确保有足够的历史数据
-            # log.debug("Debug 1")
-            if len(stock_hd) < g.long_period:
-                continue
-
-            #log.info("开始计算均线")
-            # 价格均线计算（使用pandas的rolling方法更可靠）
-            close_prices = stock_hd['close']
-            ma5 = close_prices.rolling(window=g.short_period).mean().iloc[-1]  # 5天收盘价均线
-            ma13 = close_prices.rolling(window=g.mid_period).mean().iloc[-1]  # 13天收盘价均线
-            ma21 = close_prices.rolling(window=g.long_period).mean().iloc[-1]  # 21天收盘价均线
-            #log.info("计算均线完毕")
-
-            # 成交量均线计算
-            volume_data = stock_hd['volume']
-            vol_ma15 = volume_data.rolling(window=g.volume_period).mean().iloc[-1]  # 15天成交量均线
-
-            # log.debug("Debug 2")
-
-            # 获取今日开盘价和收盘价
-            today_open = stock_hd['open'][-1]  # 今日开盘价（最后一条数据）
-            today_close = stock_hd['close'][-1]  # 今日收盘价
-            today_volume = stock_hd['volume'][-1]  # 今日成交量
-
-            # log.debug("Debug 3")
-            # 交易规则判断
-            if (
-                    # 开盘价低于所有均线
-                    today_open < ma5 and
-                    today_open < ma13 and
-                    today_open < ma21 and
-                    # 收盘价高于所有均线
-                    today_close > ma5 and
-                    today_close > ma13 and
-                    today_close > ma21 and
-                    # 成交量放大（大于15天均量的2倍）
-                    today_volume > vol_ma15 * 2
-            ):
-                # 满足条件，买入股票（使用可用资金的90%）
-                cash = context.portfolio.cash * 0.9
-                if cash > 0:
-                    # 计算可买数量（取整百股）
-                    price = today_close  # 以收盘价作为委托价
-                    amount = int(cash / price / 100) * 100
-                    if amount >= 100:  # 最低买入单位100股
-                        order(stock, amount, limit_price=price)
-                        g.bought_stocks[stock] = today_open  # 记录买入日开盘价
-                        log.info(f"买入 {stock}，价格：{price}，数量：{amount}，买入日开盘价：{today_open}")
+            # 满足条件，买入股票（使用可用资金的90%）
+            cash = context.portfolio.cash * 0.9
+            if cash > 0:
+                # 计算可买数量（取整百股）
+                price = today_close  # 以收盘价作为委托价
+                amount = int(cash / price / 100) * 100
+                if amount >= 100:  # 最低买入单位100股
+                    order(stock, amount, limit_price=price)
+                    g.bought_stocks[stock] = today_open  # 记录买入日开盘价
+                    log.info(f"买入 {stock}，价格：{price}，数量：{amount}，买入日开盘价：{today_open}")
 
         except Exception as e:
             # 异常处理，避免单只股票报错影响整体策略
             log.error(f"处理股票 {stock} 时出错：{str(e)}")
-            # 记录错误详细信息
-            log.error(f"错误详细信息：{e}")
             continue
 
 
@@ -208,3 +198,4 @@ def after_trading_end(context, data):
     else:
         log.info("当前无持仓股票")
     log.info(f"账户总资产：{context.portfolio.portfolio_value}")
+    perf.dump_summary(log)
@@ -0,0 +1,417 @@
+"""
+向量化选股引擎
+
+用表达式描述选股条件，在 (日期 × 股票) 的二维面板上一次完成全部股票的计算：
+- 字段：面板中的任意字段名，如 close、open、volume
+- 指标：MA、EMA、STD、SUM、HHV、LLV、REF、CROSS，以及逐元素的 MAX、MIN、ABS
+- 运算：+ - * /、比较 > < >= <= == !=、逻辑 & | ~（与pandas一样需要加括号）
+同一次计算中结构相同的子表达式只计算一次（如多个条件共用 MA(close, 5)）。
+
+用法：
+    from 向量化选股引擎 import Screener, MA, CROSS, fields, build_panels
+
+    close, volume = fields('close', 'volume')
+    screener = Screener({
+        'golden_cross': CROSS(MA(close, 5), MA(close, 20)),
+        'volume_up': volume > MA(volume, 15) * 2,
+    })
+    # 也可以直接写字符串："CROSS(MA(close, 5), MA(close, 20)) & (volume > MA(volume, 15) * 2)"
+    panels = build_panels(history_data, ['close', 'volume'], stocks)  # get_history 返回的长表转为面板
+    selected = screener.select(panels, stocks)  # 最新一根K线满足全部条件的股票
+"""
+
+import ast
+
+import numpy as np
+
+
+class Expr(object):
+    """表达式节点。key 为结构化的元组，用于识别公共子表达式"""
+    __slots__ = ('key',)
+
+    def __add__(self, other):
+        return Op('add', self, other)
+
+    def __radd__(self, other):
+        return Op('add', other, self)
+
+    def __sub__(self, other):
+        return Op('sub', self, other)
+
+    def __rsub__(self, other):
+        return Op('sub', other, self)
+
+    def __mul__(self, other):
+        return Op('mul', self, other)
+
+    def __rmul__(self, other):
+        return Op('mul', other, self)
+
+    def __truediv__(self, other):
+        return Op('div', self, other)
+
+    def __rtruediv__(self, other):
+        return Op('div', other, self)
+
+    def __neg__(self):
+        return Op('neg', self)
+
+    def __gt__(self, other):
+        return Op('gt', self, other)
+
+    def __lt__(self, other):
+        return Op('lt', self, other)
+
+    def __ge__(self, other):
+        return Op('ge', self, other)
+
+    def __le__(self, other):
+        return Op('le', self, other)
+
+    def __eq__(self, other):
+        return Op('eq', self, other)
+
+    def __ne__(self, other):
+        return Op('ne', self, other)
+
+    def __and__(self, other):
+        return Op('and', self, other)
+
+    def __rand__(self, other):
+        return Op('and', other, self)
+
+    def __or__(self, other):
+        return Op('or', self, other)
+
+    def __ror__(self, other):
+        return Op('or', other, self)
+
+    def __invert__(self):
+        return Op('not', self)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'Expr%r' % (self.key,)
+
+
+class Field(Expr):
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+        self.key = ('field', name)
+
+
+class Const(Expr):
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+        self.key = ('const', value)
+
+
+class Op(Expr):
+    """运算节点：name 为运算名，args 为子表达式，params 为窗口长度等常量参数"""
+    __slots__ = ('name', 'args', 'params')
+
+    def __init__(self, name, *args, **kwargs):
+        self.name = name
+        self.args = tuple(_wrap(arg) for arg in args)
+        self.params = tuple(kwargs.get('params', ()))
+        self.key = (name, self.params) + tuple(arg.key for arg in self.args)
+
+
+def _wrap(value):
+    return value if isinstance(value, Expr) else Const(value)
+
+
+def fields(*names):
+    """创建字段表达式：close, volume = fields('close', 'volume')"""
+    result = tuple(Field(name) for name in names)
+    return result[0] if len(result) == 1 else result
+
+
+def MA(x, n):
+    """n 周期简单均线，窗口内有缺失值时为 NaN"""
+    return Op('ma', x, params=(int(n),))
+
+
+def SUM(x, n):
+    return Op('sum', x, params=(int(n),))
+
+
+def STD(x, n):
+    """n 周期总体标准差（ddof=0）"""
+    return Op('std', x, params=(int(n),))
+
+
+def EMA(x, n):
+    """n 周期指数均线，与 pandas ewm(span=n, adjust=False) 一致，从每只股票第一个有效值开始递推"""
+    return Op('ema', x, params=(int(n),))
+
+
+def HHV(x, n):
+    """n 周期最高值"""
+    return Op('hhv', x, params=(int(n),))
+
+
+def LLV(x, n):
+    """n 周期最低值"""
+    return Op('llv', x, params=(int(n),))
+
+
+def REF(x, n=1):
+    """n 周期前的值"""
+    return Op('ref', x, params=(int(n),))
+
+
+def CROSS(a, b):
+    """a 上穿 b：本周期 a > b 且上一周期 a <= b"""
+    return (_wrap(a) > b) & (REF(a, 1) <= REF(b, 1))
+
+
+def MAX(*args):
+    """逐元素最大值"""
+    return Op('max', *args)
+
+
+def MIN(*args):
+    """逐元素最小值"""
+    return Op('min', *args)
+
+
+def ABS(x):
+    return Op('abs', x)
+
+
+FUNCTIONS = {
+    'MA': MA, 'SUM': SUM, 'STD': STD, 'EMA': EMA, 'HHV': HHV, 'LLV': LLV,
+    'REF': REF, 'CROSS': CROSS, 'MAX': MAX, 'MIN': MIN, 'ABS': ABS,
+}
+
+
+_BIN_OPS = {ast.Add: 'add', ast.Sub: 'sub', ast.Mult: 'mul', ast.Div: 'div',
+            ast.BitAnd: 'and', ast.BitOr: 'or'}
+_COMPARE_OPS = {ast.Gt: 'gt', ast.Lt: 'lt', ast.GtE: 'ge', ast.LtE: 'le', ast.Eq: 'eq', ast.NotEq: 'ne'}
+_BOOL_OPS = {ast.And: 'and', ast.Or: 'or'}
+
+
+def parse(text):
+    """
+    把字符串表达式解析为表达式对象。用 ast 解析语法树后逐节点构建，不执行任何代码：
+    只允许名称（FUNCTIONS 中的函数或面板字段）、函数调用、四则运算、比较、逻辑运算和数值常量，
+    属性访问、下标、关键字参数等一律报错
+    """
+    tree = ast.parse(text.strip(), mode='eval')
+    return _wrap(_build(tree.body))
+
+
+def _build(node):
+    if isinstance(node, ast.Name):
+        if node.id in FUNCTIONS:
+            raise ValueError("函数 %s 需要调用" % node.id)
+        return Field(node.id)
+    if type(node).__name__ in ('Constant', 'Num'):
+        value = getattr(node, 'value', getattr(node, 'n', None))
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError("只支持数值常量：%r" % (value,))
+        return value
+    if isinstance(node, ast.Call):
+        if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS or node.keywords:
+            raise ValueError("不支持的函数调用：%s" % ast.dump(node.func))
+        return FUNCTIONS[node.func.id](*[_build(arg) for arg in node.args])
+    if isinstance(node, ast.BinOp) and type(node.op) in _BIN_OPS:
+        return Op(_BIN_OPS[type(node.op)], _build(node.left), _build(node.right))
+    if isinstance(node, ast.UnaryOp):
+        operand = _build(node.operand)
+        if isinstance(node.op, ast.USub):
+            return -operand  # 负数常量直接取负值，表达式生成 neg 节点
+        if isinstance(node.op, ast.UAdd):
+            return operand
+        if isinstance(node.op, (ast.Invert, ast.Not)):
+            return Op('not', operand)
+    if isinstance(node, ast.Compare) and len(node.ops) == 1 and type(node.ops[0]) in _COMPARE_OPS:
+        return Op(_COMPARE_OPS[type(node.ops[0])], _build(node.left), _build(node.comparators[0]))
+    if isinstance(node, ast.BoolOp):
+        result = _build(node.values[0])
+        for value in node.values[1:]:
+            result = Op(_BOOL_OPS[type(node.op)], result, _build(value))
+        return result
+    raise ValueError("表达式中不支持的语法：%s" % type(node).__name__)
+
+
+# ---------------------------------------------------------------------------
+# 面板计算
+# ---------------------------------------------------------------------------
+
+def _shift(values, n):
+    result = np.full(values.shape, np.nan)
+    if n < len(values):
+        result[n:] = values[:len(values) - n]
+    return result
+
+
+def _window_sums(values, n, power=1):
+    """滚动求和（累加和相减），返回 (窗口和, 窗口内是否全部有效)"""
+    valid = np.isfinite(values)
+    filled = np.where(valid, values, 0.0) ** power
+    zeros = np.zeros((1,) + values.shape[1:])
+    cum_sum = np.concatenate([zeros, np.cumsum(filled, axis=0)])
+    cum_cnt = np.concatenate([zeros, np.cumsum(valid, axis=0)])
+    sums = np.full(values.shape, np.nan)
+    full = np.zeros(values.shape, dtype=bool)
+    if len(values) >= n:
+        sums[n - 1:] = cum_sum[n:] - cum_sum[:-n]
+        full[n - 1:] = (cum_cnt[n:] - cum_cnt[:-n]) == n
+    return sums, full
+
+
+def _rolling_extreme(values, n, func):
+    """滚动最高/最低：按窗口偏移逐次比较，共 n 次整面板运算，窗口内有缺失值时为 NaN"""
+    result = np.full(values.shape, np.nan)
+    if len(values) < n:
+        return result
+    rows = len(values) - n + 1
+    window = values[:rows].copy()
+    for k in range(1, n):
+        window = func(window, values[k:k + rows])  # NaN 会传播
+    result[n - 1:] = window
+    return result
+
+
+def _ema(values, n):
+    alpha = 2.0 / (n + 1)
+    result = np.full(values.shape, np.nan)
+    state = np.full(values.shape[1:], np.nan)
+    for i in range(len(values)):
+        x = values[i]
+        valid = np.isfinite(x)
+        started = np.isfinite(state)
+        state = np.where(valid & started, alpha * x + (1 - alpha) * state, np.where(valid, x, state))
+        result[i] = np.where(valid, state, np.nan)
+    return result
+
+
+def _evaluate(node, panels, memo):
+    cached = memo.get(node.key)
+    if cached is not None:
+        return cached
+
+    if isinstance(node, Field):
+        if node.name not in panels:
+            raise KeyError("面板中没有字段：%s" % node.name)
+        value = np.asarray(panels[node.name], dtype=float)
+    elif isinstance(node, Const):
+        value = node.value
+    else:
+        args = [_evaluate(arg, panels, memo) for arg in node.args]
+        value = _apply(node.name, node.params, args)
+
+    memo[node.key] = value
+    return value
+
+
+def _apply(name, params, args):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if name == 'add':
+            return args[0] + args[1]
+        if name == 'sub':
+            return args[0] - args[1]
+        if name == 'mul':
+            return args[0] * args[1]
+        if name == 'div':
+            return np.true_divide(args[0], args[1])
+        if name == 'neg':
+            return -args[0]
+        if name == 'abs':
+            return np.abs(args[0])
+        # 比较时 NaN 一律为 False
+        if name == 'gt':
+            return np.greater(args[0], args[1])
+        if name == 'lt':
+            return np.less(args[0], args[1])
+        if name == 'ge':
+            return np.greater_equal(args[0], args[1])
+        if name == 'le':
+            return np.less_equal(args[0], args[1])
+        if name == 'eq':
+            return np.equal(args[0], args[1])
+        if name == 'ne':
+            return np.not_equal(args[0], args[1])
+        if name == 'and':
+            return np.logical_and(args[0], args[1])
+        if name == 'or':
+            return np.logical_or(args[0], args[1])
+        if name == 'not':
+            return np.logical_not(args[0])
+        if name == 'max':
+            return _reduce(np.maximum, args)
+        if name == 'min':
+            return _reduce(np.minimum, args)
+
+        x = np.asarray(args[0], dtype=float)
+        n = params[0]
+        if name == 'ref':
+            return _shift(x, n)
+        if name == 'ema':
+            return _ema(x, n)
+        if name == 'hhv':
+            return _rolling_extreme(x, n, np.maximum)
+        if name == 'llv':
+            return _rolling_extreme(x, n, np.minimum)
+        sums, full = _window_sums(x, n)
+        if name == 'sum':
+            return np.where(full, sums, np.nan)
+        if name == 'ma':
+            return np.where(full, sums / n, np.nan)
+        if name == 'std':
+            squares, _ = _window_sums(x, n, power=2)
+            mean = sums / n
+            return np.where(full, np.sqrt(np.maximum(squares / n - mean * mean, 0.0)), np.nan)
+    raise ValueError("未知的运算：%s" % name)
+
+
+def _reduce(func, args):
+    result = args[0]
+    for arg in args[1:]:
+        result = func(result, arg)
+    return result
+
+
+def build_panels(history_data, field_names, stocks):
+    """把 get_history 返回的长表透视为 {字段: (日期 × 股票) 的二维数组}，列顺序与 stocks 一致"""
+    wide = history_data.set_index('code', append=True)[field_names].unstack('code')
+    return {field: wide[field].reindex(columns=stocks).values.astype(float) for field in field_names}
+
+
+class Screener(object):
+    """
+    一组命名的选股条件。条件可以是表达式对象或字符串，
+    evaluate 返回每个条件的完整面板，select 返回指定K线上满足全部条件的股票
+    """
+
+    def __init__(self, conditions):
+        if not isinstance(conditions, dict):
+            conditions = {'condition_%d' % i: cond for i, cond in enumerate(conditions)}
+        self.conditions = {name: parse(cond) if isinstance(cond, str) else _wrap(cond)
+                           for name, cond in conditions.items()}
+
+    def evaluate(self, panels):
+        """计算全部条件，返回 {条件名: (日期 × 股票) 数组}，公共子表达式只计算一次"""
+        memo = {}
+        return {name: _evaluate(expr, panels, memo) for name, expr in self.conditions.items()}
+
+    def mask(self, panels, row=-1):
+        """第 row 根K线上满足全部条件的布尔向量"""
+        results = self.evaluate(panels)
+        mask = None
+        for value in results.values():
+            value = np.asarray(value)[row].astype(bool)
+            mask = value if mask is None else mask & value
+        return mask
+
+    def select(self, panels, symbols, row=-1):
+        """第 row 根K线上满足全部条件的股票（保持 symbols 顺序）"""
+        mask = self.mask(panels, row)
+        return [symbols[i] for i in np.flatnonzero(mask)]
@@ -4,7 +4,8 @@
 运行周期:
 日线
 策略流程：
-盘前将中小板综成分股中st、停牌、退市的股票过滤得到股票池
+盘后预先计算次日候选表（成分股流通市值排序并过滤st、停牌、退市），盘前载入后
+对入选的候选股按当日状态再过滤一次；盘后未能预取时盘前现场计算
 盘中换仓，始终持有当日流通市值最小的股票（涨停标的不换仓）。
 优化点：
 1. 只卖出本策略买入的股票
@@ -12,6 +13,14 @@
 注意事项：
 策略中调用的order_target_value接口的使用有场景限制，回测可以正常使用，交易谨慎使用。
 """
+import numpy as np
+import pandas as pd
+
+from 成分股管理 import UniverseManager  # 需将 成分股管理.py 上传至研究目录
+
+# 候选股剔除的状态：ST、停牌、退市
+STATUS_FILTER = ["ST", "HALT", "DELISTING"]
+
 
 # 初始化
 def initialize(context):
@@ -36,26 +45,82 @@ def initialize(context):
     
     # 跟踪本策略买入的股票集合
     g.strategy_stocks = set()
+    # 盘后预取的次日候选表：{"date": 数据所属交易日, "df": 候选表}
+    g.prefetch = None
+    # 每次 get_fundamentals 查询的股票数量
+    g.fundamentals_chunk = 500
+    # 成分股缓存：盘后预取和盘前回退计算共用，同一日期只查询一次
+    if not hasattr(g, 'universe'):
+        g.universe = UniverseManager()
+    # 涨跌停状态：每个tick对持仓和候选股只查询一次
+    g.limit_status = LimitStatus()
 
 
 # 盘前处理
 def before_trading_start(context, data):
     g.pre_position_list = list(get_positions().keys())
-    g.stock_list = get_index_stocks(g.index)
-    # 指数成分股按昨日收盘时的流通市值进行从小到大排序，截取市值最小的100个标的进行股票状态筛选
-    df = get_fundamentals(
-        g.stock_list, "valuation",
-        fields=["total_value", "a_floats", "float_value"],
-        date=context.previous_date
+    prefetch = g.prefetch
+    if prefetch is not None and prefetch["date"] == context.previous_date:
+        log.info("载入盘后预取的候选表：%s" % prefetch["date"])
+        # 盘后的状态过滤不含隔夜公布的停牌、ST，盘前对入选的候选股再过滤一次
+        g.df = refilter_status(prefetch["df"], g.screen_stock_count)
+    else:
+        log.info("无可用的盘后预取数据，盘前计算候选表")
+        g.df = build_candidate_table(context.previous_date).head(g.screen_stock_count)
+    g.prefetch = None
+    # 盘中排序用的候选代码和流通股本向量，每个tick只需乘以最新价
+    g.screen_codes = g.df.index.tolist()
+    g.screen_floats = g.df["a_floats"].values.astype(float)
+
+
+# 盘后处理：预取次日候选表
+def after_trading_end(context, data):
+    today = context.current_dt.date()
+    try:
+        g.prefetch = {"date": today, "df": build_candidate_table(today)}
+        log.info("盘后预取次日候选表完成：%d 只" % len(g.prefetch["df"]))
+    except Exception as e:
+        # 预取失败时次日盘前重新计算
+        g.prefetch = None
+        log.error("盘后预取次日候选表失败：%s" % e)
+
+
+# 计算候选表：指数成分股按 date 收盘时的流通市值从小到大排序，
+# 截取市值最小的100个标的，剔除ST、停牌、退市状态的股票
+def build_candidate_table(date):
+    g.universe.bind(get_index_stocks, logger=log)
+    g.stock_list = g.universe.members(g.index, date.strftime("%Y%m%d"))
+    df = get_fundamentals_chunked(
+        g.stock_list, "valuation", ["total_value", "a_floats", "float_value"], date
     ).sort_values(by="float_value").head(100)
-    stock_list_tmp = df.index.tolist()
-    # 将ST、停牌、退市三种状态的股票剔除当日的股票池
     stock_list_tmp = filter_stock_by_status(
-        stock_list_tmp, filter_type=["ST", "HALT", "DELISTING"], query_date=None
+        df.index.tolist(), filter_type=STATUS_FILTER, query_date=None
     )
-    # 保留状态筛选后的股票，并取其中流通市值最小的10个股票
-    df = df[df.index.isin(stock_list_tmp)]
-    g.df = df.head(g.screen_stock_count)
+    return df[df.index.isin(stock_list_tmp)]
+
+
+# 按候选表顺序取 count 只并按当前状态过滤，被剔除的由后面的候选股补足
+def refilter_status(df, count):
+    kept = []
+    start = 0
+    while len(kept) < count and start < len(df):
+        codes = df.index[start:start + count - len(kept)].tolist()
+        start += len(codes)
+        kept.extend(filter_stock_by_status(codes, filter_type=STATUS_FILTER, query_date=None))
+    return df[df.index.isin(kept)]
+
+
+# 分批查询财务数据，避免单次请求股票过多导致超时
+def get_fundamentals_chunked(stocks, table, fields, date):
+    size = g.fundamentals_chunk
+    frames = [
+        get_fundamentals(stocks[i:i + size], table, fields=fields, date=date)
+        for i in range(0, len(stocks), size)
+    ]
+    frames = [frame for frame in frames if frame is not None and not frame.empty]
+    if not frames:
+        return pd.DataFrame(columns=fields)
+    return pd.concat(frames)
 
 
 # 盘中处理
@@ -99,27 +164,79 @@ def trade(context, buy_stocks):
                 log.info("buy:%s" % stock)
 
 
+# 行情代码后缀到交易代码后缀的转换表
+CODE_SUFFIX = {"XSHG": "SS", "XSHE": "SZ"}
+
+
+# 转换为交易代码，如 600000.XSHG -> 600000.SS
+def to_trade_code(code):
+    symbol, _, suffix = code.partition(".")
+    return symbol + "." + CODE_SUFFIX.get(suffix, suffix) if suffix else code
+
+
+# 涨跌停状态缓存：同一tick内一次 check_limit 批量查询所有代码，提供向量化的涨停掩码
+class LimitStatus(object):
+    LIMIT_UP = 1
+
+    def __init__(self):
+        self.tick = None
+        self.status = {}
+
+    def refresh(self, tick, codes):
+        # 新的tick清空缓存；同一tick内只补查缓存中没有的代码
+        if tick != self.tick:
+            self.tick = tick
+            self.status = {}
+        missing = [code for code in dict.fromkeys(codes) if code not in self.status]
+        if missing:
+            result = check_limit(missing)
+            for code in missing:
+                self.status[code] = result.get(code, 0)
+
+    def values(self, codes):
+        return np.array([self.status.get(code, 0) for code in codes], dtype=int)
+
+    def limit_up_mask(self, codes):
+        return self.values(codes) == self.LIMIT_UP
+
+
 # 获取买入股票池（涨停股不参与换仓）
 def get_trade_stocks(context, data):
+    # 持仓和候选股的涨跌停状态一次查询
+    g.limit_status.refresh(context.current_dt, g.pre_position_list + g.screen_codes)
     # 获取持仓中涨停的标的
+    up_mask = g.limit_status.limit_up_mask(g.pre_position_list)
     hold_up_limit_stock = [
-        stock.replace("XSHG", "SS").replace("XSHE", "SZ")
-        for stock in g.pre_position_list
-        if check_limit(stock)[stock] == 1
+        to_trade_code(stock) for stock, at_up in zip(g.pre_position_list, up_mask) if at_up
     ]
-    df = g.df
-    if df.empty:
+    if not g.screen_codes:
         return hold_up_limit_stock
-    df["code"] = df.index
-    # 计算当时最新的流通市值（昨日的流通股本*最新价）
-    df["curr_float_value"] = df.apply(
-        lambda x: x["a_floats"] * data[x["code"]].price, axis=1
-    )
-    df = df[df["curr_float_value"] != 0]
-    # 按流通市值从小到大排序
-    stocks = df.sort_values(by="curr_float_value").index.tolist()
     # 本次拟买入的数量
     count = g.buy_stock_count - len(hold_up_limit_stock)
-    check_out_lists = stocks[:count]
-    check_out_lists = check_out_lists + hold_up_limit_stock
-    return check_out_lists
\ No newline at end of file
+    stocks = smallest_float_value(g.screen_codes, g.screen_floats, get_live_prices(g.screen_codes, data), count)
+    check_out_lists = stocks + hold_up_limit_stock
+    return check_out_lists
+
+
+# 批量获取最新价：交易时一次 get_snapshot（缺失记为0），回测时从 data 中取
+def get_live_prices(codes, data):
+    if is_trade():
+        snapshot = get_snapshot(codes)
+        return np.array([snapshot.get(code, {}).get("last_px", 0) or 0 for code in codes], dtype=float)
+    return np.array([data[code].price for code in codes], dtype=float)
+
+
+# 按最新流通市值（昨日流通股本*最新价）从小到大取前 count 个，价格为0的标的剔除
+def smallest_float_value(codes, floats, prices, count):
+    values = floats * prices
+    valid = np.flatnonzero(values != 0)
+    if count <= 0 or not len(valid):
+        return []
+    values = values[valid]
+    if count < len(valid):
+        part = np.argpartition(values, count - 1)[:count]
+    else:
+        part = np.arange(len(valid))
+    # 只对选中的 count 个排序；稳定排序保证同值时保持原顺序
+    order = part[np.argsort(values[part], kind="stable")]
+    return [codes[i] for i in valid[order]]
\ No newline at end of file
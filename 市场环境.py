@@ -0,0 +1,126 @@
+"""
+市场环境（行情状态）分类
+
+对整段指数收盘价一次性计算状态标签（np.select 作用在预先算好的均线、涨幅数组上），
+按指数代码缓存标签序列，每日只追加新K线并计算最后一行。
+研究脚本（指数金叉分析.py 的事件研究）和实盘策略（ETF轮动策略V2 的标的池切换）共用这里的分类规则。
+
+两种分类：
+- environment：收盘价在MA60之上且30日涨幅>=5%为 Bull，在MA60之下且30日涨幅<=-5%为 Bear，其余为 Sideways
+- ma_alignment：MA10<=MA20 为 Weak（弱势），MA5>MA10>MA20>MA30 为 Strong（强势），其余为 Neutral
+
+策略中使用需将 市场环境.py 上传至研究目录。
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def rolling_mean(close, window):
+    """滚动均值（累加和相减），不足 window 个数据时为NaN"""
+    close = np.asarray(close, dtype=float)
+    result = np.full(len(close), np.nan)
+    if len(close) >= window:
+        cum = np.concatenate([[0.0], np.cumsum(close)])
+        result[window - 1:] = (cum[window:] - cum[:-window]) / window
+    return result
+
+
+def pct_change(close, periods):
+    """periods 日涨幅（%）"""
+    close = np.asarray(close, dtype=float)
+    result = np.full(len(close), np.nan)
+    if len(close) > periods:
+        result[periods:] = (close[periods:] / close[:-periods] - 1) * 100
+    return result
+
+
+def environment_labels(close, ma_window=60, ret_window=30, threshold=5.0):
+    """牛熊震荡标签数组（Bull / Bear / Sideways）"""
+    close = np.asarray(close, dtype=float)
+    ma = rolling_mean(close, ma_window)
+    ret = pct_change(close, ret_window)
+    with np.errstate(invalid='ignore'):
+        conditions = [(close > ma) & (ret >= threshold), (close < ma) & (ret <= -threshold)]
+    return np.select(conditions, ['Bull', 'Bear'], default='Sideways').astype(object)
+
+
+def ma_alignment_labels(close, windows=(5, 10, 20, 30)):
+    """
+    均线排列标签数组（Weak / Strong / Neutral），均线数据不足时为 Neutral
+    windows 为 (最短, 短, 中, 长)，Weak：短<=中；Strong：最短>短>中>长
+    """
+    ma = [rolling_mean(close, window) for window in windows]
+    with np.errstate(invalid='ignore'):
+        weak = ma[1] <= ma[2]
+        strong = (ma[0] > ma[1]) & (ma[1] > ma[2]) & (ma[2] > ma[3])
+    return np.select([weak, strong], ['Weak', 'Strong'], default='Neutral').astype(object)
+
+
+# 分类名称 -> (计算函数, 计算最后一行所需的最少K线数)
+CLASSIFIERS = {
+    'environment': (environment_labels, 61),
+    'ma_alignment': (ma_alignment_labels, 30),
+}
+
+
+class RegimeCache(object):
+    """
+    按指数代码缓存收盘价和各分类的标签序列
+    - load：整段历史一次计算
+    - append：追加一根新K线（同一日期重复追加时覆盖），只用最近的若干根K线计算最后一行
+    """
+
+    def __init__(self, kinds=None):
+        self.kinds = list(kinds or CLASSIFIERS)
+        self.lookback = max(CLASSIFIERS[kind][1] for kind in self.kinds)
+        self.dates = {}
+        self.closes = {}
+        self.labels = {}
+
+    def load(self, code, dates, closes):
+        self.dates[code] = np.asarray(pd.to_datetime(dates), dtype='datetime64[D]')
+        self.closes[code] = np.array(closes, dtype=float)
+        self.labels[code] = {kind: CLASSIFIERS[kind][0](self.closes[code]) for kind in self.kinds}
+
+    def append(self, code, date, close):
+        if code not in self.dates:
+            self.load(code, [date], [close])
+            return
+        date = np.datetime64(pd.Timestamp(date).date(), 'D')
+        dates, closes, labels = self.dates[code], self.closes[code], self.labels[code]
+        if date < dates[-1]:
+            raise ValueError(f"{code} 追加的日期 {date} 早于已有数据 {dates[-1]}")
+        if date == dates[-1]:
+            closes[-1] = close
+        else:
+            self.dates[code] = dates = np.append(dates, date)
+            self.closes[code] = closes = np.append(closes, float(close))
+            for kind in self.kinds:
+                labels[kind] = np.append(labels[kind], None)
+        tail = closes[-self.lookback:]
+        for kind in self.kinds:
+            labels[kind][-1] = CLASSIFIERS[kind][0](tail)[-1]
+
+    def last_date(self, code):
+        dates = self.dates.get(code)
+        return None if dates is None or not len(dates) else pd.Timestamp(dates[-1])
+
+    def label(self, code, kind='environment', date=None):
+        """date 当日（无数据时取之前最近一日）的标签，date 为空时取最新，没有数据时返回 None"""
+        if code not in self.dates:
+            return None
+        if date is None:
+            i = len(self.dates[code]) - 1
+        else:
+            i = np.searchsorted(self.dates[code], np.datetime64(pd.Timestamp(date).date(), 'D'), side='right') - 1
+        return self.labels[code][kind][i] if i >= 0 else None
+
+    def series(self, code, kind='environment'):
+        """标签序列（以日期为索引的 Series）"""
+        return pd.Series(self.labels[code][kind], index=pd.DatetimeIndex(self.dates[code]), name=kind)
+
+
+def environment_series(close, **kwargs):
+    """以日期为索引的收盘价 Series -> 牛熊震荡标签 Series"""
+    return pd.Series(environment_labels(close.values, **kwargs), index=close.index, name='environment')
@@ -0,0 +1,129 @@
+"""
+指数成分股股票池管理
+
+按指数缓存成分股列表及其生效日期，每日只计算新增/剔除的差异：
+- 成分股没有变化时不重复调用 set_universe，按股票保存的指标状态也无需重建
+- 新增的股票交给注册的预热回调（如加载历史K线、初始化EMA状态）
+- 同一交易日内重复查询直接返回缓存
+
+平台接口（get_index_stocks、set_universe）只在策略的全局命名空间中可用，
+由策略通过 bind 传入。管理器随g持久化时不保存接口和回调，
+因此每日盘前调用一次 bind（重启恢复后同样生效）。策略在 initialize 中只在g没有管理器时创建，
+重启恢复后第一次 sync 即使成员没有变化也会重新调用一次 set_universe。
+
+用法（策略文件中，需将 成分股管理.py 上传至研究目录）：
+    from 成分股管理 import UniverseManager
+
+    def initialize(context):
+        if not hasattr(g, 'universe'):
+            g.universe = UniverseManager()
+
+    def before_trading_start(context, data):
+        g.universe.bind(get_index_stocks, set_universe, log, hooks=[on_universe_change])
+        g.stocks = g.universe.sync(["399005.XSHE"], context.previous_date)
+
+    def on_universe_change(added, removed):
+        ...
+"""
+
+
+class UniverseManager(object):
+    """按指数缓存成分股，计算每日差异并只在成员变化时更新股票池"""
+
+    def __init__(self):
+        # {指数代码: [(生效日期, 成分股元组), ...]}，只在成员变化时追加
+        self.history = {}
+        # {指数代码: 最后查询日期}
+        self.checked = {}
+        self.universe = []
+        self._applied = False  # 本次运行是否已调用过 set_universe，不随g持久化
+        self.bind(None)
+
+    def bind(self, get_index_stocks, set_universe=None, logger=None, hooks=()):
+        """
+        绑定平台接口和预热回调 hook(added, removed)，股票池变化时调用，added/removed 为列表
+        """
+        self._get_index_stocks = get_index_stocks
+        self._set_universe = set_universe
+        self._logger = logger
+        self.hooks = list(hooks)
+
+    def __getstate__(self):
+        return {'history': self.history, 'checked': self.checked, 'universe': self.universe}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._applied = False
+        self.bind(None)
+
+    def members(self, index_code, date=None):
+        """
+        返回指数在 date 的成分股列表（保持接口返回的顺序）
+        同一日期重复查询不再调用接口（date 为 None 时每次都查询）；成员不变时不追加历史记录
+        """
+        history = self.history.setdefault(index_code, [])
+        if history and date is not None and self.checked.get(index_code) == date:
+            return list(history[-1][1])
+        if date is None:
+            stocks = self._get_index_stocks(index_code)
+        else:
+            stocks = self._get_index_stocks(index_code, date)
+        stocks = tuple(stocks)
+        if not history or set(history[-1][1]) != set(stocks):
+            history.append((date, stocks))
+        else:
+            # 成员相同但接口返回顺序可能变化，保持原生效日期
+            history[-1] = (history[-1][0], stocks)
+        self.checked[index_code] = date
+        return list(stocks)
+
+    def effective_date(self, index_code):
+        """当前成分股的生效日期（首次观察到该成员组合的查询日期）"""
+        history = self.history.get(index_code)
+        return history[-1][0] if history else None
+
+    def diff(self, index_code):
+        """最近一次成员变化的 (新增, 剔除) 列表，只有一条历史时新增为全部成分股"""
+        history = self.history.get(index_code)
+        if not history:
+            return [], []
+        current = history[-1][1]
+        previous = set(history[-2][1]) if len(history) > 1 else set()
+        current_set = set(current)
+        return ([s for s in current if s not in previous],
+                sorted(previous - current_set))
+
+    def sync(self, index_codes, date=None):
+        """
+        合并若干指数的成分股作为股票池。与上次相比有变化时调用 set_universe
+        并把新增/剔除的股票交给预热回调；无变化时直接返回当前股票池
+        """
+        if isinstance(index_codes, str):
+            index_codes = [index_codes]
+        universe = []
+        seen = set()
+        for index_code in index_codes:
+            for stock in self.members(index_code, date):
+                if stock not in seen:
+                    seen.add(stock)
+                    universe.append(stock)
+
+        previous = set(self.universe)
+        added = [s for s in universe if s not in previous]
+        removed = sorted(previous - seen)
+        if not added and not removed:
+            if not self._applied and self._set_universe is not None and universe:
+                # 重启恢复后平台股票池为空，按缓存的成员重新设置一次，状态无需重建
+                self._set_universe(universe)
+                self._applied = True
+            return list(self.universe)
+
+        self.universe = universe
+        if self._set_universe is not None:
+            self._set_universe(universe)
+            self._applied = True
+        if self._logger is not None:
+            self._logger.info("股票池更新：共%d只，新增%d只，剔除%d只" % (len(universe), len(added), len(removed)))
+        for hook in self.hooks:
+            hook(added, removed)
+        return list(universe)
@@ -0,0 +1,159 @@
+"""
+每个tick的持仓快照
+
+每个tick首次访问时调用一次 get_positions()，之后O(1)查询持仓数量、成本和是否持有。
+持仓查询有约6秒同步延迟（见Bugs.md），因此：
+- 持仓数量只按成交回报（已确认的成交）在本地修正，查询结果追上之前以本地值为准；
+  超过 expire_ticks 个tick仍未追上时以查询结果为准
+- 委托只记为“未完成委托”，不改变持仓数量；策略据此避免对同一标的重复下单。
+  委托回报为已成/撤单/废单、查询结果已反映委托目标或超过 expire_ticks 个tick后清除，
+  撤单、废单时快照失效，下次访问重新查询，未成交的止损可以重新下单
+
+平台接口 get_positions 只在策略的全局命名空间中可用，由策略在每个tick调用 begin_tick 时传入；
+快照随g持久化时不保存接口。首次 begin_tick 之前（新建或盘中重启从g恢复后）收到的回报不查询持仓，
+快照保持失效，成交按最近一次快照的持仓数量记录，下个tick查询后再核对。
+
+用法（策略文件中，需将 持仓快照.py 上传至研究目录）：
+    from 持仓快照 import PositionSnapshot
+
+    def initialize(context):
+        g.position_snapshot = PositionSnapshot()
+
+    def handle_data(context, data):
+        g.position_snapshot.begin_tick(get_positions)
+        if g.position_snapshot.held(code) and not g.position_snapshot.open_order(code):
+            order_target(code, 0)
+            g.position_snapshot.on_order(code, 0)
+
+    def on_order_response(context, order_list):
+        for order_info in order_list:
+            g.position_snapshot.on_order_status(order_info.get('stock_code'), str(order_info.get('status')))
+
+    def on_trade_response(context, trade_list):
+        for trade_info in trade_list:
+            g.position_snapshot.on_trade(trade_info.get('stock_code'), trade_info.get('business_amount', 0),
+                                         str(trade_info.get('entrust_bs')) == '1')
+"""
+
+# 委托状态：已成；部撤、已撤、废单（这三种需要按查询结果重新同步）
+ORDER_FILLED = ('8',)
+ORDER_ABORTED = ('5', '6', '9')
+
+
+class PositionSnapshot(object):
+    """持仓快照：一次查询，本地随成交回报更新，并跟踪未完成的委托"""
+
+    def __init__(self, expire_ticks=5):
+        self.expire_ticks = expire_ticks
+        self.stale = True
+        self.amounts = {}
+        self.costs = {}
+        self.fills = {}        # {代码: [成交后的持仓数量, 已等待的tick数]}，查询结果追上前覆盖查询值
+        self.open_orders = {}  # {代码: [委托前持仓数量, 目标持仓数量（按金额买入时为None）, 已等待的tick数]}
+        self._get_positions = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_get_positions'] = None
+        return state
+
+    def begin_tick(self, get_positions):
+        """新tick开始：快照失效，未确认的成交和委托等待tick数加1"""
+        self._get_positions = get_positions
+        self.stale = True
+        for item in self.fills.values():
+            item[-1] += 1
+        for item in self.open_orders.values():
+            item[-1] += 1
+
+    def end_day(self):
+        self.fills = {}
+        self.open_orders = {}
+        self.stale = True
+
+    def _refresh(self):
+        # 还没有查询接口时保持失效，等下个tick的 begin_tick
+        if not self.stale or self._get_positions is None:
+            return
+        positions = self._get_positions()
+        self.amounts = {}
+        self.costs = {}
+        for code, position in positions.items():
+            if position.amount > 0:
+                self.amounts[code] = position.amount
+                self.costs[code] = position.cost_basis
+        for code, (expected, age) in list(self.fills.items()):
+            if self.amounts.get(code, 0) == expected or age > self.expire_ticks:
+                # 查询结果已反映成交，或等待过久以查询结果为准
+                del self.fills[code]
+            else:
+                self.amounts[code] = expected
+        for code, (base, target, age) in list(self.open_orders.items()):
+            amount = self.amounts.get(code, 0)
+            done = amount == target if target is not None else amount > base
+            if done or age > self.expire_ticks:
+                del self.open_orders[code]
+        self.stale = False
+
+    def amount(self, code):
+        self._refresh()
+        return self.amounts.get(code, 0)
+
+    def cost(self, code):
+        self._refresh()
+        return self.costs.get(code, 0)
+
+    def held(self, code):
+        """已确认的持仓（不含未成交的买入委托）"""
+        return self.amount(code) > 0
+
+    def open_order(self, code):
+        """未完成委托的方向：'buy'、'sell'，没有时为 None"""
+        self._refresh()
+        order = self.open_orders.get(code)
+        if order is None:
+            return None
+        base, target, _ = order
+        return 'buy' if target is None or target > base else 'sell'
+
+    def held_list(self, universe=None, include_open=True):
+        """
+        持仓代码列表
+        include_open=True：委托完成后的持仓，即已确认持仓加上有买入委托的；
+            有清仓委托（目标持仓为0）的不列出，部分卖出的仍列出
+        include_open=False：只含已确认且没有未完成委托的持仓
+        """
+        self._refresh()
+        codes = []
+        for code, amount in self.amounts.items():
+            if amount > 0 and (universe is None or code in universe):
+                order = self.open_orders.get(code)
+                if order is None or (include_open and order[1] != 0):
+                    codes.append(code)
+        if include_open:
+            codes.extend(code for code in self.open_orders
+                         if self.amounts.get(code, 0) <= 0 and self.open_order(code) == 'buy'
+                         and (universe is None or code in universe))
+        return codes
+
+    def on_order(self, code, target_amount=None):
+        """委托后记录未完成委托，target_amount 为委托完成后的持仓数量（按金额买入时不传）"""
+        self._refresh()
+        self.open_orders[code] = [self.amounts.get(code, 0), target_amount, 0]
+
+    def on_order_status(self, code, status):
+        """委托回报：已成时清除委托；部撤、撤单、废单时清除委托并在下次访问时重新查询持仓"""
+        if status in ORDER_FILLED or status in ORDER_ABORTED:
+            self.open_orders.pop(code, None)
+        if status in ORDER_ABORTED:
+            self.stale = True
+
+    def on_trade(self, code, business_amount, is_buy):
+        """成交回报：按实际成交数量修正持仓，达到委托目标时清除委托；还没有查询接口时只记录成交"""
+        self._refresh()
+        amount = self.amounts.get(code, 0) + (business_amount if is_buy else -business_amount)
+        self.amounts[code] = max(amount, 0)
+        self.fills[code] = [self.amounts[code], 0]
+        order = self.open_orders.get(code)
+        if order is not None and order[1] is not None and self.amounts[code] == order[1]:
+            del self.open_orders[code]
@@ -1,112 +1,186 @@
+"""
+指数均线金叉事件研究
+
+信号序列（如上证指数MA20上穿MA30）与目标序列（如沪深300ETF收盘价）、市场环境序列
+各自保留自己的交易日，用 searchsorted 按日期对齐（默认要求日期完全相同；
+指定 tolerance 时等价于 merge_asof 向后匹配：取事件日当天或之前 tolerance 天内最近的一个交易日），
+多个持有期的未来收益一次按下标取值计算，
+再按市场环境分组统计。多个指数信号 × 多个ETF目标可以在一次调用中完成。
+"""
+
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-from datetime import datetime, timedelta
-import akshare as ak
-
-# 获取上证指数数据（修改列名适配）
-df_sh = ak.stock_zh_index_daily("000001")  # 上证指数
-print(df_sh.head())
-# 检查并修正日期列名（可能是"trade_date"而非"date"）
-# if "trade_date" in df_sh.columns:
-#     df_sh = df_sh.rename(columns={"trade_date": "date"})
-# df_sh['date'] = pd.to_datetime(df_sh['date'])
-# df_sh = df_sh[(df_sh['date'] >= '2015-12-29') & (df_sh['date'] <= '2025-12-28')]
-
-# # 获取沪深300ETF数据（前复权）
-# df_300etf = ak.fund_etf_hist_sina("510300")  # 沪深300ETF
-# if "trade_date" in df_300etf.columns:
-#     df_300etf = df_300etf.rename(columns={"trade_date": "date"})
-# df_300etf['date'] = pd.to_datetime(df_300etf['date'])
-# df_300etf = df_300etf[(df_300etf['date'] >= '2015-12-29') & (df_300etf['date'] <= '2025-12-28')]
-
-# # 获取沪深300指数数据
-# df_300 = ak.stock_zh_index_daily("000300")  # 沪深300指数
-# if "trade_date" in df_300.columns:
-#     df_300 = df_300.rename(columns={"trade_date": "date"})
-# df_300['date'] = pd.to_datetime(df_300['date'])
-# df_300 = df_300[(df_300['date'] >= '2015-12-29') & (df_300['date'] <= '2025-12-28')]
-
-# # 2. 计算均线与金叉信号
-# df_sh['ma20'] = df_sh['close'].rolling(20).mean()
-# df_sh['ma30'] = df_sh['close'].rolling(30).mean()
-# df_sh['golden_cross'] = (df_sh['ma20'] > df_sh['ma30']) & (df_sh['ma20'].shift(1) <= df_sh['ma30'].shift(1))
-
-# # 3. 去重连续金叉
-# df_sh['golden_cross_filtered'] = df_sh['golden_cross']
-# df_sh.loc[df_sh['golden_cross'] & df_sh['golden_cross'].shift(1), 'golden_cross_filtered'] = False
-
-# # 4. 市场环境划分
-# df_300['ma60'] = df_300['close'].rolling(60).mean()
-# df_300['30d_return'] = df_300['close'].pct_change(30) * 100
-
-# def market_environment(row):
-#     if row['close'] > row['ma60'] and row['30d_return'] >= 5:
-#         return 'Bull'
-#     elif row['close'] < row['ma60'] and row['30d_return'] <= -5:
-#         return 'Bear'
-#     else:
-#         return 'Sideways'
-
-# df_300['environment'] = df_300.apply(market_environment, axis=1)
-
-# # 5. 匹配金叉信号与ETF收益
-# golden_cross_dates = df_sh[df_sh['golden_cross_filtered']]['date'].tolist()
-# results = []
-
-# for date in golden_cross_dates:
-#     # 找到ETF对应日期的索引
-#     idx = df_300etf[df_300etf['date'] == date].index
-#     if len(idx) == 0:
-#         continue
-#     idx = idx[0]
-#     # 计算未来10日收益（跳过当前日）
-#     if idx + 10 >= len(df_300etf):
-#         continue
-#     entry_price = df_300etf.loc[idx, 'close']
-#     exit_price = df_300etf.loc[idx + 10, 'close']
-#     return_10d = (exit_price - entry_price) / entry_price * 100
-#     # 获取市场环境
-#     env = df_300[df_300['date'] == date]['environment'].values[0]
-#     results.append({
-#         'date': date,
-#         'return_10d': return_10d,
-#         'environment': env
-#     })
-
-# # 6. 统计结果
-# df_results = pd.DataFrame(results)
-# df_results['win'] = df_results['return_10d'] > 0
-
-# # 全市场统计
-# total_count = len(df_results)
-# win_count = df_results['win'].sum()
-# win_rate = win_count / total_count * 100
-# avg_gain = df_results[df_results['win']]['return_10d'].mean()
-# avg_loss = df_results[~df_results['win']]['return_10d'].mean()
-# profit_loss_ratio = avg_gain / abs(avg_loss)
-# max_drawdown = df_results['return_10d'].min()
-# sharpe_ratio = df_results['return_10d'].mean() / df_results['return_10d'].std() * np.sqrt(252/10)  # 年化
-
-# # 分市场统计
-# env_stats = df_results.groupby('environment').agg({
-#     'return_10d': ['count', lambda x: (x > 0).sum() / len(x) * 100, 
-#                    lambda x: x[x > 0].mean(), lambda x: x[x <= 0].mean(), 
-#                    'min', lambda x: x.mean() / x.std() * np.sqrt(252/10)]
-# }).round(2)
-
-# env_stats.columns = ['Count', 'Win Rate (%)', 'Avg Gain (%)', 'Avg Loss (%)', 'Max Drawdown (%)', 'Sharpe Ratio']
-
-# # 7. 输出结果
-# print("=== 全市场统计 ===")
-# print(f"金叉总次数: {total_count}")
-# print(f"上涨次数: {win_count}")
-# print(f"上涨概率: {win_rate:.1f}%")
-# print(f"上涨平均涨幅: {avg_gain:.2f}%")
-# print(f"下跌平均跌幅: {avg_loss:.2f}%")
-# print(f"盈亏比: {profit_loss_ratio:.2f}")
-# print(f"最大回撤: {max_drawdown:.2f}%")
-# print(f"夏普比率: {sharpe_ratio:.2f}")
-
-# print("\n=== 分市场环境统计 ===")
-# print(env_stats)
\ No newline at end of file
+
+from 市场环境 import environment_series
+
+
+# 均线金叉：短均线上穿长均线
+def golden_cross(close, short=20, long=30):
+    close = pd.Series(close)
+    ma_short = close.rolling(short).mean().values
+    ma_long = close.rolling(long).mean().values
+    cross = np.zeros(len(close), dtype=bool)
+    with np.errstate(invalid='ignore'):
+        cross[1:] = (ma_short[1:] > ma_long[1:]) & (ma_short[:-1] <= ma_long[:-1])
+    return cross
+
+
+# 去重连续信号：只保留连续出现的第一天
+def dedupe_consecutive(signal):
+    signal = np.asarray(signal, dtype=bool)
+    result = signal.copy()
+    result[1:] &= ~signal[:-1]
+    return result
+
+
+def to_datetime64(dates):
+    return np.asarray(pd.to_datetime(dates), dtype='datetime64[ns]')
+
+
+# 把事件日期对齐到目标序列的下标：取事件日当天或之前最近的交易日，
+# 间隔超过 tolerance 天（或早于目标序列起点）的为 -1
+def align_dates(event_dates, target_dates, tolerance=None):
+    if not (isinstance(event_dates, np.ndarray) and event_dates.dtype == 'datetime64[ns]'):
+        event_dates = to_datetime64(event_dates)
+    if not (isinstance(target_dates, np.ndarray) and target_dates.dtype == 'datetime64[ns]'):
+        target_dates = to_datetime64(target_dates)
+    idx = np.searchsorted(target_dates, event_dates, side='right') - 1
+    valid = idx >= 0
+    if tolerance is not None:
+        lag = event_dates - target_dates[np.maximum(idx, 0)]
+        valid &= lag <= np.timedelta64(int(tolerance), 'D')
+    return np.where(valid, idx, -1)
+
+
+# 多个持有期的未来收益（%）：以对齐日收盘价买入，持有 h 个交易日后的收盘价卖出，
+# 返回 (事件数 × 持有期数) 数组，数据不足的为NaN
+def forward_returns(close, idx, horizons):
+    close = np.asarray(close, dtype=float)
+    idx = np.asarray(idx)
+    horizons = np.asarray(horizons)
+    exit_idx = idx[:, None] + horizons[None, :]
+    valid = (idx[:, None] >= 0) & (exit_idx < len(close))
+    entry = close[np.where(idx >= 0, idx, 0)][:, None]
+    exit_price = close[np.where(valid, exit_idx, 0)]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        returns = (exit_price - entry) / entry * 100
+    return np.where(valid, returns, np.nan)
+
+
+def _as_series_dict(data, default_name):
+    if isinstance(data, dict):
+        return data
+    return {default_name: data}
+
+
+def event_study(signals, targets, horizons=(10,), regimes=None, tolerance=0):
+    """
+    事件研究
+    signals: 事件日期列表，或 {信号名: 事件日期列表}
+    targets: 以日期为索引的收盘价 Series，或 {目标名: Series}
+    horizons: 持有期（交易日）
+    regimes: 以日期为索引的市场环境 Series（可选），按事件日对齐
+    tolerance: 事件日与目标交易日允许的最大间隔（自然日），默认0即日期完全相同，None 为不限
+
+    返回每个 (信号, 目标, 事件) 一行的 DataFrame：signal、target、date、regime、return_{h}d
+    """
+    signals = _as_series_dict(signals, 'signal')
+    targets = _as_series_dict(targets, 'target')
+    horizons = list(horizons)
+
+    # 日期统一转换一次，之后只做 searchsorted 和按下标取值
+    targets = {name: close.sort_index() for name, close in targets.items()}
+    target_arrays = {name: (to_datetime64(close.index), close.values.astype(float))
+                     for name, close in targets.items()}
+    if regimes is not None:
+        regimes = regimes.sort_index()
+        regime_dates, regime_values = to_datetime64(regimes.index), regimes.values.astype(object)
+
+    columns = {'signal': [], 'target': [], 'date': [], 'regime': [], 'returns': []}
+    for signal_name, event_dates in signals.items():
+        event_dates = np.sort(to_datetime64(event_dates))
+        regime = np.full(len(event_dates), None, dtype=object)
+        if regimes is not None:
+            regime_idx = align_dates(event_dates, regime_dates, tolerance)
+            regime[regime_idx >= 0] = regime_values[regime_idx[regime_idx >= 0]]
+        for target_name, (dates, close) in target_arrays.items():
+            idx = align_dates(event_dates, dates, tolerance)
+            found = idx >= 0
+            columns['signal'].append(np.full(found.sum(), signal_name, dtype=object))
+            columns['target'].append(np.full(found.sum(), target_name, dtype=object))
+            columns['date'].append(event_dates[found])
+            columns['regime'].append(regime[found])
+            columns['returns'].append(forward_returns(close, idx[found], horizons))
+    if not columns['date']:
+        return pd.DataFrame()
+
+    result = pd.DataFrame({name: np.concatenate(columns[name]) for name in ('signal', 'target', 'date', 'regime')})
+    returns = np.concatenate(columns['returns'])
+    for k, h in enumerate(horizons):
+        result[f'return_{h}d'] = returns[:, k]
+    return result
+
+
+def summarize(results, horizon=10, by=('regime',)):
+    """
+    按分组统计某个持有期的收益：次数、上涨概率、平均涨幅、平均跌幅、盈亏比、最大回撤、年化夏普
+    by 为空时统计全部事件
+    """
+    column = f'return_{horizon}d'
+    df = results[list(by) + [column]].dropna(subset=[column]).copy()
+    df['ret'] = df[column]
+    df['win'] = df['ret'] > 0
+    df['gain'] = df['ret'].where(df['win'])
+    df['loss'] = df['ret'].where(~df['win'])
+    keys = list(by) if by else (lambda _: '全部')
+    stats = df.groupby(keys).agg(
+        count=('ret', 'size'), win=('win', 'mean'), avg_gain=('gain', 'mean'), avg_loss=('loss', 'mean'),
+        max_drawdown=('ret', 'min'), mean=('ret', 'mean'), std=('ret', 'std'))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result = pd.DataFrame({
+            'Count': stats['count'],
+            'Win Rate (%)': stats['win'] * 100,
+            'Avg Gain (%)': stats['avg_gain'],
+            'Avg Loss (%)': stats['avg_loss'],
+            'Profit/Loss Ratio': stats['avg_gain'] / stats['avg_loss'].abs(),
+            'Max Drawdown (%)': stats['max_drawdown'],
+            'Sharpe Ratio': stats['mean'] / stats['std'] * np.sqrt(252 / horizon),  # 年化
+        })
+    return result.round(2)
+
+
+# 读取akshare日线数据并截取日期区间，返回以日期为索引的DataFrame
+def load_daily(fetch, symbol, start='2015-12-29', end='2025-12-28'):
+    df = fetch(symbol)
+    # 检查并修正日期列名（可能是"trade_date"而非"date"）
+    if "trade_date" in df.columns:
+        df = df.rename(columns={"trade_date": "date"})
+    df['date'] = pd.to_datetime(df['date'])
+    df = df[(df['date'] >= start) & (df['date'] <= end)]
+    return df.set_index('date').sort_index()
+
+
+if __name__ == "__main__":
+    import akshare as ak
+
+    # 1. 获取上证指数、沪深300指数和沪深300ETF数据
+    df_sh = load_daily(ak.stock_zh_index_daily, "sh000001")  # 上证指数
+    df_300 = load_daily(ak.stock_zh_index_daily, "sh000300")  # 沪深300指数
+    df_300etf = load_daily(ak.fund_etf_hist_sina, "sh510300")  # 沪深300ETF
+    print(df_sh.head())
+
+    # 2. 计算均线金叉信号并去重连续金叉
+    cross = dedupe_consecutive(golden_cross(df_sh['close'], 20, 30))
+    golden_cross_dates = df_sh.index[cross]
+
+    # 3. 市场环境划分（牛市/熊市/震荡，见 市场环境.py）
+    df_300['environment'] = environment_series(df_300['close'])
+
+    # 4. 匹配金叉信号与ETF未来收益，并按市场环境统计
+    results = event_study({'上证MA20金叉MA30': golden_cross_dates}, {'沪深300ETF': df_300etf['close']},
+                          horizons=(5, 10, 20), regimes=df_300['environment'])
+
+    print("=== 全市场统计 ===")
+    print(summarize(results, horizon=10, by=()).T)
+    print("\n=== 分市场环境统计 ===")
+    print(summarize(results, horizon=10, by=('regime',)))
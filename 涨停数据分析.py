@@ -0,0 +1,375 @@
+"""
+涨停历史数据分析
+
+LimitUpStore：把 ./test/data/limit_up_*.csv（获取涨停数据.py 生成）合并为按列存储的类型化数组，
+代码、名称、行业编码为整数，up_stat（"N/M"，M天N板）拆成两列整数，
+按 (交易日, 代码) 排序后缓存为 ./test/cache 下的 .npz（不纳入版本管理），
+缓存记录各CSV的文件名、大小和修改时间，任一变化（含增删文件）时自动重建。
+
+LimitUpAnalytics：在整个历史上向量化计算每日聚合，首次访问时计算并缓存：
+- 每日涨停家数、每日各行业涨停家数
+- 连板梯队（按 limit_times 连板数）和 M天N板 梯队（按 up_stat）
+- 开板回封比例（open_times > 0 的涨停占比）
+- 滚动窗口行业热度排名
+
+LimitUpIndex：按代码、交易日、行业预先排序并记录偏移量，
+单只股票历史、日期区间、行业区间、N连板以上等查询只需二分查找和切片（亚毫秒级），
+可在策略的 before_trading_start 中直接使用。
+"""
+
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+DATA_DIR = os.path.join('.', 'test', 'data')
+CACHE_DIR = os.path.join('.', 'test', 'cache')
+CSV_PATTERN = 'limit_up_*.csv'
+CACHE_FILE = 'limit_up_store.npz'
+
+# 数值列及其类型
+NUMERIC_COLUMNS = {
+    'trade_date': np.int32,  # YYYYMMDD
+    'close': np.float32,
+    'pct_chg': np.float32,
+    'open_times': np.int16,
+    'limit_times': np.int16,
+    'up_days': np.int16,  # up_stat 中的 N（涨停次数）
+    'up_window': np.int16,  # up_stat 中的 M（统计天数）
+}
+# 编码列：记录中保存整数编号，编号对应的字符串在同名的表中
+CODED_COLUMNS = ('ts_code', 'name', 'industry')
+
+
+class LimitUpStore(object):
+    """按列存储的涨停记录，按 (trade_date, ts_code) 排序"""
+
+    def __init__(self, columns, tables):
+        self.columns = columns
+        self.tables = tables
+        self.size = len(columns['trade_date'])
+
+    def __len__(self):
+        return self.size
+
+    def __getattr__(self, name):
+        columns = self.__dict__.get('columns', {})
+        if name in columns:
+            return columns[name]
+        raise AttributeError(name)
+
+    @classmethod
+    def from_frame(cls, df):
+        df = df.sort_values(['trade_date', 'ts_code'], kind='mergesort')
+        up_stat = df['up_stat'].astype(str).str.split('/', expand=True)
+        columns = {
+            'trade_date': df['trade_date'].astype(np.int64).values.astype(np.int32),
+            'close': df['close'].values.astype(np.float32),
+            'pct_chg': df['pct_chg'].values.astype(np.float32),
+            'open_times': df['open_times'].values.astype(np.int16),
+            'limit_times': df['limit_times'].values.astype(np.int16),
+            'up_days': pd.to_numeric(up_stat[0], errors='coerce').fillna(0).values.astype(np.int16),
+            'up_window': pd.to_numeric(up_stat[1], errors='coerce').fillna(0).values.astype(np.int16),
+        }
+        tables = {}
+        for name in CODED_COLUMNS:
+            codes, table = pd.factorize(df[name].astype(str), sort=True)
+            columns[name] = codes.astype(np.int32)
+            tables[name] = np.asarray(table, dtype=str)
+        return cls(columns, tables)
+
+    @classmethod
+    def from_csv(cls, paths):
+        frames = [pd.read_csv(path, encoding='utf-8-sig', dtype={'trade_date': str}) for path in paths]
+        return cls.from_frame(pd.concat(frames, ignore_index=True))
+
+    def save(self, path, source_key=()):
+        """source_key 为生成缓存的源文件标识（见 source_key），读取缓存时用于判断是否过期"""
+        arrays = dict(self.columns)
+        arrays.update({'table_' + name: table for name, table in self.tables.items()})
+        np.savez(path, source_key=np.array(list(source_key), dtype=str), **arrays)
+
+    @classmethod
+    def load_npz(cls, path, source_key=None):
+        """读取 .npz 缓存；指定 source_key 且与缓存记录的不一致时返回 None"""
+        with np.load(path) as data:
+            if source_key is not None:
+                cached_key = list(data['source_key']) if 'source_key' in data.files else None
+                if cached_key != list(source_key):
+                    return None
+            columns = {name: data[name] for name in list(NUMERIC_COLUMNS) + list(CODED_COLUMNS)}
+            tables = {name: data['table_' + name] for name in CODED_COLUMNS}
+        return cls(columns, tables)
+
+    @staticmethod
+    def source_key(paths):
+        """源文件标识：每个文件的 "文件名|大小|修改时间(ns)"，任一文件变化或增删文件时都会不同"""
+        key = []
+        for path in paths:
+            stat = os.stat(path)
+            key.append(f"{os.path.basename(path)}|{stat.st_size}|{stat.st_mtime_ns}")
+        return key
+
+    @classmethod
+    def load(cls, data_dir=DATA_DIR, use_cache=True, cache_dir=CACHE_DIR):
+        """
+        读取 data_dir 下的全部 limit_up_*.csv。use_cache 时优先读取 cache_dir 下的 .npz 缓存，
+        CSV 的文件名、大小或修改时间与缓存记录不一致时重新解析CSV并更新缓存
+        """
+        paths = sorted(glob.glob(os.path.join(data_dir, CSV_PATTERN)))
+        if not paths:
+            raise FileNotFoundError(f"{data_dir} 下没有 {CSV_PATTERN} 文件")
+        key = cls.source_key(paths)
+        cache_path = os.path.join(cache_dir, CACHE_FILE)
+        if use_cache and os.path.exists(cache_path):
+            store = cls.load_npz(cache_path, key)
+            if store is not None:
+                return store
+        store = cls.from_csv(paths)
+        if use_cache:
+            os.makedirs(cache_dir, exist_ok=True)
+            store.save(cache_path, key)
+        return store
+
+    def decode(self, name, values=None):
+        """把编码列（或其中的部分编号）转换回字符串"""
+        return self.tables[name][self.columns[name] if values is None else values]
+
+    def to_frame(self, rows=None):
+        """转换为 DataFrame（rows 为记录下标或布尔掩码，默认全部）"""
+        rows = slice(None) if rows is None else rows
+        data = {}
+        for name in ('trade_date', 'ts_code', 'industry', 'name', 'close', 'pct_chg', 'open_times'):
+            data[name] = self.decode(name, self.columns[name][rows]) if name in CODED_COLUMNS else self.columns[name][rows]
+        data['up_stat'] = np.char.add(np.char.add(self.up_days[rows].astype(str), '/'),
+                                      self.up_window[rows].astype(str))
+        data['limit_times'] = self.limit_times[rows]
+        return pd.DataFrame(data)
+
+
+def _rolling_sum(values, window):
+    """按行（日期）的滚动求和，不足 window 行时按已有行求和"""
+    cum = np.cumsum(values, axis=0)
+    result = cum.copy()
+    result[window:] = cum[window:] - cum[:-window]
+    return result
+
+
+class LimitUpAnalytics(object):
+    """涨停历史的每日聚合，各项结果首次访问时计算并缓存"""
+
+    def __init__(self, store):
+        self.store = store
+        # 交易日表及每条记录所属交易日的编号（记录已按交易日排序）
+        self.dates, self.date_idx = np.unique(store.trade_date, return_inverse=True)
+        self._cache = {}
+
+    def _cached(self, key, func):
+        if key not in self._cache:
+            self._cache[key] = func()
+        return self._cache[key]
+
+    def _date_index(self):
+        return pd.to_datetime(self.dates.astype(str), format='%Y%m%d')
+
+    def daily_counts(self):
+        """每日涨停家数（Series，索引为交易日）"""
+        return self._cached('daily_counts', lambda: pd.Series(
+            np.bincount(self.date_idx, minlength=len(self.dates)), index=self._date_index(), name='limit_up_count'))
+
+    def _count_matrix(self, column_idx, n_columns):
+        flat = self.date_idx.astype(np.int64) * n_columns + column_idx
+        return np.bincount(flat, minlength=len(self.dates) * n_columns).reshape(len(self.dates), n_columns)
+
+    def industry_counts(self):
+        """每日各行业涨停家数（DataFrame：交易日 × 行业）"""
+        def compute():
+            industries = self.store.tables['industry']
+            matrix = self._count_matrix(self.store.industry, len(industries))
+            return pd.DataFrame(matrix, index=self._date_index(), columns=industries)
+        return self._cached('industry_counts', compute)
+
+    def ladder(self, max_height=None):
+        """
+        连板梯队：每日各连板数的家数（DataFrame：交易日 × 连板数），
+        max_height 以上的并入最高一档
+        """
+        def compute():
+            height = self.store.limit_times.astype(np.int64)
+            top = int(height.max()) if max_height is None else max_height
+            height = np.clip(height, 1, top)
+            matrix = self._count_matrix(height - 1, top)
+            return pd.DataFrame(matrix, index=self._date_index(), columns=np.arange(1, top + 1))
+        return self._cached(('ladder', max_height), compute)
+
+    def up_stat_ladder(self):
+        """M天N板梯队：每日各 "M天N板" 的家数（DataFrame：交易日 × "M天N板"），只含出现过的组合"""
+        def compute():
+            pairs = self.store.up_window.astype(np.int64) * 1000 + self.store.up_days
+            keys, pair_idx = np.unique(pairs, return_inverse=True)
+            matrix = self._count_matrix(pair_idx, len(keys))
+            labels = ['%d天%d板' % (key // 1000, key % 1000) for key in keys]
+            return pd.DataFrame(matrix, index=self._date_index(), columns=labels)
+        return self._cached('up_stat_ladder', compute)
+
+    def highest_board(self):
+        """每日最高连板数（空间板高度）"""
+        def compute():
+            result = np.zeros(len(self.dates), dtype=np.int16)
+            np.maximum.at(result, self.date_idx, self.store.limit_times)
+            return pd.Series(result, index=self._date_index(), name='highest_board')
+        return self._cached('highest_board', compute)
+
+    def open_ratio(self):
+        """每日开板回封比例：当日涨停中盘中打开过（open_times > 0）的占比"""
+        def compute():
+            opened = np.bincount(self.date_idx, weights=self.store.open_times > 0, minlength=len(self.dates))
+            return pd.Series(opened / self.daily_counts().values, index=self._date_index(), name='open_ratio')
+        return self._cached('open_ratio', compute)
+
+    def industry_heat(self, window=5):
+        """滚动 window 个交易日的行业涨停家数（DataFrame：交易日 × 行业）"""
+        def compute():
+            counts = self.industry_counts()
+            return pd.DataFrame(_rolling_sum(counts.values, window), index=counts.index, columns=counts.columns)
+        return self._cached(('industry_heat', window), compute)
+
+    def industry_heat_rank(self, window=5, top_n=5):
+        """
+        每日行业热度前 top_n（DataFrame：交易日 × 名次，值为行业名称），
+        按滚动窗口内涨停家数降序，家数为0的位置为空
+        """
+        def compute():
+            heat = self.industry_heat(window)
+            values = heat.values
+            n = min(top_n, values.shape[1])
+            part = np.argpartition(-values, n - 1, axis=1)[:, :n]
+            order = np.take_along_axis(part, np.argsort(-np.take_along_axis(values, part, axis=1), axis=1, kind='stable'), axis=1)
+            names = heat.columns.values[order].astype(object)
+            names[np.take_along_axis(values, order, axis=1) == 0] = None
+            return pd.DataFrame(names, index=heat.index, columns=np.arange(1, n + 1))
+        return self._cached(('industry_heat_rank', window, top_n), compute)
+
+    def breadth(self):
+        """合并的市场宽度指标：涨停家数、最高连板、连板家数（limit_times >= 2）、开板回封比例"""
+        def compute():
+            multi = np.bincount(self.date_idx, weights=self.store.limit_times >= 2, minlength=len(self.dates))
+            return pd.DataFrame({
+                'limit_up_count': self.daily_counts(),
+                'highest_board': self.highest_board(),
+                'multi_board_count': pd.Series(multi.astype(int), index=self._date_index()),
+                'open_ratio': self.open_ratio(),
+            })
+        return self._cached('breadth', compute)
+
+
+def to_date_int(date):
+    """把 20240102、'20240102'、'2024-01-02'、date/datetime/Timestamp/np.datetime64 转为 YYYYMMDD 整数"""
+    if isinstance(date, (int, np.integer)):
+        return int(date)
+    if isinstance(date, str):
+        return int(date.replace('-', '')[:8])
+    date = pd.Timestamp(date)
+    return date.year * 10000 + date.month * 100 + date.day
+
+
+class LimitUpIndex(object):
+    """
+    涨停记录的查询索引，查询结果为记录下标（按交易日升序），用 frame(rows) 转为 DataFrame
+    - 交易日：记录本身按交易日排序，区间查询为两次二分查找
+    - 代码/行业：按 (编号, 交易日) 排序的下标数组加每个编号的起止偏移量
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.dates = store.trade_date
+        self.code_order, self.code_offsets = self._group(store.ts_code, len(store.tables['ts_code']))
+        self.industry_order, self.industry_offsets = self._group(store.industry, len(store.tables['industry']))
+        self.code_ids = {code: i for i, code in enumerate(store.tables['ts_code'])}
+        self.industry_ids = {name: i for i, name in enumerate(store.tables['industry'])}
+        # 分组内的交易日，便于在组内二分查找日期区间
+        self.code_dates = self.dates[self.code_order]
+        self.industry_dates = self.dates[self.industry_order]
+
+    @staticmethod
+    def _group(keys, n_keys):
+        # 稳定排序保留组内的交易日顺序
+        order = np.argsort(keys, kind='stable').astype(np.int64)
+        offsets = np.zeros(n_keys + 1, dtype=np.int64)
+        np.cumsum(np.bincount(keys, minlength=n_keys), out=offsets[1:])
+        return order, offsets
+
+    def _date_bounds(self, dates, start, end):
+        lo = 0 if start is None else np.searchsorted(dates, to_date_int(start), side='left')
+        hi = len(dates) if end is None else np.searchsorted(dates, to_date_int(end), side='right')
+        return lo, hi
+
+    def _group_rows(self, order, offsets, group_dates, key, start, end):
+        lo, hi = offsets[key], offsets[key + 1]
+        sub_lo, sub_hi = self._date_bounds(group_dates[lo:hi], start, end)
+        return order[lo + sub_lo:lo + sub_hi]
+
+    def date_rows(self, start=None, end=None):
+        """交易日区间 [start, end] 内的全部涨停记录"""
+        lo, hi = self._date_bounds(self.dates, start, end)
+        return np.arange(lo, hi)
+
+    def on_date(self, date):
+        return self.date_rows(date, date)
+
+    def code_rows(self, ts_code, start=None, end=None):
+        """单只股票的涨停记录，可限定交易日区间"""
+        key = self.code_ids.get(ts_code)
+        if key is None:
+            return np.zeros(0, dtype=np.int64)
+        return self._group_rows(self.code_order, self.code_offsets, self.code_dates, key, start, end)
+
+    def industry_rows(self, industry, start=None, end=None):
+        """单个行业的涨停记录，可限定交易日区间"""
+        key = self.industry_ids.get(industry)
+        if key is None:
+            return np.zeros(0, dtype=np.int64)
+        return self._group_rows(self.industry_order, self.industry_offsets, self.industry_dates, key, start, end)
+
+    def consecutive_rows(self, min_boards, start=None, end=None, rows=None):
+        """连板数不少于 min_boards 的记录（默认在交易日区间内，也可传入其他查询的结果继续筛选）"""
+        if rows is None:
+            rows = self.date_rows(start, end)
+        return rows[self.store.limit_times[rows] >= min_boards]
+
+    def consecutive_codes(self, min_boards, start=None, end=None):
+        """区间内出现过 min_boards 连板及以上的股票代码"""
+        rows = self.consecutive_rows(min_boards, start, end)
+        return [str(code) for code in self.store.tables['ts_code'][np.unique(self.store.ts_code[rows])]]
+
+    def last_limit_up(self, ts_code, before=None):
+        """股票在 before（含）之前最近一次涨停的记录下标，没有时返回 None"""
+        rows = self.code_rows(ts_code, end=before)
+        return int(rows[-1]) if len(rows) else None
+
+    def frame(self, rows):
+        return self.store.to_frame(rows)
+
+
+if __name__ == "__main__":
+    import time
+
+    start = time.perf_counter()
+    store = LimitUpStore.load(DATA_DIR)
+    analytics = LimitUpAnalytics(store)
+    breadth = analytics.breadth()
+    ladder = analytics.ladder()
+    rank = analytics.industry_heat_rank(window=5, top_n=3)
+    print(f"{len(store)} 条记录，{len(analytics.dates)} 个交易日，计算耗时 {time.perf_counter() - start:.3f} 秒")
+    print(breadth.tail())
+    print(ladder.tail())
+    print(rank.tail())
+
+    index = LimitUpIndex(store)
+    start = time.perf_counter()
+    codes = index.consecutive_codes(3, '2025-01-01', '2025-03-31')
+    history = index.code_rows('000032.SZ')
+    print(f"查询耗时 {(time.perf_counter() - start) * 1000:.3f} 毫秒")
+    print(f"2025年一季度3连板及以上: {len(codes)} 只")
+    print(index.frame(history).tail())
@@ -1,8 +1,279 @@
 import pandas as pd
 import numpy as np
 import os
+from bisect import bisect_right
 
-def get_matrix(etf_price_history_df, etf_name_list_df, sort_by_correlation=True):
+
+def to_returns(price_wide):
+    """价格宽表（日期 × 代码）转为日收益率，缺失价格对应的收益率为NaN"""
+    values = np.asarray(price_wide, dtype=float)
+    returns = np.full(values.shape, np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        returns[1:] = values[1:] / values[:-1] - 1
+    returns[~np.isfinite(returns)] = np.nan
+    return returns
+
+
+def _standardize(values):
+    """
+    按列标准化为 float32，返回 (标准化矩阵, 有效掩码)，缺失位置填0
+    标准化后做矩阵乘法可避免大数相减带来的精度损失
+    """
+    mask = np.isfinite(values)
+    count = mask.sum(axis=0)
+    filled = np.where(mask, values, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = filled.sum(axis=0) / count
+        centered = np.where(mask, values - mean, 0.0)
+        std = np.sqrt((centered * centered).sum(axis=0) / count)
+        z = np.where(mask, centered / std, 0.0)
+    # 有效值不足2个或波动为0的列无法计算相关性
+    bad = (count < 2) | ~(std > 0)
+    z[:, bad] = 0.0
+    mask[:, bad] = False
+    return z.astype(np.float32), mask.astype(np.float32)
+
+
+def _block_size(max_memory_mb):
+    """每个分块约占 8 个 b×b 的 float32 矩阵，据此由内存上限推算分块大小"""
+    b = int(np.sqrt(max_memory_mb * 2 ** 20 / (8 * 4)))
+    return max(16, b)
+
+
+def correlation_blocks(values, block_size=None, min_periods=20, max_memory_mb=256):
+    """
+    分块计算相关性矩阵的上三角（含对角块），逐块产出 (i0, i1, j0, j1, block)
+    - values: (日期 × 代码) 数组，NaN 表示缺失
+    - 每对代码只使用两者同时有效的日期（与 DataFrame.corr 的成对删除一致），
+      通过掩码加权的一阶、二阶矩矩阵乘法得到，共同有效日期少于 min_periods 的为NaN
+    - 无缺失数据时直接用标准化矩阵相乘
+    """
+    values = np.asarray(values, dtype=float)
+    n_cols = values.shape[1]
+    z, mask = _standardize(values)
+    if block_size is None:
+        block_size = _block_size(max_memory_mb)
+    dense = bool(mask.all())
+    z2 = None if dense else z * z
+
+    for i0 in range(0, n_cols, block_size):
+        i1 = min(i0 + block_size, n_cols)
+        zi = z[:, i0:i1]
+        for j0 in range(i0, n_cols, block_size):
+            j1 = min(j0 + block_size, n_cols)
+            zj = z[:, j0:j1]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                if dense:
+                    n = np.float32(len(values))
+                    block = zi.T @ zj / n
+                    enough = n >= min_periods
+                else:
+                    mi, mj = mask[:, i0:i1], mask[:, j0:j1]
+                    n = mi.T @ mj
+                    sx = zi.T @ mj
+                    sy = mi.T @ zj
+                    sxy = zi.T @ zj
+                    vx = z2[:, i0:i1].T @ mj - sx * sx / n
+                    vy = mi.T @ z2[:, j0:j1] - sy * sy / n
+                    block = (sxy - sx * sy / n) / np.sqrt(vx * vy)
+                    enough = n >= min_periods
+                block = np.where(enough, np.clip(block, -1, 1), np.nan).astype(np.float32)
+            if i0 == j0:
+                diag = np.arange(i1 - i0)
+                valid = mask[:, i0:i1].sum(axis=0) >= min_periods
+                block[diag, diag] = np.where(valid, 1.0, np.nan)
+            yield i0, i1, j0, j1, block
+
+
+def compute_correlation(values, block_size=None, min_periods=20, max_memory_mb=256, out_path=None):
+    """
+    计算 (日期 × 代码) 数据的相关性矩阵，返回 float32 的 N×N 数组
+    分块计算并按对称性只算上三角；指定 out_path 时结果写入内存映射的 .npy 文件，
+    适合上千只ETF的全市场矩阵（峰值内存约为输入数据加 max_memory_mb）
+    """
+    n_cols = np.asarray(values).shape[1]
+    if out_path is not None:
+        result = np.lib.format.open_memmap(out_path, mode='w+', dtype=np.float32, shape=(n_cols, n_cols))
+    else:
+        result = np.empty((n_cols, n_cols), dtype=np.float32)
+    for i0, i1, j0, j1, block in correlation_blocks(values, block_size, min_periods, max_memory_mb):
+        result[i0:i1, j0:j1] = block
+        result[j0:j1, i0:i1] = block.T
+    if out_path is not None:
+        result.flush()
+    return result
+
+
+class RollingCorrelation(object):
+    """
+    滚动窗口相关性跟踪：保存窗口内收益率的成对计数、一阶矩、二阶矩和交叉乘积累加和，
+    每新增一天只做 O(N²) 的加减（移出窗口的那天同样减去），不必重算整段历史
+    - 收益率与 to_returns 定义相同（前一日或当日缺价时为NaN），缺失数据按成对删除处理，
+      因此与 compute_correlation 的结果一致
+    - 完整的相关性矩阵只保留最近 max_snapshots 个（每个 N×N float32，1500只约9MB，默认只保留最新一个），
+      snapshot(date) 只能查到保留的这几个；每个交易日相关性最高的 top_n 对另外保存
+      （最近 max_pair_days 天），按日期查询历史用 pairs(date)
+    - save/load 把最新状态写入 .npz，供研究脚本和选池（ETF池构建.py）直接读取后继续逐日更新
+    """
+
+    def __init__(self, codes, window=60, min_periods=20, max_snapshots=1, rebuild_every=500,
+                 top_n=20, max_pair_days=250):
+        self.codes = list(codes)
+        self.window = window
+        self.min_periods = min_periods
+        self.max_snapshots = max_snapshots
+        self.top_n = top_n
+        self.max_pair_days = max_pair_days
+        # 累加和存在舍入误差，每更新 rebuild_every 次用窗口内数据重建一次
+        self.rebuild_every = rebuild_every
+        n = len(self.codes)
+        self.rows = []  # 窗口内的 (收益率, 掩码)
+        self.last_prices = np.full(n, np.nan)
+        self.count = np.zeros((n, n))
+        self.sum_x = np.zeros((n, n))  # sum_x[i, j]: i 在 i、j 同时有效日期上的收益率之和
+        self.sum_xx = np.zeros((n, n))
+        self.sum_xy = np.zeros((n, n))
+        self.updates = 0
+        self.snapshots = {}
+        self.snapshot_dates = []
+        self.pair_history = {}  # {日期: [(代码1, 代码2, 相关系数), ...]}
+        self.pair_dates = []
+
+    def _accumulate(self, x, m, sign):
+        xm = np.where(m, x, 0.0)
+        mf = m.astype(float)
+        self.count += sign * np.outer(mf, mf)
+        self.sum_x += sign * np.outer(xm, mf)
+        self.sum_xx += sign * np.outer(xm * xm, mf)
+        self.sum_xy += sign * np.outer(xm, xm)
+
+    def _rebuild(self):
+        for name in ('count', 'sum_x', 'sum_xx', 'sum_xy'):
+            getattr(self, name)[:] = 0.0
+        for x, m in self.rows:
+            self._accumulate(x, m, 1)
+
+    def update(self, date, prices):
+        """
+        加入一个交易日的收盘价（与 codes 顺序一致的数组，或以代码为索引的 Series/字典），
+        更新窗口并保存当日的相关性快照，返回该快照
+        """
+        if isinstance(prices, dict):
+            prices = pd.Series(prices)
+        if isinstance(prices, pd.Series):
+            prices = prices.reindex(self.codes).values
+        prices = np.asarray(prices, dtype=float)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            x = prices / self.last_prices - 1
+        m = np.isfinite(x)
+        self.last_prices = prices
+
+        self.rows.append((x, m))
+        self._accumulate(x, m, 1)
+        if len(self.rows) > self.window:
+            old_x, old_m = self.rows.pop(0)
+            self._accumulate(old_x, old_m, -1)
+        self.updates += 1
+        if self.updates % self.rebuild_every == 0:
+            self._rebuild()
+
+        matrix = self.matrix()
+        self._store(date, matrix)
+        return matrix
+
+    def matrix(self):
+        """由当前累加和计算相关性矩阵（float32）"""
+        n = self.count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            sx, sy = self.sum_x, self.sum_x.T
+            cov = self.sum_xy - sx * sy / n
+            vx = self.sum_xx - sx * sx / n
+            vy = self.sum_xx.T - sy * sy / n
+            corr = np.clip(cov / np.sqrt(vx * vy), -1, 1)
+        corr[~(n >= self.min_periods) | ~np.isfinite(corr)] = np.nan
+        diag = np.arange(len(self.codes))
+        corr[diag, diag] = np.where(np.diag(n) >= self.min_periods, 1.0, np.nan)
+        return corr.astype(np.float32)
+
+    @staticmethod
+    def _keep(history, dates, date, value, limit):
+        """按日期保存，日期按更新顺序递增；超过 limit 个时删除最早的"""
+        if date not in history:
+            dates.append(date)
+        history[date] = value
+        while len(dates) > limit:
+            del history[dates.pop(0)]
+
+    def _store(self, date, matrix):
+        date = pd.Timestamp(date)
+        self._keep(self.snapshots, self.snapshot_dates, date, matrix, self.max_snapshots)
+        if self.top_n:
+            pairs = [(self.codes[i], self.codes[j], corr) for i, j, corr in top_pairs(matrix, self.top_n)]
+            self._keep(self.pair_history, self.pair_dates, date, pairs, self.max_pair_days)
+
+    @staticmethod
+    def _lookup(dates, date):
+        """date 当日或之前最近一日在 dates 中的日期（二分查找），date 为空时取最新"""
+        if not dates:
+            return None
+        if date is None:
+            return dates[-1]
+        i = bisect_right(dates, pd.Timestamp(date)) - 1
+        return dates[i] if i >= 0 else None
+
+    def snapshot(self, date=None):
+        """
+        查询 date 当日（无快照时取之前最近一日）的相关性矩阵 DataFrame，date 为空时返回最新快照
+        只在保留的 max_snapshots 个快照中查找（默认只有最新一个），date 早于其中最早的日期时返回 None
+        """
+        key = self._lookup(self.snapshot_dates, date)
+        if key is None:
+            return None
+        return pd.DataFrame(self.snapshots[key], index=self.codes, columns=self.codes)
+
+    def pairs(self, date=None):
+        """查询 date 当日（无记录时取之前最近一日）相关性最高的 top_n 对 [(代码1, 代码2, 相关系数), ...]"""
+        key = self._lookup(self.pair_dates, date)
+        return None if key is None else self.pair_history[key]
+
+    @classmethod
+    def from_price_wide(cls, price_wide, window=60, **kwargs):
+        """用价格宽表（日期 × 代码）逐日回放，生成历史快照"""
+        tracker = cls(price_wide.columns, window=window, **kwargs)
+        for date, prices in zip(price_wide.index, price_wide.values):
+            tracker.update(date, prices)
+        return tracker
+
+    def save(self, path):
+        """保存窗口数据和最新快照；载入后可继续逐日更新"""
+        latest = self.snapshot_dates[-1] if self.snapshot_dates else None
+        np.savez_compressed(
+            path,
+            codes=np.array(self.codes),
+            params=np.array([self.window, self.min_periods, self.max_snapshots, self.rebuild_every,
+                             self.top_n, self.max_pair_days]),
+            returns=np.array([x for x, _ in self.rows]).reshape(len(self.rows), len(self.codes)),
+            last_prices=self.last_prices,
+            latest_date=np.array([str(latest) if latest is not None else '']),
+            latest=self.snapshots[latest] if latest is not None else np.zeros((0, 0), dtype=np.float32),
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            params = [int(v) for v in data['params']]
+            tracker = cls([str(code) for code in data['codes']], *params)
+            tracker.rows = [(x, np.isfinite(x)) for x in data['returns']]
+            tracker.last_prices = data['last_prices']
+            latest_date, latest = str(data['latest_date'][0]), data['latest']
+        tracker._rebuild()
+        if latest_date:
+            tracker._store(latest_date, latest)
+        return tracker
+
+
+def get_matrix(etf_price_history_df, etf_name_list_df, sort_by_correlation=True, use_returns=True,
+               min_periods=20, out_path=None):
     """
     计算并打印ETF之间的相关性矩阵
     
@@ -12,6 +283,9 @@ def get_matrix(etf_price_history_df, etf_name_list_df, sort_by_correlation=True)
     etf_name_list_df: DataFrame，包含ETF代码和名称的对应关系
                       必须包含'ts_code'列(ETF代码)和'name'列(ETF名称)
     sort_by_correlation: bool，是否按相关性强度排序ETF
+    use_returns: bool，按日收益率计算相关性（False 时按价格水平计算）
+    min_periods: int，两只ETF共同有效的最少天数，不足时相关性为NaN
+    out_path: str，相关性矩阵另存为内存映射的 .npy 文件（ETF数量很多时使用）
     
     返回:
     correlation_matrix: DataFrame，ETF相关性矩阵
@@ -30,8 +304,12 @@ def get_matrix(etf_price_history_df, etf_name_list_df, sort_by_correlation=True)
         values='close'
     )
     
-    # 3. 计算相关性矩阵
-    correlation_matrix = price_wide.corr()
+    # 3. 计算相关性矩阵（分块矩阵乘法，成对删除缺失值）
+    values = to_returns(price_wide.values) if use_returns else price_wide.values
+    correlation_matrix = pd.DataFrame(
+        compute_correlation(values, min_periods=min_periods, out_path=out_path),
+        index=price_wide.columns, columns=price_wide.columns
+    )
     
     # 4. 创建代码到名称的映射字典
     code_to_name = dict(zip(etf_name_list_df['ts_code'], etf_name_list_df['name']))
@@ -78,31 +356,165 @@ def get_matrix(etf_price_history_df, etf_name_list_df, sort_by_correlation=True)
     
     return correlation_matrix
 
-def print_top_correlations(correlation_matrix, top_n=10):
+def _select_pairs(rows, cols, values, top_n, largest):
+    """从候选对中选出前 top_n 个（argpartition 选择，不做全量排序）"""
+    keys = -values if largest else values
+    if len(keys) > top_n:
+        part = np.argpartition(keys, top_n - 1)[:top_n]
+        rows, cols, values = rows[part], cols[part], values[part]
+    return rows, cols, values
+
+
+def top_pairs_from_blocks(blocks, top_n=10, largest=True):
+    """
+    从 correlation_blocks 产出的上三角分块中流式选出相关性最高（largest=False 时最低）的 top_n 对，
+    不需要完整矩阵，返回按相关性排序的 [(i, j, corr), ...]，i < j 为列下标
+    """
+    best_rows = np.zeros(0, dtype=int)
+    best_cols = np.zeros(0, dtype=int)
+    best_values = np.zeros(0)
+    for i0, i1, j0, j1, block in blocks:
+        rows, cols = np.nonzero(np.isfinite(block))
+        rows, cols = rows + i0, cols + j0
+        upper = rows < cols  # 只取上三角，排除对角线（自相关）
+        rows, cols = rows[upper], cols[upper]
+        values = block[rows - i0, cols - j0].astype(float)
+        rows, cols, values = _select_pairs(rows, cols, values, top_n, largest)
+        best_rows, best_cols, best_values = _select_pairs(
+            np.concatenate([best_rows, rows]), np.concatenate([best_cols, cols]),
+            np.concatenate([best_values, values]), top_n, largest)
+    order = np.argsort(-best_values if largest else best_values, kind='stable')
+    return [(int(best_rows[k]), int(best_cols[k]), float(best_values[k])) for k in order]
+
+
+def top_pairs(correlation_matrix, top_n=10, largest=True, block_size=512):
+    """
+    从相关性矩阵（DataFrame 或数组，可以是内存映射）的上三角中选出前 top_n 对，
+    按行分块读取，返回 [(名称1, 名称2, 相关系数), ...]
+    """
+    values = correlation_matrix.values if isinstance(correlation_matrix, pd.DataFrame) else correlation_matrix
+    labels = list(correlation_matrix.columns) if isinstance(correlation_matrix, pd.DataFrame) else None
+    n = values.shape[0]
+
+    def blocks():
+        for i0 in range(0, n, block_size):
+            i1 = min(i0 + block_size, n)
+            yield i0, i1, i0, n, np.asarray(values[i0:i1, i0:])
+
+    pairs = top_pairs_from_blocks(blocks(), top_n, largest)
+    if labels is None:
+        return pairs
+    return [(labels[i], labels[j], corr) for i, j, corr in pairs]
+
+
+def print_top_correlations(correlation_matrix, top_n=10, show_least=False):
     """
     打印相关性最高的ETF对
     
     参数:
     correlation_matrix: DataFrame，相关性矩阵
     top_n: int，要显示的前n个最高相关性对
+    show_least: bool，同时打印相关性最低的前n个ETF对
     """
-    # 创建相关性对的DataFrame
-    corr_pairs = correlation_matrix.unstack()
-    
-    # 过滤掉自相关
-    corr_pairs = corr_pairs[corr_pairs < 1.0]
-    
-    # 按相关性降序排序
-    corr_pairs = corr_pairs.sort_values(ascending=False)
-    
-    # 打印前n个最高相关性对
-    print(f"\n相关性最高的{top_n}个ETF对:")
-    print("-" * 50)
-    for i, ((etf1, etf2), corr) in enumerate(corr_pairs.head(top_n).items(), 1):
-        print(f"{i:2d}. {etf1:<10} vs {etf2:<10} : {corr:.4f}")
+    titles = [(f"相关性最高的{top_n}个ETF对", True)]
+    if show_least:
+        titles.append((f"相关性最低的{top_n}个ETF对", False))
+    for title, largest in titles:
+        print(f"\n{title}:")
+        print("-" * 50)
+        for i, (etf1, etf2, corr) in enumerate(top_pairs(correlation_matrix, top_n, largest), 1):
+            print(f"{i:2d}. {etf1:<10} vs {etf2:<10} : {corr:.4f}")
+
+def cluster_correlation(values, threshold=0.3):
+    """
+    按相关性距离（1 - 相关系数）做平均连接层次聚类，距离不超过 threshold 的归为一簇
+    返回 (排序下标, 簇编号)，排序下标使同簇的ETF相邻，可直接用于重排矩阵
+    未安装 scipy 时退化为贪心分组：依次取平均相关性最高的未分组ETF，
+    把与其相关系数不低于 1 - threshold 的ETF归为同一簇
+    """
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    dist = 1 - np.where(np.isfinite(values), values, 0.0)
+    np.fill_diagonal(dist, 0.0)
+    dist = np.clip((dist + dist.T) / 2, 0, 2)
+    if n < 2:
+        return np.arange(n), np.ones(n, dtype=int)
+    try:
+        from scipy.cluster.hierarchy import linkage, fcluster, leaves_list
+        from scipy.spatial.distance import squareform
+    except ImportError:
+        linkage = None
+
+    if linkage is not None:
+        tree = linkage(squareform(dist, checks=False), method='average')
+        labels = fcluster(tree, t=threshold, criterion='distance')
+        return leaves_list(tree), labels
+
+    labels = np.zeros(n, dtype=int)
+    avg = np.nanmean(np.where(np.isfinite(values), values, np.nan), axis=1)
+    order = []
+    for seed in np.argsort(-np.nan_to_num(avg, nan=-np.inf), kind='stable'):
+        if labels[seed]:
+            continue
+        members = np.flatnonzero((labels == 0) & (dist[seed] <= threshold))
+        members = members[np.argsort(dist[seed, members], kind='stable')]
+        labels[members] = labels.max() + 1
+        order.extend(members)
+    return np.array(order, dtype=int), labels
+
+
+def draw_heatmap(correlation_matrix, save_path, title='ETF相关性矩阵热力图', annotate_max=30, label_max=120, dpi=None):
+    """
+    用一次 imshow 绘制整张矩阵。只在ETF数量不超过 annotate_max 时标注数值，
+    超过 label_max 时不显示坐标轴名称；图幅和分辨率随数量调整
+    """
+    import matplotlib.pyplot as plt
+    import matplotlib.colors as mcolors
+
+    n_rows, n_cols = correlation_matrix.shape
+    n = max(n_rows, n_cols)
+    # 显示名称时按数量放大图幅，否则固定图幅（每个格子仍有数个像素）
+    size = min(max(8.0, n * 0.25), 30.0) if n <= label_max else 14.0
+    if dpi is None:
+        dpi = 300 if n <= annotate_max else 150
+    fig, ax = plt.subplots(figsize=(size * 1.15, size))
+
+    # 创建自定义颜色映射
+    colors = ['#FF6B6B', '#FFE66D', '#4ECDC4', '#45B7D1']
+    cmap = mcolors.LinearSegmentedColormap.from_list('custom_cmap', colors, N=100)
+    im = ax.imshow(np.asarray(correlation_matrix.values, dtype=float), cmap=cmap, aspect='auto',
+                   vmin=-1, vmax=1, interpolation='nearest')
+
+    if n <= label_max:
+        fontsize = 10 if n <= annotate_max else 6
+        ax.set_xticks(range(n_cols))
+        ax.set_xticklabels(correlation_matrix.columns, rotation=45, ha='right', fontsize=fontsize)
+        ax.set_yticks(range(n_rows))
+        ax.set_yticklabels(correlation_matrix.index, fontsize=fontsize)
+    else:
+        ax.set_xticks([])
+        ax.set_yticks([])
+
+    # 在每个格子中添加数值（只在数量较少时）
+    if n <= annotate_max:
+        for i in range(n_rows):
+            for j in range(n_cols):
+                ax.text(j, i, f'{correlation_matrix.iloc[i, j]:.2f}',
+                        ha="center", va="center", color="black", fontsize=9)
+
+    cbar = fig.colorbar(im, ax=ax)
+    cbar.set_label('相关系数', rotation=270, labelpad=20, fontsize=12)
+    ax.set_title(title, fontsize=16, fontweight='bold', pad=20)
+    fig.tight_layout()
+    fig.savefig(save_path, dpi=dpi, bbox_inches='tight', facecolor='white')
+    plt.close(fig)
+    print(f"热力图已保存为: {save_path}")
+
 
 # 高级版本：包含热力图功能（需要matplotlib）
-def get_matrix_with_heatmap(etf_price_history_df, etf_name_list_df, sort_by_correlation=True, save_dir=None):
+def get_matrix_with_heatmap(etf_price_history_df, etf_name_list_df, sort_by_correlation=True, save_dir=None,
+                            cluster=None, cluster_threshold=0.3, annotate_max=30,
+                            per_cluster=False, tile_size=None):
     """
     计算并打印ETF之间的相关性矩阵，并绘制热力图（需要安装matplotlib）
     
@@ -111,14 +523,17 @@ def get_matrix_with_heatmap(etf_price_history_df, etf_name_list_df, sort_by_corr
     etf_name_list_df: DataFrame，包含ETF代码和名称的对应关系
     sort_by_correlation: bool，是否按相关性强度排序ETF
     save_dir: str，热力图保存目录（默认为当前工作目录）
+    cluster: bool，按层次聚类重排矩阵，默认在ETF数量超过 annotate_max 时启用
+    cluster_threshold: float，聚类的相关性距离阈值（1 - 相关系数）
+    annotate_max: int，ETF数量不超过该值时在格子中标注数值
+    per_cluster: bool，另外为每个成员多于1只的簇单独绘制子热力图
+    tile_size: int，另外把矩阵按 tile_size × tile_size 切块分别绘制
     
     返回:
     correlation_matrix: DataFrame，ETF相关性矩阵
     """
     try:
         import matplotlib.pyplot as plt
-        import matplotlib.colors as mcolors
-        from matplotlib import rcParams
         
         # 设置中文字体支持
         plt.rcParams['font.sans-serif'] = ['WenQuanYi Zen Hei', 'SimHei', 'DejaVu Sans']
@@ -145,43 +560,39 @@ def get_matrix_with_heatmap(etf_price_history_df, etf_name_list_df, sort_by_corr
     # 设置保存路径
     save_path = os.path.join(save_dir, 'correlation_heatmap.png')
     
-    # 绘制热力图
-    plt.figure(figsize=(14, 12))
-    
-    # 创建自定义颜色映射
-    colors = ['#FF6B6B', '#FFE66D', '#4ECDC4', '#45B7D1']
-    n_bins = 100
-    cmap = mcolors.LinearSegmentedColormap.from_list('custom_cmap', colors, N=n_bins)
+    # 按层次聚类重排，使高相关的ETF聚在对角线附近
+    n = len(correlation_matrix)
+    if cluster is None:
+        cluster = n > annotate_max
+    labels = None
+    plot_matrix = correlation_matrix
+    if cluster and n > 1:
+        order, labels = cluster_correlation(correlation_matrix.values, cluster_threshold)
+        plot_matrix = correlation_matrix.iloc[order, order]
+        labels = labels[order]
+        print(f"层次聚类：{n}只ETF分为{len(np.unique(labels))}簇")
     
     # 绘制热力图
-    im = plt.imshow(correlation_matrix.values, cmap=cmap, aspect='auto', vmin=-1, vmax=1)
-    
-    # 设置坐标轴标签
-    plt.xticks(range(len(correlation_matrix.columns)), correlation_matrix.columns, 
-               rotation=45, ha='right', fontsize=10)
-    plt.yticks(range(len(correlation_matrix.index)), correlation_matrix.index, 
-               fontsize=10)
-    
-    # 在每个格子中添加数值
-    for i in range(len(correlation_matrix.index)):
-        for j in range(len(correlation_matrix.columns)):
-            text = plt.text(j, i, f'{correlation_matrix.iloc[i, j]:.2f}',
-                           ha="center", va="center", color="black", fontsize=9)
-    
-    # 添加颜色条
-    cbar = plt.colorbar(im)
-    cbar.set_label('相关系数', rotation=270, labelpad=20, fontsize=12)
-    
-    # 设置标题
-    plt.title('ETF相关性矩阵热力图', fontsize=16, fontweight='bold', pad=20)
-    
-    # 调整布局
-    plt.tight_layout()
-    
-    # 保存图片
-    plt.savefig(save_path, dpi=300, bbox_inches='tight', facecolor='white')
-    plt.close()
-    print(f"热力图已保存为: {save_path}")
+    draw_heatmap(plot_matrix, save_path, annotate_max=annotate_max)
+    
+    # 每个簇单独绘制子热力图
+    if per_cluster and labels is not None:
+        for label in np.unique(labels):
+            members = np.flatnonzero(labels == label)
+            if len(members) < 2:
+                continue
+            sub = plot_matrix.iloc[members, members]
+            draw_heatmap(sub, os.path.join(save_dir, f'correlation_heatmap_cluster{label}.png'),
+                         title=f'簇{label}相关性热力图（{len(members)}只）', annotate_max=annotate_max)
+    
+    # 按块切分绘制，便于查看大矩阵的局部
+    if tile_size:
+        for i0 in range(0, n, tile_size):
+            for j0 in range(i0, n, tile_size):
+                tile = plot_matrix.iloc[i0:i0 + tile_size, j0:j0 + tile_size]
+                draw_heatmap(tile, os.path.join(save_dir, f'correlation_heatmap_tile_{i0}_{j0}.png'),
+                             title=f'相关性热力图 [{i0}:{i0 + len(tile)}, {j0}:{j0 + tile.shape[1]}]',
+                             annotate_max=annotate_max)
     
     return correlation_matrix
 
@@ -226,7 +637,19 @@ if __name__ == "__main__":
     correlation_matrix = get_matrix(etf_price_history_df, etf_name_list_df, sort_by_correlation=True)
     
     # 打印相关性最高的ETF对
-    print_top_correlations(correlation_matrix, top_n=10)
+    print_top_correlations(correlation_matrix, top_n=10, show_least=True)
+
+    # 滚动60日相关性：逐日回放后保存到缓存目录，之后载入即可按日继续 update
+    print("\n=== 滚动60日相关性（最新交易日） ===")
+    price_wide = etf_price_history_df.pivot_table(index='date', columns='code', values='close').sort_index()
+    tracker = RollingCorrelation.from_price_wide(price_wide, window=60)
+    cache_dir = os.path.join('.', 'test', 'cache')
+    os.makedirs(cache_dir, exist_ok=True)
+    tracker.save(os.path.join(cache_dir, 'rolling_correlation.npz'))
+    code_to_name = dict(zip(etf_name_list_df['ts_code'], etf_name_list_df['name']))
+    print(f"日期: {tracker.snapshot_dates[-1].date()}")
+    for i, (code1, code2, corr) in enumerate(tracker.pairs()[:10], 1):
+        print(f"{i:2d}. {code_to_name.get(code1, code1):<10} vs {code_to_name.get(code2, code2):<10} : {corr:.4f}")
     
     # 尝试调用高级版本（带热力图）
     print("\n=== 高级版本（带热力图） ===")
@@ -0,0 +1,218 @@
+"""
+策略热点路径性能监控（可选启用）
+
+为 handle_data、run_daily 定时任务和平台数据接口（get_history、get_price、
+get_snapshot、get_positions、下单等）提供计时装饰器和上下文管理器。
+调用次数和耗时直方图只在内存中累加，每次记录只有一次 perf_counter 和
+几次整数运算；未启用时装饰器只多一次布尔判断。
+在 after_trading_end 中调用 dump_summary(log) 输出当日汇总并清零。
+
+是否启用不写在策略代码里：设置环境变量 STRATEGY_PERF=1，或在研究目录放一个
+名为 perf_enable 的空文件（PTrade 上传即可开启，删除即关闭），见 configure。
+
+未启用时不包装平台接口，装饰器和 timer 只多一次布尔判断，因此策略可以直接导入本模块。
+
+用法（策略文件中，需将 策略性能监控.py 上传至研究目录）：
+    import 策略性能监控 as perf
+
+    def initialize(context):
+        perf.configure(globals(), flag_dir=get_research_path(), logger=log)
+        run_daily(context, exec_strategy, time='09:31')
+
+    @perf.timed('exec_strategy', slowest=5)
+    def exec_strategy(context):
+        ...
+
+    @perf.timed('handle_data', slowest=5)
+    def handle_data(context, data):
+        with perf.timer('calculate_scores'):
+            ...
+
+    def after_trading_end(context, data):
+        perf.dump_summary(log)
+"""
+
+import builtins
+import functools
+import heapq
+import os
+import time
+
+# 开关：环境变量，或研究目录下的标记文件
+ENV_FLAG = 'STRATEGY_PERF'
+FLAG_FILE = 'perf_enable'
+
+# 默认计时的平台数据/下单接口
+DEFAULT_APIS = [
+    'get_history', 'get_price', 'get_snapshot', 'get_positions', 'get_position',
+    'order', 'order_value', 'order_target', 'order_target_value',
+]
+
+# 直方图按 2 的幂次分桶（微秒）：第 k 桶覆盖 [2^(k-1), 2^k) 微秒，最后一桶收纳更慢的调用
+HIST_BUCKETS = 26
+
+
+class _Stat(object):
+    __slots__ = ('calls', 'total', 'max', 'hist', 'slowest')
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.hist = [0] * HIST_BUCKETS
+        self.slowest = []  # 小顶堆：(耗时, 标签)
+
+    def add(self, elapsed, label=None, keep=0):
+        self.calls += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+        bucket = int(elapsed * 1e6).bit_length()
+        self.hist[bucket if bucket < HIST_BUCKETS else HIST_BUCKETS - 1] += 1
+        if keep:
+            if len(self.slowest) < keep:
+                heapq.heappush(self.slowest, (elapsed, label))
+            elif elapsed > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, (elapsed, label))
+
+    def percentile(self, q):
+        """由直方图估算分位数，返回所在桶的上界（秒）"""
+        target = self.calls * q / 100.0
+        seen = 0
+        for bucket, count in enumerate(self.hist):
+            seen += count
+            if count and seen >= target:
+                return (1 << bucket) / 1e6
+        return self.max
+
+
+class PerfMonitor(object):
+    """按名称汇总调用次数、总耗时、最大耗时、耗时直方图和最慢的若干次调用"""
+
+    def __init__(self):
+        self.enabled = False
+        self.stats = {}
+
+    def record(self, name, elapsed, label=None, keep=0):
+        stat = self.stats.get(name)
+        if stat is None:
+            stat = self.stats[name] = _Stat()
+        stat.add(elapsed, label, keep)
+
+    def reset(self):
+        self.stats = {}
+
+    def summary_lines(self):
+        lines = []
+        for name, stat in sorted(self.stats.items(), key=lambda x: -x[1].total):
+            lines.append("%s calls=%d total=%.1fms mean=%.3fms p50<%.3fms p99<%.3fms max=%.3fms" % (
+                name, stat.calls, stat.total * 1000, stat.total * 1000 / stat.calls,
+                stat.percentile(50) * 1000, stat.percentile(99) * 1000, stat.max * 1000))
+            for elapsed, label in sorted(stat.slowest, reverse=True):
+                lines.append("    慢调用 %s %.3fms" % (label, elapsed * 1000))
+        return lines
+
+
+monitor = PerfMonitor()
+
+
+def enable():
+    monitor.enabled = True
+
+
+def disable():
+    monitor.enabled = False
+
+
+def timed(name, slowest=0):
+    """
+    计时装饰器。slowest>0 时保留最慢的若干次调用，
+    若第一个参数是 context 则用 context.current_dt 作为标签。
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not monitor.enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                label = getattr(args[0], 'current_dt', None) if slowest and args else None
+                monitor.record(name, elapsed, label, slowest)
+        return wrapper
+    return decorator
+
+
+class timer(object):
+    """计时上下文管理器：with timer('calculate_scores'): ..."""
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        if monitor.enabled:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.start is not None:
+            monitor.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def requested(flag_dir=None):
+    """环境变量 STRATEGY_PERF 为 1/true/on，或 flag_dir 下存在 perf_enable 文件时返回 True"""
+    value = os.environ.get(ENV_FLAG, '').strip().lower()
+    if value:
+        return value in ('1', 'true', 'on', 'yes')
+    return bool(flag_dir) and os.path.exists(os.path.join(flag_dir, FLAG_FILE))
+
+
+def instrument_api(namespace, names, logger=None):
+    """
+    用计时装饰器替换 namespace（通常是策略的 globals()）中的平台接口，重复调用不会重复包装。
+    namespace 中没有的名称再到 builtins 中查找（平台以内置名称注入接口时），
+    包装后写入 namespace，使策略中的调用优先命中包装函数；都找不到时输出警告。
+    返回实际包装的名称列表。
+    """
+    wrapped_names = []
+    for name in names:
+        func = namespace.get(name)
+        if func is None:
+            func = getattr(builtins, name, None)
+        if func is None:
+            if logger is not None:
+                logger.warning("性能监控：未找到接口 %s，不计时" % name)
+            continue
+        if getattr(func, '_perf_wrapped', False):
+            continue
+        wrapped = timed(name)(func)
+        wrapped._perf_wrapped = True
+        namespace[name] = wrapped
+        wrapped_names.append(name)
+    return wrapped_names
+
+
+def configure(namespace, names=None, flag_dir=None, logger=None):
+    """按 requested 的结果启用监控并包装接口（names 默认为 DEFAULT_APIS），返回是否启用"""
+    if not requested(flag_dir):
+        return False
+    enable()
+    instrument_api(namespace, DEFAULT_APIS if names is None else names, logger)
+    if logger is not None:
+        logger.info("性能监控已启用")
+    return True
+
+
+def dump_summary(logger, title="当日性能汇总"):
+    """输出当日汇总（按总耗时降序）并清零，供 after_trading_end 调用"""
+    if not monitor.stats:
+        return
+    logger.info("========== %s ==========" % title)
+    for line in monitor.summary_lines():
+        logger.info(line)
+    monitor.reset()
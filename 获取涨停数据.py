@@ -136,19 +136,13 @@ if __name__ == "__main__":
     # print(limit_up_csv_path)
     # save_limit_up_data(year)
 
-    # 读取 目录./test/data/ 下面文件名以limit_up 开头的csv 文件到一个dataframe中
-    # csv 文件的第一列是日期，索引是默认索引
+    # 读取 目录./test/data/ 下面文件名以limit_up 开头的csv 文件（合并后缓存到 ./test/cache），计算每日涨停统计
+    from 涨停数据分析 import LimitUpStore, LimitUpAnalytics
 
-    import glob
-    all_files = glob.glob("./test/data/limit_up_*.csv")
-    df_list = []
-    for file in all_files:
-        df = pd.read_csv(file, index_col=0)
-        df_list.append(df)
-    combined_df = pd.concat(df_list)
-    print(f"合并后的数据总记录数: {len(combined_df)}")
-    print(combined_df.index)
-    print(combined_df.head())
-    print(combined_df.tail())
+    store = LimitUpStore.load("./test/data")
+    analytics = LimitUpAnalytics(store)
+    print(f"合并后的数据总记录数: {len(store)}")
+    print(analytics.breadth().head())
+    print(analytics.breadth().tail())
 
     